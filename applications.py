@@ -1,71 +1,136 @@
+import multiprocessing
 import os
-from tqdm import tqdm
-import mtldp.utils as mtlutils
-import mtldp.mtltrajs as mtltrajs
-import mtlimg.img_classes as img
+
+import numpy as np
+import pandas as pd
+
+import cores.utils as mtlutils
 
 timezone = "US/Eastern"
 output_folder = "peachtree"
+_image_worker_context = None
 
 
 # load data from either traffic matrices or trajectory points
-def generate_road_img_dict(network, overall_trajs_dict, start_tod, end_tod,
-                           temporal_interval, distance_interval, map_layer="links", output_file=None):
+def generate_road_img_dict(network, points_df, start_tod, end_tod,
+                           temporal_interval, distance_interval, map_layer="links", output_file=None, processes=1):
     """
+    Traffic images of all the roads of the layer, all the roads are built in one pass and the dates one by one
+    (see :func:`cores.utils.iter_traffic_images`)
 
     :param output_file:
     :param network:
-    :param overall_trajs_dict:
+    :param points_df: `pandas.DataFrame` or `cores.utils.TrajectoryTable` of the matched points
     :param start_tod:
     :param end_tod:
-    :param temporal_interval:
-    :param distance_interval:
-    :param map_layer:
-    :return: {date: RoadImageDict}
+    :param temporal_interval: second
+    :param distance_interval: meter
+    :param map_layer: "links" or "movements"
+    :param processes: number of processes, the dates are built concurrently if larger than 1 (None for the
+        number of CPUs), each worker writes the output file of its date
+    :return: {date: `cores.utils.TrafficImage`}
     """
     output_dict = {}
     groupby_kwd = "link_id" if map_layer == "links" else "movement_id"
-    points_df = overall_trajs_dict.get_points_df()
-    points_df = mtlutils.df_add_date_time_and_tod(points_df, attr="timestamp", timezone_name=timezone)
-    date_trajs_df = dict(tuple(points_df.groupby(["date"])))
-    for date, daily_trajs_df in date_trajs_df.items():
+    points_df = points_df if isinstance(points_df, mtlutils.TrajectoryTable) else mtlutils.TrajectoryTable(points_df)
+    road_lengths = _get_road_lengths(network, map_layer, points_df.get_keys(groupby_kwd))
+    time_bins = mtlutils.TimeBins(temporal_interval / 60, start_tod, end_tod)
+    if output_file is not None and not os.path.exists(output_folder):
+        os.mkdir(output_folder)
+    if processes is None or processes > 1:
+        return _generate_road_img_dict_parallel(points_df, road_lengths, time_bins, distance_interval, groupby_kwd,
+                                                output_file is not None, processes)
+
+    # one date in memory at a time if the images are saved
+    for date, daily_overall_img_dict in mtlutils.iter_traffic_images(points_df, road_lengths, time_bins,
+                                                                     distance_interval, road_column=groupby_kwd,
+                                                                     timezone_name=timezone):
         print(f"Processing {date}...")
-        overall_points = mtltrajs.OverallPoints()
-        overall_points.load_data(daily_trajs_df)
-        road_trajs_dict = overall_points.get_trajs_dict(groupby='traj_id',
-                                                        traj_attributes=['link_id', 'movement_id'])
-        road_trajs_dict = road_trajs_dict.groupby(groupby_kwd)
-        daily_overall_img_dict = None
-        for road_id, road_trajs_dict in tqdm(road_trajs_dict.items()):
-            road_segment = network.__dict__[map_layer][road_id]
-            daily_road_img_dict = img.RoadImageDict(start_tod, end_tod, [date], temporal_interval, distance_interval,
-                                                    map_layer, timezone_name=timezone)
-            daily_road_img_dict.init_from_trajs_dict(road_trajs_dict, road_segment)
-            if daily_overall_img_dict is None:
-                daily_overall_img_dict = daily_road_img_dict
-            else:
-                daily_overall_img_dict.extend(daily_road_img_dict, update_speed=False)
-        daily_overall_img_dict.update_speed()
         if output_file is None:
             output_dict[date] = daily_overall_img_dict
         else:
-            if not os.path.exists(output_folder):
-                os.mkdir(output_folder)
-            daily_overall_img_dict.to_json(os.path.join(output_folder, f"{date}_traffic_image.json"))
+            daily_overall_img_dict.save(os.path.join(output_folder, f"{date}_traffic_image"))
+
+    return output_dict
 
+
+def _generate_road_img_dict_parallel(traj_table, road_lengths, time_bins, distance_interval, road_column,
+                                     save_file, processes):
+    """
+    Date-parallel :func:`generate_road_img_dict`: each task holds the trajectories having points on its date
+    (so the segments across the midnight are kept), the road lengths and bins are shared with the workers once
+    by the pool initializer
+    """
+    date_codes, date_list = pd.factorize(mtlutils.get_local_date(
+        traj_table.df["timestamp"].values.astype(float), timezone), sort=True)
+    offsets = traj_table.traj_offsets
+    traj_first_date = np.minimum.reduceat(date_codes, offsets[:-1]) if len(date_codes) > 0 else date_codes
+    traj_last_date = np.maximum.reduceat(date_codes, offsets[:-1]) if len(date_codes) > 0 else date_codes
+
+    task_list = []
+    for date_code, date in enumerate(date_list):
+        traj_locs = np.flatnonzero((traj_first_date <= date_code) & (traj_last_date >= date_code))
+        row_nums = offsets[traj_locs + 1] - offsets[traj_locs]
+        rows = np.repeat(offsets[traj_locs] - np.cumsum(row_nums) + row_nums, row_nums) + np.arange(row_nums.sum())
+        task_list.append((date, traj_table.df.iloc[rows]))
+
+    processes = min(len(task_list), processes or os.cpu_count() or 1)
+    output_dict = {}
+    with multiprocessing.Pool(max(processes, 1), initializer=_init_image_worker,
+                              initargs=(road_lengths, time_bins, distance_interval, road_column, save_file)) as pool:
+        for date, daily_overall_img_dict in pool.imap(_build_date_image, task_list):
+            if daily_overall_img_dict is not None:
+                output_dict[date] = daily_overall_img_dict
     return output_dict
 
 
-def aggregate_road_image_dicts(road_dict_list):
+def _init_image_worker(road_lengths, time_bins, distance_interval, road_column, save_file):
+    global _image_worker_context
+    _image_worker_context = {"road_lengths": road_lengths, "time_bins": time_bins,
+                             "distance_interval": distance_interval, "road_column": road_column,
+                             "save_file": save_file}
+
+
+def _build_date_image(task):
+    date, date_points = task
+    context = _image_worker_context
+    print(f"Processing {date}...")
+    date_img_dict = mtlutils.build_traffic_images(date_points, context["road_lengths"], context["time_bins"],
+                                                  context["distance_interval"], road_column=context["road_column"],
+                                                  timezone_name=timezone)
+    if date not in date_img_dict:
+        return date, None
+    if context["save_file"]:
+        date_img_dict[date].save(os.path.join(output_folder, f"{date}_traffic_image"))
+        return date, None
+    return date, date_img_dict[date]
+
+
+def aggregate_road_image_dicts(road_dict_list, decay=1.0):
     """
+    Streaming multi-day aggregation, the daily images are folded one by one
+    (see :class:`cores.utils.TrafficImageAggregator`)
 
-    :param road_dict_list: list of RoadImageDict
-    :return: RoadImageDict
+    :param road_dict_list: iterable of `cores.utils.TrafficImage` or the folders of the saved images
+    :param decay: weight of the previous days at each new day, 1.0 for the equal weights
+    :return: `cores.utils.TrafficImageAggregator` with the mean, variance and count of each cell
     """
-    aggregated_road_image_dict = img.assign_weights_to_rimg_dicts(road_dict_list, weights=1.0 / len(road_dict_list))
+    aggregated_road_image_dict = mtlutils.TrafficImageAggregator(decay=decay)
+    for road_image_dict in road_dict_list:
+        aggregated_road_image_dict.add(road_image_dict)
     return aggregated_road_image_dict
 
 
+def _get_road_lengths(network, map_layer, road_id_list):
+    road_lengths = {}
+    for road_id in road_id_list:
+        if road_id not in network.__dict__[map_layer]:
+            continue
+        road_segment = network.__dict__[map_layer][road_id]
+        road_lengths[road_id] = road_segment.length if map_layer == "links" else road_segment.upstream_length
+    return road_lengths
+
+
 def _get_time_columns(start_tod, end_tod, interval):
     start_date_time = mtlutils.tod_to_date_time(start_tod)
     end_date_time = mtlutils.tod_to_date_time(end_tod)
@@ -75,7 +140,6 @@ def _get_time_columns(start_tod, end_tod, interval):
 
 
 if __name__ == "__main__":
-    import pandas as pd
     import mtldp.mtlmap as mtlmap
 
     img_start_tod = 6
@@ -89,15 +153,11 @@ if __name__ == "__main__":
                                             mode=mtlmap.MapMode.ACCURATE)
 
     points = pd.read_csv('peachtree/matched_trajs.csv')
-    points_table = mtltrajs.OverallPoints()
-    points_table.load_data(points)
-    trajs_dict = points_table.get_trajs_dict(groupby='traj_id',
-                                             traj_attributes=['link_id', 'movement_id', 'junction_id'])
-    generate_road_img_dict(network, trajs_dict, img_start_tod, img_end_tod,
+    generate_road_img_dict(network, points, img_start_tod, img_end_tod,
                            time_interval, distance_interval, map_layer=layer)
     # exit()
 
-    # rdimg_dict = img.read_road_image_dict_from_json(os.path.join(output_folder, "1970-01-14_traffic_image.json"))
+    # rdimg_dict = mtlutils.read_traffic_image(os.path.join(output_folder, "1970-01-14_traffic_image"))
     #
     # arterial_info_dict = {"S": ['2390850312', '69488055'],
     #                       "N": ['69488055', '2390850312']}
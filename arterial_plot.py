@@ -2,6 +2,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import cores.mtlmap as mtlmap
+import cores.utils as mtlutils
 
 
 traj_data = pd.read_csv('peachtree/matched_trajs.csv')
@@ -22,15 +23,14 @@ for arterial_dir, arterial in corridor.oneways.items():
     x_min = through_traj['timestamp'].min()
     x_max = through_traj['timestamp'].max()
     through_traj['timestamp'] = through_traj['timestamp'] - x_min
+    through_traj['distance'] = arterial.get_corridor_distance(through_traj['movement_id'].values,
+                                                              through_traj['distance'].values)
     for movement in movement_list:
-        through_traj.loc[through_traj['movement_id'] == movement, 'distance'] += distance_dict[movement]
         plt.hlines(distance_dict[movement], 0, x_max - x_min, colors="r", linestyles="dashed")
-    trajs = through_traj['traj_id'].unique()
-    for traj in trajs:
-        traj = through_traj[through_traj["traj_id"] == traj]
-        time = traj["timestamp"].values
-        distance = traj['distance'].values
-        plt.plot(time, distance, color='gray', alpha=0.4)
+    # all the trajectories are rasterized into one image instead of one line per trajectory
+    raster = mtlutils.render_time_space_diagram(through_traj, time_resolution=1.0, distance_resolution=2.0)
+    plt.imshow(np.log1p(raster.get_density()), extent=raster.extent, origin='lower', aspect='auto',
+               cmap='gray_r', interpolation='nearest')
     ax = plt.gca()
     if arterial_dir == 'S':
         ax.invert_yaxis()
@@ -40,16 +40,18 @@ for arterial_dir, arterial in corridor.oneways.items():
     plt.show()
 
     connections = pd.read_csv('D:/osm-map-parser/output/peachtree/connections.csv')
+    # first connection of each movement
+    connections = connections.drop_duplicates(subset='movement_id').set_index('movement_id')
     laneset_list = []
     print(movement_list)
     upstream_laneset = None
     downstream_laneset = None
     for movement in movement_list:
-        connection = connections[connections['movement_id'] == movement]
-        upstream_laneset = connection['upstream_laneset'].values.tolist()[0]
+        connection = connections.loc[movement]
+        upstream_laneset = connection['upstream_laneset']
         if upstream_laneset != downstream_laneset:
             laneset_list.append(downstream_laneset)
-        downstream_laneset = connection['downstream_laneset'].values.tolist()[0]
+        downstream_laneset = connection['downstream_laneset']
         laneset_list.append(upstream_laneset)
 
     laneset_list.append(downstream_laneset)
@@ -0,0 +1,97 @@
+"""
+Validation of the fixed-time SPaT inference in `spat_cali` on simulated junctions with known timing, from the
+saturated movements to the light ones (long headways), and check that the cycle length is recovered.
+
+Run from the repository root:
+    python -m benchmarks.spat_inference_validation
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from spat_cali import infer_spat
+
+# (case name, cycle length, [(offset, green duration, arrival headway), ...] of the movements)
+CASES = [("near capacity", 90, [(0, 36, 5), (45, 40, 5)]),
+         ("medium", 90, [(0, 36, 8), (45, 40, 8)]),
+         ("light single movement", 90, [(10, 36, 5)]),
+         ("very light single movement", 90, [(10, 36, 15)]),
+         ("light 2:1 movements", 90, [(0, 36, 6), (45, 40, 12)]),
+         ("long cycle light", 150, [(20, 60, 8), (90, 50, 12)])]
+
+
+def simulate_movement(junction_id, movement_id, cycle_length, offset, green_duration, headway, cycle_num=40,
+                      speed=10.0, discharge_headway=2.0, jam_spacing=7.0, seed=0):
+    """
+    Trajectories of one movement at a fixed-time signal, the vehicles arriving in the red (or behind the queue)
+    stop at the end of the queue and cross the stop bar from the green start every ``discharge_headway``
+
+    :return: `pandas.DataFrame` with columns traj_id, timestamp, movement_id, junction_id and distance
+    """
+    rng = np.random.default_rng(seed)
+    start = 1.2e6
+    arrivals = start + np.cumsum(rng.exponential(headway, int(cycle_num * cycle_length / headway)))
+    arrivals = arrivals[arrivals < start + cycle_num * cycle_length]
+    traj_list, departures = [], []
+    for index, arrival in enumerate(arrivals):
+        departure = max(arrival, departures[-1] + discharge_headway) if len(departures) > 0 else arrival
+        phase = np.mod(departure - offset, cycle_length)
+        if phase >= green_duration:
+            departure += cycle_length - phase
+        queue = int(np.sum(np.array(departures[-50:]) > arrival))
+        departures.append(departure)
+
+        timestamps = np.arange(np.floor(arrival) - 200 / speed, departure + 50 / speed, 1.0)
+        if departure - arrival < 1:
+            distance = (timestamps - departure) * speed
+        else:
+            # approach to the end of the queue, wait, then leave from the stop position
+            stop_distance = -(queue * jam_spacing + 1)
+            stop_from = arrival + stop_distance / speed
+            stop_to = departure + stop_distance / speed
+            distance = np.where(timestamps < stop_from, (timestamps - arrival) * speed,
+                                np.where(timestamps <= stop_to, stop_distance, (timestamps - departure) * speed))
+        traj_list.append(pd.DataFrame({"traj_id": f"{movement_id}-{index}", "timestamp": timestamps,
+                                       "movement_id": movement_id, "junction_id": junction_id,
+                                       "distance": distance}))
+    return pd.concat(traj_list, ignore_index=True)
+
+
+def run_validation(cycle_num=40):
+    """
+    Infer the SPaT of each case and compare with the true timing
+
+    :param cycle_num: number of simulated cycles
+    :return: `pandas.DataFrame` of the validation results
+    """
+    result_list = []
+    for case_name, cycle_length, movements in CASES:
+        traj_data = pd.concat([simulate_movement("J", f"{index}_J_{index + 10}", cycle_length, offset, green,
+                                                 headway, cycle_num, seed=index)
+                               for index, (offset, green, headway) in enumerate(movements)], ignore_index=True)
+        start_time = time.time()
+        _, plan = infer_spat(traj_data)
+        elapsed = time.time() - start_time
+        for index, (offset, green, headway) in enumerate(movements):
+            movement_plan = plan[plan["movement_index"] == f"{index}_J_{index + 10}"]
+            inferred_cycle = movement_plan["cycle_length"].values[0] if len(movement_plan) > 0 else np.nan
+            result_list.append({"case": case_name, "movement": index, "headway": headway,
+                                "true_cycle": cycle_length, "cycle": inferred_cycle,
+                                "true_green": green,
+                                "green": movement_plan["green_duration"].values[0] if len(movement_plan) > 0
+                                else np.nan,
+                                "seconds": round(elapsed, 3),
+                                "correct": abs(inferred_cycle - cycle_length) <= 1.0})
+    return pd.DataFrame(result_list)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cycles", type=int, default=40)
+    args = parser.parse_args()
+    results = run_validation(args.cycles)
+    print(results.to_string(index=False))
+    if not results["correct"].all():
+        raise SystemExit("the cycle length is not recovered")
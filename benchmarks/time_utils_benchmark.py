@@ -0,0 +1,159 @@
+"""
+Benchmark of the vectorized DataFrame time conversions in `cores.utils.time_utils` against the
+original row-wise ``df.apply`` implementation (with the scalar functions of the baseline copied here), and
+check that the outputs are identical.
+
+Run from the repository root:
+    python -m benchmarks.time_utils_benchmark --rows 1000000
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+import cores.utils.time_utils as time_utils
+
+
+# the scalar functions of the baseline time_utils, copied as the reference of the original behaviour
+_BASELINE_DATE_TIME_FORMAT = "%H:%M"
+
+
+def _baseline_date_time_to_tod(date_time):
+    split_info = [int(val) for val in date_time.split(':')]
+    tod = split_info[0] + split_info[1] / 60.0
+    if len(split_info) == 3:
+        tod += split_info[2] / 3600.0
+    return tod
+
+
+def _baseline_tod_to_date_time(tod, date_time_format=_BASELINE_DATE_TIME_FORMAT):
+    if tod > 23.999 or tod < 0:
+        print(f"tod {tod} not in [0, 23.999]")
+        return None
+    hour = int(tod)
+    minute = int(np.round(60 * (tod - hour)))
+    second = int(3600 * (tod - hour - minute / 60))
+    if second < 0:
+        minute -= 1
+        second = int(3600 * (tod - hour - minute / 60))
+    time_string = f"1970-01-01 {hour}:{minute}:{second}"
+    ts = pd.Timestamp(time_string)
+    return ts.strftime(date_time_format)
+
+
+def _baseline_seconds_in_day_to_date_time(seconds_in_day, date_time_format=_BASELINE_DATE_TIME_FORMAT):
+    hour = int(seconds_in_day / 3600.0)
+    minute = int((seconds_in_day - hour * 3600) / 60)
+    second = int(seconds_in_day - hour * 3600 - minute * 60)
+    time_string = f"1970-01-01 {hour}:{minute}:{second}"
+    ts = pd.Timestamp(time_string)
+    return ts.strftime(date_time_format)
+
+
+def _baseline_get_seconds_between_tods(tod_1, tod_2):
+    if tod_1 > 23.999 or tod_1 < 0:
+        print(f"tod_1 {tod_1} not in [0, 23.999]")
+        return None
+    if tod_2 > 23.999 or tod_2 < 0:
+        print(f"tod_2 {tod_2} not in [0, 23.999]")
+        return None
+    return (tod_2 - tod_1) * 3600
+
+
+def _baseline_date_time_to_seconds_in_day(date_time):
+    return _baseline_get_seconds_between_tods(_baseline_date_time_to_tod("00:00"),
+                                              _baseline_date_time_to_tod(date_time))
+
+
+def _baseline_get_seconds_in_day_from_timestamp(timestamp, timezone_name):
+    ts = pd.Timestamp(timestamp, tz=timezone_name, unit='s')
+    return _baseline_date_time_to_seconds_in_day(ts.strftime(_BASELINE_DATE_TIME_FORMAT))
+
+
+def _row_wise_tod(df, attr):
+    if attr == "date_time":
+        return df.apply(lambda row: _baseline_date_time_to_tod(row[attr]), axis=1)
+    return df.apply(lambda row: row[attr] / 3600.0, axis=1)
+
+
+def _row_wise_date_time(df, attr):
+    if attr == "tod":
+        return df.apply(lambda row: _baseline_tod_to_date_time(row[attr]), axis=1)
+    return df.apply(lambda row: _baseline_seconds_in_day_to_date_time(row[attr]), axis=1)
+
+
+def _row_wise_seconds_in_day(df, attr, timezone_name):
+    if attr == "timestamp":
+        return df.apply(lambda row: _baseline_get_seconds_in_day_from_timestamp(row[attr], timezone_name), axis=1)
+    elif attr == "date_time":
+        return df.apply(lambda row: _baseline_date_time_to_seconds_in_day(row[attr]), axis=1)
+    return df.apply(lambda row: row[attr] * 3600.0, axis=1)
+
+
+def generate_input(rows, seed=0):
+    """
+    Random input for all the sources
+
+    :param rows: number of rows
+    :param seed: random seed
+    :return: `pandas.DataFrame` with columns timestamp, tod, seconds_in_day, date_time
+    """
+    rng = np.random.default_rng(seed)
+    timestamp = rng.uniform(1.5e9, 1.6e9, rows)
+    seconds_in_day = np.floor(rng.uniform(0, 86399, rows))
+    # whole minutes, the row-wise tod_to_date_time raises if the minute is rounded to 60
+    tod = np.floor(rng.uniform(0, 1439, rows)) / 60
+    minute_in_day = pd.Series(np.floor(seconds_in_day / 60).astype(int))
+    date_time = minute_in_day.map(lambda val: f"{val // 60:02d}:{val % 60:02d}")
+    return pd.DataFrame({"timestamp": timestamp, "tod": tod, "seconds_in_day": seconds_in_day,
+                         "date_time": date_time})
+
+
+def run_benchmark(rows, timezone_name="US/Eastern"):
+    """
+    Time each source/target combination and check the outputs
+
+    :param rows: number of rows
+    :param timezone_name: timezone of the timestamp source
+    :return: `pandas.DataFrame` of the benchmark results
+    """
+    df = generate_input(rows)
+    cases = [("tod", "date_time", lambda: _row_wise_tod(df, "date_time"),
+              lambda: time_utils.df_add_tod(df.copy(), attr="date_time")["tod"]),
+             ("tod", "seconds_in_day", lambda: _row_wise_tod(df, "seconds_in_day"),
+              lambda: time_utils.df_add_tod(df.copy(), attr="seconds_in_day")["tod"]),
+             ("date_time", "tod", lambda: _row_wise_date_time(df, "tod"),
+              lambda: time_utils.df_add_date_time(df.copy(), attr="tod")["date_time"]),
+             ("date_time", "seconds_in_day", lambda: _row_wise_date_time(df, "seconds_in_day"),
+              lambda: time_utils.df_add_date_time(df.copy(), attr="seconds_in_day")["date_time"]),
+             ("seconds_in_day", "timestamp", lambda: _row_wise_seconds_in_day(df, "timestamp", timezone_name),
+              lambda: time_utils.df_add_seconds_in_day(df.copy(), attr="timestamp",
+                                                       timezone_name=timezone_name)["seconds_in_day"]),
+             ("seconds_in_day", "date_time", lambda: _row_wise_seconds_in_day(df, "date_time", timezone_name),
+              lambda: time_utils.df_add_seconds_in_day(df.copy(), attr="date_time")["seconds_in_day"]),
+             ("seconds_in_day", "tod", lambda: _row_wise_seconds_in_day(df, "tod", timezone_name),
+              lambda: time_utils.df_add_seconds_in_day(df.copy(), attr="tod")["seconds_in_day"])]
+
+    results = []
+    for target, source, row_wise, vectorized in cases:
+        start_time = time.time()
+        expected = row_wise()
+        row_wise_time = time.time() - start_time
+        start_time = time.time()
+        output = vectorized()
+        vectorized_time = time.time() - start_time
+        identical = pd.Series(np.asarray(expected, dtype=object)).equals(pd.Series(np.asarray(output, dtype=object)))
+        results.append([source, target, row_wise_time, vectorized_time, row_wise_time / vectorized_time, identical])
+        print(f"{source} -> {target}: row-wise {row_wise_time:.2f}s, vectorized {vectorized_time:.3f}s, "
+              f"identical: {identical}")
+    return pd.DataFrame(results, columns=["source", "target", "row_wise_sec", "vectorized_sec",
+                                          "speedup", "identical"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--timezone", type=str, default="US/Eastern")
+    args = parser.parse_args()
+    run_benchmark(args.rows, args.timezone)
@@ -0,0 +1,389 @@
+import hashlib
+import inspect
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import uuid
+
+import pandas as pd
+
+from link_cali import calibrate_lanesets
+from net_cali import get_laneset_connection, get_laneset_demand
+from spat_cali import get_laneset_spat, infer_spat
+from turning_ratio import get_turning_and_demand
+
+CACHE_MANIFEST_FILE = "manifest.json"
+FILE_HASH_FILE = "file_hashes.json"
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+class PipelineStep(object):
+    """
+    Step of :class:`CalibrationPipeline`
+
+    The function is called with the input tables (read from the csv of the input artifacts) as keyword arguments
+    together with the parameters, and returns one `pandas.DataFrame` per output artifact (a tuple if more than
+    one). The function should be defined at the module level so it can be sent to the worker processes.
+
+    **Main Attributes**
+        - ``.name``: str
+        - ``.func``: callable
+        - ``.inputs``: {argument name: artifact name}
+        - ``.outputs``: list of the output artifact names
+        - ``.params``: dict of the other keyword arguments (json serializable)
+        - ``.version``: bump it to invalidate the cache without any change of the code or the inputs
+    """
+
+    def __init__(self, name, func, inputs, outputs, params=None, version=0):
+        self.name = name
+        self.func = func
+        self.inputs = dict(inputs)
+        self.outputs = list(outputs)
+        self.params = {} if params is None else dict(params)
+        self.version = version
+
+    def get_key(self, input_hashes):
+        """
+        Content hash of the step: its name, version, parameters, the source of the repo modules its function
+        depends on (see :func:`get_module_dependencies`) and the content hash of each input artifact
+
+        :param input_hashes: {artifact name: content hash}
+        :return: str
+        """
+        code_hashes = {module_name: _hash_file(sys.modules[module_name].__file__)
+                       for module_name in sorted(get_module_dependencies(self.func.__module__))}
+        content = {"name": self.name, "version": self.version, "outputs": self.outputs,
+                   "func": f"{self.func.__module__}.{self.func.__qualname__}",
+                   "code": code_hashes,
+                   "params": self.params,
+                   "inputs": {argument: input_hashes[artifact] for argument, artifact in sorted(self.inputs.items())}}
+        return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class CalibrationPipeline(object):
+    """
+    DAG of the calibration steps with the intermediate csv cached by content hash
+
+    Each step is cached in ``{cache_folder}/{step key}/`` (see :meth:`PipelineStep.get_key`), the key of a step
+    depends on the content of its inputs rather than their path or time, so a change of one input only recomputes
+    the steps downstream of it, and a recomputed step with the same output stops the propagation. The steps
+    whose inputs are ready run concurrently if ``processes`` is larger than 1.
+
+    **Main Attributes**
+        - ``.files``: {artifact name: path} of the external inputs
+        - ``.steps``: {step name: :class:`PipelineStep`}
+        - ``.artifact_hashes``: {artifact name: content hash} of the last run
+        - ``.artifact_paths``: {artifact name: path} of the last run
+        - ``.step_keys``: {step name: cache key} of the last run
+    """
+
+    def __init__(self, cache_folder=".calibration_cache", processes=1):
+        """
+
+        :param cache_folder: str
+        :param processes: number of processes, None for the number of CPUs
+        """
+        self.cache_folder = cache_folder
+        self.processes = processes
+        self.files = {}
+        self.steps = {}
+        self.artifact_hashes = {}
+        self.artifact_paths = {}
+        self.step_keys = {}
+
+    def add_file(self, artifact, path):
+        """
+        External input csv
+
+        :param artifact: artifact name
+        :param path: str
+        :return: None
+        """
+        self.files[artifact] = path
+
+    def add_step(self, name, func, inputs, outputs, params=None, version=0):
+        """
+        Add a step, see :class:`PipelineStep`
+
+        :return: :class:`PipelineStep`
+        """
+        if name in self.steps:
+            raise ValueError(f"duplicated step {name}")
+        producers = self.get_producers()
+        for artifact in outputs:
+            if artifact in producers or artifact in self.files:
+                raise ValueError(f"artifact {artifact} is produced twice")
+        step = PipelineStep(name, func, inputs, outputs, params, version)
+        self.steps[name] = step
+        return step
+
+    def get_producers(self):
+        """
+        :return: {artifact name: step name}
+        """
+        return {artifact: step.name for step in self.steps.values() for artifact in step.outputs}
+
+    def get_order(self, targets=None):
+        """
+        Topological order of the steps needed by the target artifacts
+
+        :param targets: list of the artifact names, None for all the steps
+        :return: list of the step names
+        """
+        producers = self.get_producers()
+        if targets is None:
+            needed = list(self.steps.keys())
+        else:
+            needed = []
+            for artifact in targets:
+                if artifact not in producers and artifact not in self.files:
+                    raise KeyError(f"unknown artifact {artifact}")
+                if artifact in producers:
+                    needed.append(producers[artifact])
+
+        order, state = [], {}
+        for step_name in needed:
+            stack = [(step_name, False)]
+            while len(stack) > 0:
+                name, expanded = stack.pop()
+                if expanded:
+                    state[name] = "done"
+                    order.append(name)
+                    continue
+                if state.get(name) == "done":
+                    continue
+                if state.get(name) == "visiting":
+                    raise ValueError(f"cycle in the pipeline at step {name}")
+                state[name] = "visiting"
+                stack.append((name, True))
+                for artifact in self.steps[name].inputs.values():
+                    if artifact in producers:
+                        if state.get(producers[artifact]) == "visiting":
+                            raise ValueError(f"cycle in the pipeline at step {producers[artifact]}")
+                        stack.append((producers[artifact], False))
+                    elif artifact not in self.files:
+                        raise KeyError(f"missing input {artifact} of step {name}")
+        return order
+
+    def run(self, targets=None, output_folder=None):
+        """
+        Run the pipeline, the cached steps are skipped
+
+        :param targets: list of the artifact names, None for all the steps
+        :param output_folder: the produced csv are copied to ``{output_folder}/{artifact}.csv`` if given
+        :return: {step name: "cached" or "computed"}
+        """
+        order = self.get_order(targets)
+        producers = self.get_producers()
+        os.makedirs(self.cache_folder, exist_ok=True)
+        self.artifact_paths = dict(self.files)
+        self.artifact_hashes = self._get_file_hashes()
+
+        status, pending, running, work_dirs = {}, list(order), {}, []
+        processes = self.processes or os.cpu_count() or 1
+        pool = multiprocessing.Pool(min(processes, len(order))) if processes > 1 and len(order) > 1 else None
+        try:
+            while len(pending) > 0 or len(running) > 0:
+                ready_list = [name for name in pending
+                              if all(artifact in self.artifact_hashes or artifact not in producers
+                                     for artifact in self.steps[name].inputs.values())]
+                for name in ready_list:
+                    pending.remove(name)
+                    step = self.steps[name]
+                    key = step.get_key(self.artifact_hashes)
+                    self.step_keys[name] = key
+                    cache_dir = os.path.join(self.cache_folder, key)
+                    if os.path.exists(os.path.join(cache_dir, CACHE_MANIFEST_FILE)):
+                        self._collect_step(step, cache_dir)
+                        status[name] = "cached"
+                        continue
+                    work_dir = os.path.join(self.cache_folder, f"tmp-{uuid.uuid4().hex}")
+                    work_dirs.append(work_dir)
+                    task = (step.func, {argument: self.artifact_paths[artifact]
+                                        for argument, artifact in step.inputs.items()},
+                            step.params, step.outputs, work_dir)
+                    print(f"Running {name}...")
+                    if pool is None:
+                        _run_step(task)
+                        self._finish_step(step, work_dir, cache_dir)
+                        status[name] = "computed"
+                    else:
+                        running[name] = (pool.apply_async(_run_step, (task,)), work_dir, cache_dir)
+
+                finished = [name for name, (result, _, _) in running.items() if result.ready()]
+                if len(finished) == 0 and len(running) > 0:
+                    next(iter(running.values()))[0].wait(0.1)
+                for name in finished:
+                    result, work_dir, cache_dir = running.pop(name)
+                    result.get()
+                    self._finish_step(self.steps[name], work_dir, cache_dir)
+                    status[name] = "computed"
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            # the outputs of the failed or interrupted steps
+            for work_dir in work_dirs:
+                if os.path.exists(work_dir):
+                    shutil.rmtree(work_dir, ignore_errors=True)
+
+        if output_folder is not None:
+            os.makedirs(output_folder, exist_ok=True)
+            for name in order:
+                for artifact in self.steps[name].outputs:
+                    shutil.copyfile(self.artifact_paths[artifact], os.path.join(output_folder, f"{artifact}.csv"))
+        return status
+
+    def prune(self):
+        """
+        Remove the cached steps not used by the last run (all the steps if no step has run)
+
+        :return: number of the removed cache folders
+        """
+        keep = set(self.step_keys.values())
+        removed = 0
+        if not os.path.exists(self.cache_folder):
+            return removed
+        for name in os.listdir(self.cache_folder):
+            path = os.path.join(self.cache_folder, name)
+            if os.path.isdir(path) and name not in keep:
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+        return removed
+
+    def _finish_step(self, step, work_dir, cache_dir):
+        manifest = {artifact: _hash_file(os.path.join(work_dir, f"{artifact}.csv")) for artifact in step.outputs}
+        with open(os.path.join(work_dir, CACHE_MANIFEST_FILE), "w") as f:
+            json.dump({"step": step.name, "outputs": manifest}, f, indent=2)
+        if os.path.exists(cache_dir):
+            # written by another run in the meantime
+            shutil.rmtree(cache_dir)
+        os.replace(work_dir, cache_dir)
+        self._collect_step(step, cache_dir)
+
+    def _collect_step(self, step, cache_dir):
+        with open(os.path.join(cache_dir, CACHE_MANIFEST_FILE)) as f:
+            manifest = json.load(f)["outputs"]
+        for artifact in step.outputs:
+            self.artifact_paths[artifact] = os.path.join(cache_dir, f"{artifact}.csv")
+            self.artifact_hashes[artifact] = manifest[artifact]
+
+    def _get_file_hashes(self):
+        """
+        Content hash of the external inputs, memoized by the size and modification time of the files
+        """
+        memo_file = os.path.join(self.cache_folder, FILE_HASH_FILE)
+        memo = {}
+        if os.path.exists(memo_file):
+            with open(memo_file) as f:
+                memo = json.load(f)
+        hashes = {}
+        for artifact, path in self.files.items():
+            stat = os.stat(path)
+            signature = [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+            record = memo.get(signature[0])
+            if record is None or record[:2] != signature[1:]:
+                record = signature[1:] + [_hash_file(path)]
+                memo[signature[0]] = record
+            hashes[artifact] = record[2]
+        with open(memo_file, "w") as f:
+            json.dump(memo, f, indent=2)
+        return hashes
+
+
+def get_module_dependencies(module_name, root=REPO_ROOT):
+    """
+    Repo modules a module depends on (itself included): the modules under ``root`` referenced by its globals,
+    directly or as the module of the imported functions and classes, recursively
+
+    :param module_name: str
+    :param root: root folder of the repo
+    :return: set of the module names
+    """
+    dependencies, stack = set(), [module_name]
+    while len(stack) > 0:
+        name = stack.pop()
+        module = sys.modules.get(name)
+        module_file = getattr(module, "__file__", None)
+        if name in dependencies or module_file is None or \
+                not os.path.abspath(module_file).startswith(root + os.sep):
+            continue
+        dependencies.add(name)
+        for value in vars(module).values():
+            if inspect.ismodule(value):
+                stack.append(value.__name__)
+            elif inspect.isfunction(value) or inspect.isclass(value):
+                stack.append(value.__module__)
+        # the parent packages, e.g. the re-exports of cores.utils
+        if "." in name:
+            stack.append(name.rsplit(".", 1)[0])
+    return dependencies
+
+
+def _run_step(task):
+    func, input_paths, params, outputs, work_dir = task
+    inputs = {argument: pd.read_csv(path) for argument, path in input_paths.items()}
+    results = func(**inputs, **params)
+    if len(outputs) == 1:
+        results = (results,)
+    if len(results) != len(outputs):
+        raise ValueError(f"{func.__qualname__} returns {len(results)} tables for {len(outputs)} outputs")
+    os.makedirs(work_dir, exist_ok=True)
+    for artifact, result in zip(outputs, results):
+        result.to_csv(os.path.join(work_dir, f"{artifact}.csv"), index=None)
+
+
+def _hash_file(path, chunk_size=1 << 20):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _laneset_connection_step(connections, turning):
+    return get_laneset_connection(connections, turning[["movement_id", "volume"]])
+
+
+def build_calibration_pipeline(lanesets_file, connections_file, traj_file, cache_folder=".calibration_cache",
+                               processes=1, period_hours=0.25, time_interval=30, distance_interval=20):
+    """
+    Calibration of the links (:mod:`link_cali`), turning ratio and demand (:mod:`turning_ratio`,
+    :mod:`net_cali`) and SPaT (:mod:`spat_cali`), the three branches only share the input files
+
+    :param lanesets_file: csv of the static lanesets
+    :param connections_file: csv of the static connections
+    :param traj_file: csv of the matched trajectories
+    :param cache_folder: str
+    :param processes: see :class:`CalibrationPipeline`
+    :param period_hours: see :func:`turning_ratio.get_turning_and_demand`
+    :param time_interval: see :func:`link_cali.calibrate_lanesets`
+    :param distance_interval: see :func:`link_cali.calibrate_lanesets`
+    :return: :class:`CalibrationPipeline`
+    """
+    pipeline = CalibrationPipeline(cache_folder, processes)
+    pipeline.add_file("lanesets", lanesets_file)
+    pipeline.add_file("connections", connections_file)
+    pipeline.add_file("trajs", traj_file)
+
+    pipeline.add_step("links", calibrate_lanesets, {"laneset_raw": "lanesets", "traj_data": "trajs"}, ["links"],
+                      {"time_interval": time_interval, "distance_interval": distance_interval})
+    pipeline.add_step("turning", get_turning_and_demand, {"traj_data": "trajs"}, ["turning", "demand"],
+                      {"period_hours": period_hours})
+    pipeline.add_step("laneset_connection", _laneset_connection_step,
+                      {"connections": "connections", "turning": "turning"}, ["laneset_connection"])
+    pipeline.add_step("laneset_demand", get_laneset_demand, {"laneset_info": "lanesets", "demand": "demand"},
+                      ["laneset_demand"])
+    pipeline.add_step("spat", infer_spat, {"traj_data": "trajs"}, ["spat", "signal_plan"])
+    pipeline.add_step("laneset_spat", get_laneset_spat, {"spat_raw": "spat", "connection": "connections"},
+                      ["laneset_spat"])
+    return pipeline
+
+
+if __name__ == "__main__":
+    calibration_pipeline = build_calibration_pipeline('D:/osm-map-parser/output/peachtree/lanesets.csv',
+                                                      'D:/osm-map-parser/output/peachtree/connections.csv',
+                                                      'peachtree/matched_trajs.csv', processes=3)
+    print(calibration_pipeline.run(output_folder="calibration"))
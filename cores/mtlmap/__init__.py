@@ -6,12 +6,15 @@ from .links import Link, get_link_from_dict
 from .segments import Segment
 from .nodes_classes import Node
 from .path import Path
+from .linear_reference import LinearReference
 
 from .static_net import Network
 from .movements import Movement, get_movement_from_dict
 from .build_network import build_network_from_xml
 
 from .arterial import Arterial, OnewayArterial
+from .assignment import AssignmentNetwork, ODMatrix, frank_wolfe, all_or_nothing, relative_gap
+from .path_assignment import PathBasedAssignment
 
 from .map_xml import save_network_to_xml
 from .map_modes import GraphMode, MapMode
@@ -1,4 +1,11 @@
+import numpy as np
+import pandas as pd
+
 from .path import Path
+from ..utils.constants import MPH_TO_METERS_PER_SEC
+
+STOP_SPEED = 2.0  # m/s, a vehicle below this speed is regarded as stopped
+DEFAULT_SPEED_LIMIT = 25 * MPH_TO_METERS_PER_SEC  # m/s, same as the osm ways without "maxspeed"
 
 
 class Arterial(object):
@@ -118,23 +125,149 @@ class OnewayArterial(Path):
         return f"{name} {to_direction}bound"
 
     def get_trip_ts(self, trip):
-        time_ls, distance_ls = [], []
-        return time_ls, distance_ls
+        """
+        Get the time-space points of a single trip along the arterial
 
-    def filter_trip_dict(self, trip_dict):
+        :param trip: `pandas.DataFrame` of the trip points or trajectory object with ``.df``
+        :return: time list, corridor distance list
         """
+        points_df = self.filter_trip_dict(trip)
+        return points_df["timestamp"].tolist(), points_df["corridor_distance"].tolist()
 
-        :param trip_dict:
-        :return:
+    def filter_trip_dict(self, trip_dict, through_only=False):
         """
-        pass
+        Keep the points along the arterial and add the ``"corridor_distance"`` column, sorted by trip and time.
+        A point is along the arterial if its movement is on the arterial, or if the upstream link of its movement
+        is on the arterial and the point has not passed the stop bar (side-street exit).
+
+        :param trip_dict: matched points table with ``traj_id``, ``timestamp``, ``movement_id`` and ``distance``,
+                          or a trips dict object with ``.get_points_df()``
+        :param through_only: True to keep only the trips that traverse the whole arterial
+        :return: `pandas.DataFrame`
+        """
+        points_df = _get_points_df(trip_dict)
+        link_locs, on_path = self.linear_reference.locate_movements(points_df["movement_id"].values)
+        distance = points_df["distance"].values.astype(float)
+        keep = (link_locs >= 0) & (on_path | (distance <= 0))
+
+        points_df = points_df.loc[keep].copy()
+        link_locs = link_locs[keep]
+        points_df["corridor_distance"] = self.linear_reference.link_end_offsets[link_locs] + distance[keep]
+        points_df["corridor_link_index"] = link_locs
+        points_df = points_df.sort_values(["traj_id", "timestamp"], kind="stable")
+        if through_only:
+            trip_types = self.split_side_street(points_df)
+            points_df = points_df[points_df["traj_id"].isin(trip_types["through"])]
+        return points_df
 
     def split_side_street(self, trip_dict):
-        pass
+        """
+        Classify the trips by where they enter and exit the arterial
+
+        :param trip_dict: see :meth:`filter_trip_dict`
+        :return: dict of trip id list, key: "through", "side_entry", "side_exit", "side_both"
+        """
+        performance_df = self.get_trip_performance(trip_dict)
+        side_entry = performance_df["entry_type"].values == "side_street"
+        side_exit = performance_df["exit_type"].values == "side_street"
+        traj_ids = performance_df["traj_id"].values
+        return {"through": traj_ids[~side_entry & ~side_exit].tolist(),
+                "side_entry": traj_ids[side_entry & ~side_exit].tolist(),
+                "side_exit": traj_ids[~side_entry & side_exit].tolist(),
+                "side_both": traj_ids[side_entry & side_exit].tolist()}
+
+    def get_trip_performance(self, trip_dict, free_flow_speed=None, stop_speed=STOP_SPEED):
+        """
+        Compute the performance measures of all the trips along the arterial in one pass
+
+        :param trip_dict: see :meth:`filter_trip_dict`
+        :param free_flow_speed: float, m/s, default None to use the speed limit of each link (the mean speed limit
+            for the links without one, ``DEFAULT_SPEED_LIMIT`` if no link has one)
+        :param stop_speed: float, m/s, threshold of the stopped state
+        :return: `pandas.DataFrame` with one row per trip, columns: ``traj_id``, ``entry_time``, ``exit_time``,
+                 ``entry_distance``, ``exit_distance``, ``travel_distance``, ``travel_time``, ``free_flow_time``,
+                 ``delay``, ``stop_num``, ``entry_type`` and ``exit_type`` ("mainline" or "side_street")
+        """
+        columns = ["traj_id", "entry_time", "exit_time", "entry_distance", "exit_distance", "travel_distance",
+                   "travel_time", "free_flow_time", "delay", "stop_num", "entry_type", "exit_type"]
+        if isinstance(trip_dict, pd.DataFrame) and "corridor_distance" in trip_dict.columns:
+            points_df = trip_dict
+        else:
+            points_df = self.filter_trip_dict(trip_dict)
+        if len(points_df) == 0:
+            return pd.DataFrame(columns=columns)
+
+        traj_codes, traj_ids = pd.factorize(points_df["traj_id"].values)
+        timestamp = points_df["timestamp"].values.astype(float)
+        distance = points_df["corridor_distance"].values.astype(float)
+        link_locs = points_df["corridor_link_index"].values
+        order = np.lexsort((timestamp, traj_codes))
+        traj_codes, timestamp = traj_codes[order], timestamp[order]
+        distance, link_locs = distance[order], link_locs[order]
+
+        point_num = len(order)
+        new_trip = np.ones(point_num, dtype=bool)
+        new_trip[1:] = traj_codes[1:] != traj_codes[:-1]
+        starts = np.flatnonzero(new_trip)
+        ends = np.append(starts[1:], point_num) - 1
+
+        # free-flow travel time, the pace of each step is given by the link of the earlier point
+        if free_flow_speed is None:
+            speed_limits = self.linear_reference.link_speed_limits
+            # the missing speed limits take the mean of the others, or the default if all of them are missing
+            fill_speed = np.nanmean(speed_limits) if np.any(~np.isnan(speed_limits)) else DEFAULT_SPEED_LIMIT
+            pace = 1.0 / np.where(np.isnan(speed_limits), fill_speed, speed_limits)
+            step_pace = pace[link_locs[:-1]]
+        else:
+            step_pace = np.full(point_num - 1, 1.0 / free_flow_speed)
+        step_time = np.maximum(np.diff(distance), 0) * step_pace
+        step_time[new_trip[1:]] = 0
+        free_flow_time = np.bincount(traj_codes[:-1], weights=step_time, minlength=len(starts))
+
+        # a stop starts when the speed drops below the threshold
+        if "speed" in points_df.columns:
+            stopped = points_df["speed"].values.astype(float)[order] < stop_speed
+        else:
+            step_speed = np.diff(distance) / np.maximum(np.diff(timestamp), 1e-3)
+            stopped = np.append(step_speed, np.inf) < stop_speed
+            stopped[ends] = stopped[np.maximum(ends - 1, starts)]
+        stop_start = stopped.copy()
+        stop_start[1:] &= ~stopped[:-1] | new_trip[1:]
+        stop_num = np.bincount(traj_codes, weights=stop_start, minlength=len(starts)).astype(int)
+
+        last_link = len(self.linear_reference.link_index) - 1
+        entry_type = np.where(link_locs[starts] == 0, "mainline", "side_street")
+        exit_type = np.where(link_locs[ends] == last_link, "mainline", "side_street")
+
+        travel_time = timestamp[ends] - timestamp[starts]
+        performance_df = pd.DataFrame({"traj_id": traj_ids[traj_codes[starts]],
+                                       "entry_time": timestamp[starts], "exit_time": timestamp[ends],
+                                       "entry_distance": distance[starts], "exit_distance": distance[ends],
+                                       "travel_distance": distance[ends] - distance[starts],
+                                       "travel_time": travel_time, "free_flow_time": free_flow_time,
+                                       "delay": travel_time - free_flow_time, "stop_num": stop_num,
+                                       "entry_type": entry_type, "exit_type": exit_type})
+        return performance_df
 
     def __str__(self):
         return self.name
 
 
+def _get_points_df(trip_dict):
+    """
+    Get the points table from the input trips
+
+    :param trip_dict: `pandas.DataFrame`, trips dict object with ``.get_points_df()`` or trajectory with ``.df``
+    :return: `pandas.DataFrame`
+    """
+    if isinstance(trip_dict, pd.DataFrame):
+        return trip_dict
+    if hasattr(trip_dict, "get_points_df"):
+        return trip_dict.get_points_df()
+    if hasattr(trip_dict, "df"):
+        return trip_dict.df
+    raise TypeError("Input trips should be a DataFrame or a trajectory object")
+
+
 if __name__ == "__main__":
     pass
@@ -0,0 +1,331 @@
+"""
+Static traffic assignment over the lanesets
+
+The lanesets are packed into arrays so that the link performance function (BPR), the all-or-nothing loading and
+the line search are evaluated for the whole network at once. Each laneset is a vertex of the assignment graph,
+a route is a sequence of lanesets and its cost is the sum of the travel time of the lanesets.
+
+OD matrix input (shared by all the assignment tools): `pandas.DataFrame` with columns
+``["origin", "destination", "demand"]`` or dict ``{(origin, destination): demand}``, where the origin and
+destination are laneset ids and the demand is in veh/hour.
+"""
+import heapq
+import warnings
+
+import numpy as np
+import pandas as pd
+
+try:
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import dijkstra
+except ImportError:
+    csr_matrix = None
+    dijkstra = None
+
+BPR_ALPHA = 0.15
+BPR_BETA = 4
+SATURATION_FLOW = 1800  # veh/hour/lane
+
+
+class AssignmentNetwork(object):
+    """
+    Array representation of the lanesets for traffic assignment
+
+    **Main Attributes**
+        - ``.laneset_list``: list of lanesets, the position is the laneset index
+        - ``.laneset_index``: `pandas.Index` of the laneset ids
+        - ``.free_travel_time``: free-flow travel time of each laneset (sec)
+        - ``.capacity``: capacity of each laneset (veh/hour)
+        - ``.indptr``, ``.indices``: CSR adjacency from a laneset to its downstream lanesets
+    """
+
+    def __init__(self, network):
+        """
+
+        :param network: `cores.mtlmap.Network` with lanesets
+        """
+        self.laneset_list = list(network.lanesets.values())
+        self.laneset_index = pd.Index([str(laneset) for laneset in self.laneset_list])
+        self.free_travel_time = np.array([_get_free_travel_time(laneset) for laneset in self.laneset_list])
+        self.capacity = np.array([_get_capacity(laneset) for laneset in self.laneset_list])
+
+        indptr = [0]
+        indices = []
+        for laneset in self.laneset_list:
+            downstream_ids = [str(val) for val in laneset.downstream_laneset_list]
+            downstream_locs = self.laneset_index.get_indexer(downstream_ids)
+            indices.extend(np.unique(downstream_locs[downstream_locs >= 0]).tolist())
+            indptr.append(len(indices))
+        self.indptr = np.array(indptr, dtype=np.int64)
+        self.indices = np.array(indices, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.laneset_list)
+
+    def travel_time(self, flow):
+        """
+        BPR link performance function
+
+        :param flow: `numpy.ndarray` of laneset flow
+        :return: `numpy.ndarray` of travel time
+        """
+        return self.free_travel_time * (1 + BPR_ALPHA * np.power(flow / self.capacity, BPR_BETA))
+
+    def travel_time_derivative(self, flow):
+        """
+        Derivative of the BPR function w.r.t. the flow
+
+        :param flow: `numpy.ndarray`
+        :return: `numpy.ndarray`
+        """
+        return self.free_travel_time * BPR_ALPHA * BPR_BETA * \
+            np.power(flow / self.capacity, BPR_BETA - 1) / self.capacity
+
+    def objective(self, flow):
+        """
+        Beckmann objective, same as `cores.mtlmap.lanes.LaneSet.compute_cumulative_travel_time`
+
+        :param flow: `numpy.ndarray`
+        :return: float
+        """
+        return float(np.sum(self.free_travel_time * flow + BPR_ALPHA / (BPR_BETA + 1) * self.free_travel_time *
+                            np.power(flow / self.capacity, BPR_BETA + 1) * self.capacity))
+
+    def shortest_path_trees(self, origins, cost):
+        """
+        Shortest path tree from each origin, the cost of a route includes the origin laneset
+
+        :param origins: `numpy.ndarray` of origin laneset index
+        :param cost: `numpy.ndarray` of laneset cost
+        :return: distance and predecessor matrices, shape (len(origins), number of lanesets),
+                 predecessor is -1 for the origin and the unreachable lanesets
+        """
+        origins = np.asarray(origins, dtype=np.int64)
+        if dijkstra is not None:
+            # edge weight is the cost of the downstream laneset
+            graph = csr_matrix((np.maximum(cost[self.indices], 1e-9), self.indices, self.indptr),
+                               shape=(len(self), len(self)))
+            distance, predecessor = dijkstra(graph, directed=True, indices=origins, return_predecessors=True)
+            distance = distance + cost[origins][:, None]
+            predecessor = np.where(predecessor < 0, -1, predecessor)
+            return distance, predecessor
+
+        distance = np.full((len(origins), len(self)), np.inf)
+        predecessor = np.full((len(origins), len(self)), -1, dtype=np.int64)
+        indptr, indices, cost_list = self.indptr.tolist(), self.indices.tolist(), cost.tolist()
+        for row, origin in enumerate(origins.tolist()):
+            distance[row], predecessor[row] = _dijkstra(indptr, indices, cost_list, origin)
+        return distance, predecessor
+
+    def write_back(self, flow):
+        """
+        Write the laneset flow and travel time back to the laneset objects
+
+        :param flow: `numpy.ndarray`
+        :return: None
+        """
+        travel_time = self.travel_time(flow)
+        for idx, laneset in enumerate(self.laneset_list):
+            laneset.laneset_flow = float(flow[idx])
+            laneset.travel_time = float(travel_time[idx])
+
+
+class ODMatrix(object):
+    """
+    OD demand in laneset index, grouped by origin
+
+    **Main Attributes**
+        - ``.origins``: unique origin laneset index
+        - ``.od_origin``, ``.od_destination``, ``.demand``: arrays of the OD pairs
+        - ``.od_origin_row``: row of the origin of each OD pair in ``.origins``
+        - ``.dropped_od_ids``: list of the (origin, destination) ignored (laneset not found or zero demand)
+    """
+
+    def __init__(self, assign_net, od_matrix):
+        """
+
+        :param assign_net: `cores.mtlmap.AssignmentNetwork`
+        :param od_matrix: see the module doc
+        """
+        od_df = _get_od_df(od_matrix)
+        od_df = od_df.groupby(["origin", "destination"], sort=False)["demand"].sum().reset_index()
+        origin_locs = assign_net.laneset_index.get_indexer(od_df["origin"].astype(str))
+        destination_locs = assign_net.laneset_index.get_indexer(od_df["destination"].astype(str))
+        valid = (origin_locs >= 0) & (destination_locs >= 0) & (od_df["demand"].values > 0)
+        self.dropped_od_ids = list(zip(od_df["origin"].astype(str).values[~valid],
+                                       od_df["destination"].astype(str).values[~valid]))
+        if len(self.dropped_od_ids) > 0:
+            warnings.warn(f"{len(self.dropped_od_ids)} OD pairs ignored (laneset not found or zero demand)")
+
+        self.od_origin = origin_locs[valid]
+        self.od_destination = destination_locs[valid]
+        self.demand = od_df["demand"].values[valid].astype(float)
+        self.origins, self.od_origin_row = np.unique(self.od_origin, return_inverse=True)
+        self.od_ids = list(zip(od_df["origin"].astype(str).values[valid],
+                               od_df["destination"].astype(str).values[valid]))
+
+    def __len__(self):
+        return len(self.demand)
+
+
+def all_or_nothing(assign_net, od, cost):
+    """
+    Load all the demand to the shortest paths
+
+    :param assign_net: `cores.mtlmap.AssignmentNetwork`
+    :param od: `cores.mtlmap.ODMatrix`
+    :param cost: `numpy.ndarray` of laneset cost
+    :return: laneset flow, shortest path cost of each OD pair
+    """
+    distance, predecessor = assign_net.shortest_path_trees(od.origins, cost)
+    od_cost = distance[od.od_origin_row, od.od_destination]
+    reachable = np.isfinite(od_cost)
+
+    # demand at the destination of each tree, then pushed to the root level by level
+    tree_flow = np.zeros(distance.shape)
+    np.add.at(tree_flow, (od.od_origin_row[reachable], od.od_destination[reachable]), od.demand[reachable])
+    depth = _get_tree_depth(predecessor)
+    rows = np.arange(len(od.origins))[:, None].repeat(len(assign_net), axis=1)
+    for level in range(int(depth.max()), 0, -1):
+        at_level = depth == level
+        np.add.at(tree_flow, (rows[at_level], predecessor[at_level]), tree_flow[at_level])
+    return tree_flow.sum(axis=0), od_cost
+
+
+def frank_wolfe(network, od_matrix, max_iterations=100, gap_tolerance=1e-4,
+                line_search_steps=30, write_back=True, verbose=False):
+    """
+    User equilibrium by Frank-Wolfe algorithm
+
+    :param network: `cores.mtlmap.Network` or `cores.mtlmap.AssignmentNetwork`
+    :param od_matrix: see the module doc
+    :param max_iterations: int
+    :param gap_tolerance: float, stop when the relative gap is below this value
+    :param line_search_steps: number of bisection steps in the line search
+    :param write_back: True to write the flow to the lanesets
+    :param verbose: True to print the relative gap of each iteration
+    :return: `pandas.DataFrame` with columns ``["laneset_id", "flow", "travel_time"]``, list of relative gap
+    """
+    assign_net = network if isinstance(network, AssignmentNetwork) else AssignmentNetwork(network)
+    od = ODMatrix(assign_net, od_matrix)
+
+    flow, _ = all_or_nothing(assign_net, od, assign_net.free_travel_time)
+    gap_list = []
+    for iteration in range(max_iterations):
+        cost = assign_net.travel_time(flow)
+        target_flow, od_cost = all_or_nothing(assign_net, od, cost)
+        gap = relative_gap(flow, cost, od, od_cost)
+        gap_list.append(gap)
+        if verbose:
+            print(f"Iteration {iteration}: relative gap {gap:.6f}")
+        if gap < gap_tolerance:
+            break
+        step = _line_search(assign_net, flow, target_flow, line_search_steps)
+        flow = flow + step * (target_flow - flow)
+
+    if write_back:
+        assign_net.write_back(flow)
+    flow_df = pd.DataFrame({"laneset_id": assign_net.laneset_index.values, "flow": flow,
+                            "travel_time": assign_net.travel_time(flow)})
+    return flow_df, gap_list
+
+
+def relative_gap(flow, cost, od, od_cost):
+    """
+    Relative gap: (total system travel time - shortest path travel time) / total system travel time
+
+    :param flow: `numpy.ndarray` of laneset flow
+    :param cost: `numpy.ndarray` of laneset cost under the flow
+    :param od: `cores.mtlmap.ODMatrix`
+    :param od_cost: shortest path cost of each OD pair
+    :return: float
+    """
+    total_time = float(np.dot(flow, cost))
+    reachable = np.isfinite(od_cost)
+    shortest_time = float(np.dot(od.demand[reachable], od_cost[reachable]))
+    if total_time <= 0:
+        return 0.0
+    return (total_time - shortest_time) / total_time
+
+
+def _line_search(assign_net, flow, target_flow, steps):
+    """
+    Bisection on the derivative of the Beckmann objective along the search direction
+
+    :return: float, step size in [0, 1]
+    """
+    direction = target_flow - flow
+    lower, upper = 0.0, 1.0
+    if np.dot(direction, assign_net.travel_time(target_flow)) <= 0:
+        return 1.0
+    for _ in range(steps):
+        mid = (lower + upper) / 2
+        if np.dot(direction, assign_net.travel_time(flow + mid * direction)) > 0:
+            upper = mid
+        else:
+            lower = mid
+    return (lower + upper) / 2
+
+
+def _get_tree_depth(predecessor):
+    """
+    Depth of each laneset in its shortest path tree, 0 for the root and the unreachable lanesets
+
+    :param predecessor: predecessor matrix
+    :return: `numpy.ndarray` of int
+    """
+    depth = np.where(predecessor >= 0, 1, 0)
+    ancestor = predecessor.copy()
+    rows = np.arange(predecessor.shape[0])[:, None]
+    active = ancestor >= 0
+    while np.any(active):
+        ancestor = np.where(active, predecessor[rows, np.maximum(ancestor, 0)], -1)
+        active = ancestor >= 0
+        depth += active
+    return depth
+
+
+def _dijkstra(indptr, indices, cost, origin):
+    """
+    Pure-python Dijkstra, used when scipy is not installed
+
+    :return: distance array, predecessor array
+    """
+    distance = [float("inf")] * len(cost)
+    predecessor = [-1] * len(cost)
+    distance[origin] = cost[origin]
+    visited = [False] * len(cost)
+    heap = [(distance[origin], origin)]
+    while heap:
+        current_distance, node = heapq.heappop(heap)
+        if visited[node]:
+            continue
+        visited[node] = True
+        for downstream in indices[indptr[node]:indptr[node + 1]]:
+            new_distance = current_distance + cost[downstream]
+            if new_distance < distance[downstream]:
+                distance[downstream] = new_distance
+                predecessor[downstream] = node
+                heapq.heappush(heap, (new_distance, downstream))
+    return np.array(distance), np.array(predecessor, dtype=np.int64)
+
+
+def _get_free_travel_time(laneset):
+    free_travel_time = getattr(laneset, "free_travel_time", None)
+    if free_travel_time is None:
+        free_travel_time = laneset.length / laneset.speed_limit
+    return float(free_travel_time)
+
+
+def _get_capacity(laneset):
+    capacity = getattr(laneset, "capacity", None)
+    if capacity is None:
+        capacity = laneset.lane_number * SATURATION_FLOW
+    return float(capacity)
+
+
+def _get_od_df(od_matrix):
+    if isinstance(od_matrix, pd.DataFrame):
+        return od_matrix[["origin", "destination", "demand"]]
+    od_list = [[origin, destination, demand] for (origin, destination), demand in od_matrix.items()]
+    return pd.DataFrame(od_list, columns=["origin", "destination", "demand"])
@@ -32,6 +32,10 @@ class LaneSet(object):
         self.downstream_laneset_list = []
         self.upstream_laneset_list = []
 
+        # assignment results, see `cores.mtlmap.AssignmentNetwork.write_back`
+        self.laneset_flow = None  # unit: veh / hour
+        self.travel_time = None  # unit: sec
+
     @classmethod
     def init_from_segment(cls, segment, movement_dict,
                           lane_number, insegment_offset):
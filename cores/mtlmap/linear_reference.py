@@ -0,0 +1,188 @@
+"""
+Linear referencing along a path
+
+The corridor distance of a point is measured from the origin node of the path. The local distance follows the
+convention of the matched trajectories: it is the signed distance to the downstream end (stop bar) of the link,
+negative before the stop bar. For a movement, the local distance is measured from the end of its upstream link.
+"""
+
+import numpy as np
+import pandas as pd
+
+EARTH_RADIUS = 6372800  # Earth radius in meters, same as `haversine_distance`
+
+
+class LinearReference(object):
+    """
+    Linear-referencing index of a :class:`cores.mtlmap.Path`
+
+    **Main Attributes**
+        - ``.link_index``: `pandas.Index` of the link ids along the path
+        - ``.link_end_offsets``: cumulative distance at the downstream end of each link
+        - ``.link_start_offsets``: cumulative distance at the upstream end of each link
+        - ``.movement_index``: `pandas.Index` of the movement ids along the path
+        - ``.movement_offsets``: cumulative distance at the end of the upstream link of each movement
+        - ``.link_speed_limits``: speed limit of each link (m/s), ``NaN`` if unknown
+        - ``.length``: total length of the path
+    """
+
+    def __init__(self, path):
+        """
+
+        :param path: `cores.mtlmap.Path`
+        """
+        link_lengths = np.array([link.length for link in path.link_list], dtype=float)
+        self.link_index = pd.Index([str(link) for link in path.link_list])
+        self.link_end_offsets = np.cumsum(link_lengths)
+        self.link_start_offsets = self.link_end_offsets - link_lengths
+        self.length = float(self.link_end_offsets[-1]) if len(link_lengths) > 0 else 0.0
+        self.link_speed_limits = np.array([np.nan if link.speed_limit is None else link.speed_limit
+                                           for link in path.link_list], dtype=float)
+
+        movement_ids = []
+        movement_offsets = []
+        for movement in path.movement_list:
+            link_loc = self.link_index.get_indexer([str(movement.upstream_link)])[0]
+            if link_loc < 0:
+                continue
+            movement_ids.append(str(movement))
+            movement_offsets.append(self.link_end_offsets[link_loc])
+        self.movement_index = pd.Index(movement_ids)
+        self.movement_offsets = np.array(movement_offsets, dtype=float)
+
+        self._build_polyline(path.link_list, link_lengths)
+
+    def get_offsets(self, road_ids, layer="movement"):
+        """
+        Get the corridor offset of each road id, ``NaN`` if the road is not on the path
+
+        :param road_ids: array-like of movement id or link id
+        :param layer: "movement" or "link"
+        :return: `numpy.ndarray` of float
+        """
+        if layer == "movement":
+            index, offsets = self.movement_index, self.movement_offsets
+        elif layer == "link":
+            index, offsets = self.link_index, self.link_end_offsets
+        else:
+            raise ValueError("layer should be either 'movement' or 'link'")
+
+        road_ids = pd.Index(np.asarray(road_ids, dtype=object).astype(str))
+        locations = index.get_indexer(road_ids)
+        output = np.full(len(locations), np.nan)
+        valid = locations >= 0
+        output[valid] = offsets[locations[valid]]
+        return output
+
+    def to_corridor_distance(self, road_ids, local_distance, layer="movement"):
+        """
+        Map (road id, local distance) pairs to the corridor distance in one call
+
+        :param road_ids: array-like of movement id or link id
+        :param local_distance: array-like, signed distance to the stop bar
+        :param layer: "movement" or "link"
+        :return: `numpy.ndarray` of float, ``NaN`` for the road not on the path
+        """
+        return self.get_offsets(road_ids, layer=layer) + np.asarray(local_distance, dtype=float)
+
+    def locate_movements(self, movement_ids):
+        """
+        Locate the upstream link of each movement on the path, the movement id has the format
+        ``{upstream_link_id}_{downstream_node_id}`` so that the side-street turning movements can also be located
+
+        :param movement_ids: array-like of movement id
+        :return: (index of the upstream link on the path, -1 if not on the path;
+                  True if the movement itself is along the path)
+        """
+        codes, uniques = pd.factorize(np.asarray(movement_ids, dtype=object).astype(str))
+        upstream_links = pd.Index([val.rsplit("_", 1)[0] for val in uniques])
+        unique_link_locs = self.link_index.get_indexer(upstream_links)
+        unique_on_path = self.movement_index.get_indexer(uniques) >= 0
+        return unique_link_locs[codes], unique_on_path[codes]
+
+    def project_gps(self, latitude, longitude, max_offset=None, chunk_size=200000):
+        """
+        Project the GPS points (e.g., the unmatched points) onto the path geometry
+
+        :param latitude: array-like
+        :param longitude: array-like
+        :param max_offset: float, meters, points further than this from the path get ``NaN``
+        :param chunk_size: number of (point, segment) pairs evaluated at once
+        :return: (corridor distance, lateral offset in meters), both `numpy.ndarray`
+        """
+        x, y = self._to_plane(np.asarray(latitude, dtype=float), np.asarray(longitude, dtype=float))
+        distance = np.full(len(x), np.nan)
+        offset = np.full(len(x), np.nan)
+        segment_num = len(self._seg_x)
+        if segment_num == 0:
+            return distance, offset
+
+        rows = max(1, chunk_size // segment_num)
+        for start in range(0, len(x), rows):
+            px = x[start:start + rows, None] - self._seg_x[None, :]
+            py = y[start:start + rows, None] - self._seg_y[None, :]
+            ratio = (px * self._seg_dx + py * self._seg_dy) / self._seg_len2
+            ratio = np.clip(ratio, 0, 1)
+            square_dist = (px - ratio * self._seg_dx) ** 2 + (py - ratio * self._seg_dy) ** 2
+            best = np.argmin(square_dist, axis=1)
+            local_rows = np.arange(len(best))
+            distance[start:start + rows] = self._seg_start[best] + ratio[local_rows, best] * self._seg_length[best]
+            offset[start:start + rows] = np.sqrt(square_dist[local_rows, best])
+
+        if max_offset is not None:
+            distance[offset > max_offset] = np.nan
+        return distance, offset
+
+    def _build_polyline(self, link_list, link_lengths):
+        """
+        Build the planar polyline, the along-link distance is scaled to the link length so that
+        the projected distance is consistent with the link offsets
+
+        :param link_list: list of `cores.mtlmap.Link`
+        :param link_lengths: `numpy.ndarray`
+        :return: None
+        """
+        lat_list, lon_list = [], []
+        for link in link_list:
+            lat_list.extend(link.geometry.lat)
+            lon_list.extend(link.geometry.lon)
+        self._ref_lat = np.mean(lat_list) if len(lat_list) > 0 else 0.0
+        self._ref_lon = np.mean(lon_list) if len(lon_list) > 0 else 0.0
+
+        seg_x, seg_y, seg_dx, seg_dy, seg_start, seg_length = [], [], [], [], [], []
+        for idx, link in enumerate(link_list):
+            x, y = self._to_plane(np.asarray(link.geometry.lat, dtype=float),
+                                  np.asarray(link.geometry.lon, dtype=float))
+            dx, dy = np.diff(x), np.diff(y)
+            planar_length = np.hypot(dx, dy)
+            valid = planar_length > 1e-6
+            if not np.any(valid):
+                continue
+            scaled_length = planar_length[valid] * link_lengths[idx] / planar_length[valid].sum()
+            seg_x.append(x[:-1][valid])
+            seg_y.append(y[:-1][valid])
+            seg_dx.append(dx[valid])
+            seg_dy.append(dy[valid])
+            seg_start.append(self.link_start_offsets[idx] + np.cumsum(scaled_length) - scaled_length)
+            seg_length.append(scaled_length)
+
+        def _concat(array_list):
+            return np.concatenate(array_list) if len(array_list) > 0 else np.zeros(0)
+
+        self._seg_x, self._seg_y = _concat(seg_x), _concat(seg_y)
+        self._seg_dx, self._seg_dy = _concat(seg_dx), _concat(seg_dy)
+        self._seg_len2 = self._seg_dx ** 2 + self._seg_dy ** 2
+        self._seg_start, self._seg_length = _concat(seg_start), _concat(seg_length)
+
+    def _to_plane(self, latitude, longitude):
+        """
+        Equirectangular projection around the center of the path (meters)
+
+        :param latitude: `numpy.ndarray`
+        :param longitude: `numpy.ndarray`
+        :return: x, y
+        """
+        scale = np.pi / 180 * EARTH_RADIUS
+        x = (longitude - self._ref_lon) * scale * np.cos(np.radians(self._ref_lat))
+        y = (latitude - self._ref_lat) * scale
+        return x, y
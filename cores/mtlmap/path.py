@@ -5,6 +5,7 @@ to be done: path class
 from ..mtlmap.map_modes import GraphMode
 from ..mtlmap.nodes_classes import NodeCategory
 from ..utils.geometry import Geometry
+from .linear_reference import LinearReference
 from .utils import get_movement_list
 
 
@@ -31,6 +32,7 @@ class Path(object):
         self.distance_by_movement = {}
         self.distance_by_link = {}
         self.distance_by_node = {}
+        self.linear_reference = None
 
     def init_from_node_list(self, network, node_id_list):
         if len(node_id_list) == 2:
@@ -112,9 +114,32 @@ class Path(object):
             intersection_list.append(node_id)
         return label_list, distance_list, intersection_list
 
+    def get_corridor_distance(self, road_ids, local_distance, layer="movement"):
+        """
+        Convert the local distance (to the stop bar) of the points into the distance along the path
+
+        :param road_ids: array-like of movement id or link id
+        :param local_distance: array-like of the signed distance to the stop bar
+        :param layer: "movement" or "link"
+        :return: `numpy.ndarray`, ``NaN`` if the road is not on the path
+        """
+        return self.linear_reference.to_corridor_distance(road_ids, local_distance, layer=layer)
+
+    def project_gps_to_distance(self, latitude, longitude, max_offset=None):
+        """
+        Project the GPS points (e.g., unmatched points) to the distance along the path
+
+        :param latitude: array-like
+        :param longitude: array-like
+        :param max_offset: float, meters, points further than this from the path get ``NaN``
+        :return: (corridor distance, lateral offset)
+        """
+        return self.linear_reference.project_gps(latitude, longitude, max_offset=max_offset)
+
     def _general_init(self):
         self._update_distance_dict()
         self.geometry = self._get_geometry()
+        self.linear_reference = LinearReference(self)
 
     def _movement_list_from_link_list(self, link_list):
         """
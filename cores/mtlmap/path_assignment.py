@@ -0,0 +1,267 @@
+"""
+Path-based user equilibrium by gradient projection
+
+The path sets are stored compactly: the laneset index of all the paths are concatenated in one array with an
+offset array (CSR layout), so that the path cost, path derivative and laneset flow are computed for all the paths
+at once. The solver keeps its path flows between calls, a new OD matrix is warm started from the previous solution.
+
+See :mod:`cores.mtlmap.assignment` for the OD matrix input.
+"""
+import numpy as np
+import pandas as pd
+
+from .assignment import AssignmentNetwork, ODMatrix, relative_gap
+
+
+class PathBasedAssignment(object):
+    """
+    Gradient projection solver with warm start
+
+    **Main Attributes**
+        - ``.assign_net``: `cores.mtlmap.AssignmentNetwork`
+        - ``.od_keys``: list of (origin laneset id, destination laneset id)
+        - ``.od_demand``: demand of each OD pair in ``.od_keys``
+        - ``.path_lanesets``: concatenated laneset index of all the paths
+        - ``.path_indptr``: offset of each path in ``.path_lanesets``
+        - ``.path_od``: OD pair index of each path
+        - ``.path_flow``: flow of each path
+    """
+
+    def __init__(self, network):
+        """
+
+        :param network: `cores.mtlmap.Network` or `cores.mtlmap.AssignmentNetwork`
+        """
+        self.assign_net = network if isinstance(network, AssignmentNetwork) else AssignmentNetwork(network)
+        self.reset()
+
+    def reset(self):
+        """
+        Drop all the path sets (cold start)
+
+        :return: None
+        """
+        self.od_keys = []
+        self.od_demand = np.zeros(0)
+        self.path_lanesets = np.zeros(0, dtype=np.int64)
+        self.path_indptr = np.zeros(1, dtype=np.int64)
+        self.path_od = np.zeros(0, dtype=np.int64)
+        self.path_flow = np.zeros(0)
+        self._od_lookup = {}
+        self._path_lookup = {}
+
+    def solve(self, od_matrix, max_iterations=50, gap_tolerance=1e-4, step_scale=1.0,
+              warm_start=True, write_back=True, verbose=False):
+        """
+        Solve the user equilibrium for the OD matrix
+
+        :param od_matrix: see :mod:`cores.mtlmap.assignment`
+        :param max_iterations: int
+        :param gap_tolerance: float, stop when the relative gap is below this value
+        :param step_scale: float, scale of the projected Newton step
+        :param warm_start: True to start from the path flows of the previous call
+        :param write_back: True to write the flow to the lanesets
+        :param verbose: True to print the relative gap of each iteration
+        :return: `pandas.DataFrame` with columns ``["laneset_id", "flow", "travel_time"]``, list of relative gap
+        """
+        if not warm_start:
+            self.reset()
+        od = ODMatrix(self.assign_net, od_matrix)
+        od_rows = self._update_demand(od)
+
+        # load the new OD pairs to their current shortest paths
+        self._generate_shortest_paths(od, od_rows, self.assign_net.travel_time(self.get_laneset_flow()))
+
+        gap_list = []
+        for iteration in range(max_iterations):
+            laneset_flow = self.get_laneset_flow()
+            cost = self.assign_net.travel_time(laneset_flow)
+            shortest_paths, od_cost = self._generate_shortest_paths(od, od_rows, cost)
+            gap = relative_gap(laneset_flow, cost, od, od_cost)
+            gap_list.append(gap)
+            if verbose:
+                print(f"Iteration {iteration}: relative gap {gap:.6f}")
+            if gap < gap_tolerance:
+                break
+            self._shift_flow(laneset_flow, shortest_paths, step_scale)
+
+        self._remove_unused_paths()
+        laneset_flow = self.get_laneset_flow()
+        if write_back:
+            self.assign_net.write_back(laneset_flow)
+        flow_df = pd.DataFrame({"laneset_id": self.assign_net.laneset_index.values, "flow": laneset_flow,
+                                "travel_time": self.assign_net.travel_time(laneset_flow)})
+        return flow_df, gap_list
+
+    def get_laneset_flow(self):
+        """
+        Laneset flow from the path flow
+
+        :return: `numpy.ndarray`
+        """
+        path_lengths = np.diff(self.path_indptr)
+        return np.bincount(self.path_lanesets, weights=np.repeat(self.path_flow, path_lengths),
+                           minlength=len(self.assign_net))
+
+    def get_path_cost(self, cost):
+        """
+        Cost of all the paths
+
+        :param cost: `numpy.ndarray` of laneset cost
+        :return: `numpy.ndarray`
+        """
+        if len(self.path_flow) == 0:
+            return np.zeros(0)
+        return np.add.reduceat(cost[self.path_lanesets], self.path_indptr[:-1])
+
+    def get_path_df(self):
+        """
+        Path sets and path flows
+
+        :return: `pandas.DataFrame` with columns ``["origin", "destination", "laneset_list", "flow"]``
+        """
+        laneset_ids = self.assign_net.laneset_index.values
+        path_list = []
+        for path_idx in range(len(self.path_flow)):
+            origin, destination = self.od_keys[self.path_od[path_idx]]
+            lanesets = laneset_ids[self.path_lanesets[self.path_indptr[path_idx]:self.path_indptr[path_idx + 1]]]
+            path_list.append([origin, destination, " ".join(lanesets), self.path_flow[path_idx]])
+        return pd.DataFrame(path_list, columns=["origin", "destination", "laneset_list", "flow"])
+
+    def _update_demand(self, od):
+        """
+        Set the demand of the OD pairs and rescale the existing path flows to the new demand
+
+        :param od: `cores.mtlmap.ODMatrix`
+        :return: OD pair index of each row in ``od``
+        """
+        od_rows = np.array([self._get_od_index(od_key) for od_key in od.od_ids], dtype=np.int64)
+        new_demand = np.zeros(len(self.od_keys))
+        new_demand[od_rows] = od.demand
+
+        current_demand = np.bincount(self.path_od, weights=self.path_flow, minlength=len(self.od_keys))
+        ratio = np.divide(new_demand, current_demand, out=np.zeros(len(new_demand)), where=current_demand > 0)
+        self.path_flow = self.path_flow * ratio[self.path_od]
+        self.od_demand = new_demand
+        return od_rows
+
+    def _generate_shortest_paths(self, od, od_rows, cost):
+        """
+        Add the shortest path of each OD pair to the path set, the OD pairs without flow are loaded to it
+
+        :return: shortest path index of each OD pair in ``.od_keys`` (-1 if no demand), shortest path cost of ``od``
+        """
+        distance, predecessor = self.assign_net.shortest_path_trees(od.origins, cost)
+        od_cost = distance[od.od_origin_row, od.od_destination]
+
+        shortest_paths = np.full(len(self.od_keys), -1, dtype=np.int64)
+        new_lanesets, new_lengths, new_od = [], [], []
+        path_num = len(self.path_flow)
+        for row in range(len(od)):
+            if not np.isfinite(od_cost[row]):
+                continue
+            tree = predecessor[od.od_origin_row[row]]
+            lanesets = [int(od.od_destination[row])]
+            while tree[lanesets[-1]] >= 0:
+                lanesets.append(int(tree[lanesets[-1]]))
+            path_key = (int(od_rows[row]), tuple(lanesets[::-1]))
+            if path_key not in self._path_lookup:
+                self._path_lookup[path_key] = path_num + len(new_od)
+                new_lanesets.extend(path_key[1])
+                new_lengths.append(len(lanesets))
+                new_od.append(od_rows[row])
+            shortest_paths[od_rows[row]] = self._path_lookup[path_key]
+
+        if len(new_od) > 0:
+            self.path_lanesets = np.concatenate([self.path_lanesets, np.array(new_lanesets, dtype=np.int64)])
+            self.path_indptr = np.concatenate([self.path_indptr,
+                                               self.path_indptr[-1] + np.cumsum(new_lengths, dtype=np.int64)])
+            self.path_od = np.concatenate([self.path_od, np.array(new_od, dtype=np.int64)])
+            self.path_flow = np.concatenate([self.path_flow, np.zeros(len(new_od))])
+
+        # load the OD pairs that do not have any path flow yet
+        current_demand = np.bincount(self.path_od, weights=self.path_flow, minlength=len(self.od_keys))
+        unloaded = (current_demand <= 0) & (self.od_demand > 0) & (shortest_paths >= 0)
+        self.path_flow[shortest_paths[unloaded]] = self.od_demand[unloaded]
+        return shortest_paths, od_cost
+
+    def _shift_flow(self, laneset_flow, shortest_paths, step_scale):
+        """
+        Move the flow from each path to the shortest path of its OD pair by a projected Newton step. The paths
+        of the same origin are updated together, and the laneset flow is updated before moving to the next origin.
+
+        :return: None
+        """
+        path_origin = self._get_path_origin()
+        order = np.argsort(path_origin, kind="stable")
+        group_starts = np.flatnonzero(np.diff(path_origin[order], prepend=-1))
+        group_ends = np.append(group_starts[1:], len(order))
+        local_index = np.full(len(self.path_flow), -1, dtype=np.int64)
+
+        for group_start, group_end in zip(group_starts, group_ends):
+            path_idx = order[group_start:group_end]
+            local_index[path_idx] = np.arange(len(path_idx))
+            lanesets, lengths = self._gather_paths(path_idx)
+            offsets = np.cumsum(lengths) - lengths
+            cost = self.assign_net.travel_time(laneset_flow)
+            derivative = self.assign_net.travel_time_derivative(laneset_flow)
+            path_cost = np.add.reduceat(cost[lanesets], offsets)
+            path_derivative = np.add.reduceat(derivative[lanesets], offsets)
+
+            shortest = shortest_paths[self.path_od[path_idx]]
+            valid = (shortest >= 0) & (shortest != path_idx)
+            shortest_local = np.where(valid, local_index[np.maximum(shortest, 0)], 0)
+            cost_difference = path_cost - path_cost[shortest_local]
+            # derivatives of the common lanesets are counted twice, which gives a conservative step
+            second_derivative = np.maximum(path_derivative + path_derivative[shortest_local], 1e-12)
+            old_flow = self.path_flow[path_idx]
+            delta = np.clip(step_scale * cost_difference / second_derivative, 0, old_flow)
+            delta[~valid] = 0
+
+            new_flow = old_flow - delta
+            np.add.at(new_flow, shortest_local[valid], delta[valid])
+            self.path_flow[path_idx] = new_flow
+            laneset_flow = laneset_flow + np.bincount(lanesets, weights=np.repeat(new_flow - old_flow, lengths),
+                                                      minlength=len(self.assign_net))
+
+    def _gather_paths(self, path_idx):
+        """
+        Laneset index of the given paths
+
+        :param path_idx: `numpy.ndarray` of path index
+        :return: concatenated laneset index, length of each path
+        """
+        lengths = self.path_indptr[path_idx + 1] - self.path_indptr[path_idx]
+        offsets = np.cumsum(lengths) - lengths
+        positions = np.repeat(self.path_indptr[path_idx] - offsets, lengths) + np.arange(lengths.sum())
+        return self.path_lanesets[positions], lengths
+
+    def _get_path_origin(self):
+        origin_ids = pd.Index([origin for origin, _ in self.od_keys])
+        origin_codes = pd.factorize(origin_ids)[0]
+        return origin_codes[self.path_od]
+
+    def _remove_unused_paths(self):
+        """
+        Remove the paths without flow and rebuild the path index
+
+        :return: None
+        """
+        keep = self.path_flow > 0
+        if np.all(keep):
+            return
+        path_lengths = np.diff(self.path_indptr)
+        self.path_lanesets = self.path_lanesets[np.repeat(keep, path_lengths)]
+        self.path_indptr = np.concatenate([[0], np.cumsum(path_lengths[keep])]).astype(np.int64)
+        self.path_od = self.path_od[keep]
+        self.path_flow = self.path_flow[keep]
+        self._path_lookup = {}
+        for path_idx in range(len(self.path_flow)):
+            lanesets = tuple(self.path_lanesets[self.path_indptr[path_idx]:self.path_indptr[path_idx + 1]].tolist())
+            self._path_lookup[(int(self.path_od[path_idx]), lanesets)] = path_idx
+
+    def _get_od_index(self, od_key):
+        if od_key not in self._od_lookup:
+            self._od_lookup[od_key] = len(self.od_keys)
+            self.od_keys.append(od_key)
+        return self._od_lookup[od_key]
@@ -4,8 +4,18 @@ from .gps_utils import haversine_distance, get_trace_length, get_directed_segmen
 
 from .geometry import Geometry, BoundingBox
 
+from .time_bins import TimeBins
+
+from .trajectory_table import TrajectoryTable
+from .trajectory_interpolation import interpolate_trajectories, iter_interpolate_trajectories
+from .time_space_diagram import TimeSpaceRaster, render_time_space_diagram
+from .traffic_image import TrafficImage, TrafficImageFile, TrafficImageAggregator, build_traffic_images, \
+    iter_traffic_images, read_traffic_image
+
 from .time_utils import timestamp_to_date_time_and_tod, tod_to_date_time, date_time_to_tod, get_timestamp_from_date_tod, \
     get_floor_timestamp, pandas_timestamp_to_string, numpy_datetime64_to_string, string_to_pandas_timestamp, \
     string_to_numpy_datetime64, df_add_date_time_and_tod, df_add_date, df_add_tod, df_add_date_time, \
-    get_seconds_between_tods, get_seconds_between_date_time, get_date_range, get_date_time_range
+    get_seconds_between_tods, get_seconds_between_date_time, get_date_range, get_date_time_range, \
+    get_utc_offset_table, get_utc_offset, get_local_seconds, local_seconds_to_timestamp, get_local_date, get_local_tod, \
+    floor_local_timestamp, date_time_to_tod_array
 
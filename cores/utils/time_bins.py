@@ -0,0 +1,164 @@
+"""
+Time binning of the trajectory / detector records
+
+The timestamps, tods or date times are mapped to integer bin indices of a fixed resolution within the day, and
+the channels are aggregated for all the entities (movement, link, ...) into dense ``(entity, bin)`` arrays with
+``numpy.bincount``. The labels of the bins are the same as :func:`cores.utils.time_utils.get_date_time_list`.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .time_utils import DEFAULT_TIMEZONE, get_local_seconds, date_time_to_tod_array
+
+
+class TimeBins(object):
+    """
+    Fixed-resolution time bins within a day
+
+    **Main Attributes**
+        - ``.resolution``: bin size (minute)
+        - ``.start_tod``, ``.end_tod``: time range of the bins (hour)
+        - ``.bin_num``: number of the bins
+        - ``.date_time_list``: start date time of each bin, e.g., ["06:00", "06:20", ...], with the seconds
+          (e.g., ["06:00:00", "06:00:30", ...]) if the resolution is not a whole number of minutes
+    """
+
+    def __init__(self, resolution=20, start_tod=0, end_tod=24):
+        """
+
+        :param resolution: bin size (minute)
+        :param start_tod: start of the first bin (hour)
+        :param end_tod: end of the last bin (hour)
+        """
+        bin_num = (end_tod - start_tod) * 60 / resolution
+        if bin_num <= 0 or abs(bin_num - round(bin_num)) > 1e-9:
+            raise ValueError(f"[{start_tod}, {end_tod}] cannot be divided into {resolution}-minute bins")
+        self.resolution = resolution
+        self.start_tod = start_tod
+        self.end_tod = end_tod
+        self.bin_num = int(round(bin_num))
+        self.bin_seconds = resolution * 60
+        # "hh:mm:ss" if the bins do not all start on whole minutes (e.g., 30-second bins), so the labels are unique
+        start_seconds = np.round(start_tod * 3600 + self.bin_seconds * np.arange(self.bin_num)).astype(np.int64)
+        if np.all(start_seconds % 60 == 0):
+            self.date_time_list = [f"{val // 3600:02d}:{val % 3600 // 60:02d}" for val in start_seconds]
+        else:
+            self.date_time_list = [f"{val // 3600:02d}:{val % 3600 // 60:02d}:{val % 60:02d}"
+                                   for val in start_seconds]
+
+    def __len__(self):
+        return self.bin_num
+
+    def get_bin_index(self, tod):
+        """
+        Bin index of the tod
+
+        :param tod: array-like of tod (hour)
+        :return: `numpy.ndarray` of int64, -1 if out of the range or missing
+        """
+        # rounded to millisecond so that the tod converted from "hh:mm" falls into the bin starting from it
+        seconds = np.round((np.asarray(tod, dtype=float) - self.start_tod) * 3600, 3)
+        return self._seconds_to_bin_index(seconds)
+
+    def get_bin_index_from_timestamp(self, timestamp, timezone_name=DEFAULT_TIMEZONE):
+        """
+        Bin index of the unix timestamp in the local time
+
+        :param timestamp: array-like of unix timestamp
+        :param timezone_name: str
+        :return: `numpy.ndarray` of int64, -1 if out of the range or missing
+        """
+        local_seconds = get_local_seconds(np.asarray(timestamp, dtype=float), timezone_name)
+        return self._seconds_to_bin_index(np.mod(local_seconds, 86400) - self.start_tod * 3600)
+
+    def get_bin_index_from_date_time(self, date_time):
+        """
+        Bin index of the "hh:mm" or "hh:mm:ss" strings, each unique string is only parsed once
+
+        :param date_time: array-like of str
+        :return: `numpy.ndarray` of int64, -1 if out of the range or missing
+        """
+        return self.get_bin_index(date_time_to_tod_array(date_time))
+
+    def _seconds_to_bin_index(self, seconds):
+        bin_index = np.floor(seconds / self.bin_seconds)
+        valid = (bin_index >= 0) & (bin_index < self.bin_num)
+        return np.where(valid, bin_index, -1).astype(np.int64)
+
+    def aggregate(self, bin_index, entities=None, channels=None, entity_index=None):
+        """
+        Aggregate the records into dense ``(entity, bin)`` arrays
+
+        :param bin_index: array-like of bin index, the records with negative index are dropped
+        :param entities: array-like of entity id (e.g., movement id) of each record, None for a single entity
+        :param channels: dict of {channel name: array-like of value}, the missing values are skipped
+        :param entity_index: `pandas.Index` of the output entities, default the sorted unique entities
+        :return: `pandas.Index` of the entities,
+                 dict of ``(entity, bin)`` arrays: "count" and ``"{channel}_sum"``, ``"{channel}_mean"``
+                 for each channel (``NaN`` mean for the empty bins)
+        """
+        bin_index = np.asarray(bin_index, dtype=np.int64)
+        if entities is None:
+            entity_index = pd.Index([None]) if entity_index is None else entity_index
+            entity_codes = np.zeros(len(bin_index), dtype=np.int64)
+        elif entity_index is None:
+            entity_codes, entity_index = pd.factorize(np.asarray(entities), sort=True)
+            entity_index = pd.Index(entity_index)
+        else:
+            entity_codes = entity_index.get_indexer(np.asarray(entities))
+
+        valid = (bin_index >= 0) & (entity_codes >= 0)
+        flat_index = (entity_codes * self.bin_num + bin_index)[valid]
+        shape = (len(entity_index), self.bin_num)
+        size = shape[0] * shape[1]
+
+        output = {"count": np.bincount(flat_index, minlength=size).reshape(shape)}
+        for channel_name, values in ({} if channels is None else channels).items():
+            values = np.asarray(values, dtype=float)[valid]
+            finite = np.isfinite(values)
+            channel_sum = np.bincount(flat_index[finite], weights=values[finite], minlength=size).reshape(shape)
+            channel_count = np.bincount(flat_index[finite], minlength=size).reshape(shape)
+            output[f"{channel_name}_sum"] = channel_sum
+            output[f"{channel_name}_mean"] = np.divide(channel_sum, channel_count, out=np.full(shape, np.nan),
+                                                       where=channel_count > 0)
+        return entity_index, output
+
+    def aggregate_df(self, df, time_column="timestamp", entity_column=None, channel_names=None,
+                     timezone_name=DEFAULT_TIMEZONE, entity_index=None):
+        """
+        :meth:`aggregate` of a DataFrame
+
+        :param df: `pandas.DataFrame`
+        :param time_column: "timestamp", "tod" or "date_time" column
+        :param entity_column: column of the entity id, None for a single entity
+        :param channel_names: list of the columns to aggregate
+        :param timezone_name: timezone of the timestamp
+        :param entity_index: see :meth:`aggregate`
+        :return: see :meth:`aggregate`
+        """
+        if time_column == "timestamp":
+            bin_index = self.get_bin_index_from_timestamp(df[time_column].values, timezone_name)
+        elif time_column == "tod":
+            bin_index = self.get_bin_index(df[time_column].values)
+        elif time_column == "date_time":
+            bin_index = self.get_bin_index_from_date_time(df[time_column].values)
+        else:
+            raise NotImplementedError
+        entities = None if entity_column is None else df[entity_column].values
+        channels = {channel_name: df[channel_name].values for channel_name in ([] if channel_names is None
+                                                                                 else channel_names)}
+        return self.aggregate(bin_index, entities, channels, entity_index)
+
+    def to_df(self, entity_index, output, entity_column_name="entity_id"):
+        """
+        Long-format DataFrame of the output of :meth:`aggregate`
+
+        :return: `pandas.DataFrame` with columns ``[entity_column_name, "start_time", ...]``
+        """
+        data = {entity_column_name: np.repeat(entity_index.values, self.bin_num),
+                "start_time": np.tile(self.date_time_list, len(entity_index))}
+        for key, val in output.items():
+            data[key] = val.ravel()
+        return pd.DataFrame(data)
+
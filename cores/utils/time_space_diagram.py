@@ -0,0 +1,287 @@
+"""
+Rasterized time-space diagram
+
+The trajectories are drawn into a ``(distance, time)`` pixel grid instead of one line per trajectory: the line
+segments between the consecutive samples of each trajectory are rasterized with a vectorized DDA (all the
+segments of a batch are expanded into pixels at once) and accumulated with ``numpy.bincount``. The pixel count
+(density) and the sum of a value (e.g., speed) are kept, so the diagram of a full day is a few array operations.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .trajectory_table import TrajectoryTable
+
+SIGNAL_COLORS = {1: (0.0, 0.75, 0.0, 1.0), 2: (0.9, 0.0, 0.0, 1.0)}
+DEFAULT_BATCH_SIZE = 1000000
+
+
+class TimeSpaceRaster(object):
+    """
+    Time-space diagram as dense arrays, the row is the distance bin and the column is the time bin
+
+    **Main Attributes**
+        - ``.counts``: `numpy.ndarray` of int64, number of rasterized samples of each pixel
+        - ``.value_sums``: `numpy.ndarray` of float, sum of the value (e.g., speed) of each pixel
+        - ``.signal``: `numpy.ndarray` of int8, signal overlay (0: none, 1: green, 2: red)
+        - ``.extent``: (start_time, end_time, min_distance, max_distance) for ``matplotlib.pyplot.imshow``
+    """
+
+    def __init__(self, start_time, end_time, min_distance, max_distance, time_resolution=1.0,
+                 distance_resolution=1.0):
+        """
+
+        :param start_time: start of the diagram (second)
+        :param end_time: end of the diagram (second)
+        :param min_distance: min corridor distance (m)
+        :param max_distance: max corridor distance (m)
+        :param time_resolution: width of a pixel (second)
+        :param distance_resolution: height of a pixel (m)
+        """
+        if end_time <= start_time or max_distance <= min_distance:
+            raise ValueError("the time and distance range of the diagram are empty")
+        self.start_time = start_time
+        self.min_distance = min_distance
+        self.time_resolution = time_resolution
+        self.distance_resolution = distance_resolution
+        self.width = int(np.ceil((end_time - start_time) / time_resolution))
+        self.height = int(np.ceil((max_distance - min_distance) / distance_resolution))
+        self.end_time = start_time + self.width * time_resolution
+        self.max_distance = min_distance + self.height * distance_resolution
+
+        self.counts = np.zeros((self.height, self.width), dtype=np.int64)
+        self.value_sums = np.zeros((self.height, self.width))
+        self.signal = np.zeros((self.height, self.width), dtype=np.int8)
+
+    @property
+    def extent(self):
+        return self.start_time, self.end_time, self.min_distance, self.max_distance
+
+    def add_points(self, timestamps, distances, values=None):
+        """
+        Add the samples without connecting them
+
+        :param timestamps: array-like of time (second)
+        :param distances: array-like of corridor distance (m), NaN is skipped
+        :param values: array-like of the value to color the pixels, e.g., speed
+        :return: None
+        """
+        columns, rows = self._to_pixel(np.asarray(timestamps, dtype=float), np.asarray(distances, dtype=float))
+        values = None if values is None else np.asarray(values, dtype=float)
+        self._accumulate(np.floor(columns).astype(np.int64), np.floor(rows).astype(np.int64), values)
+
+    def add_trajectories(self, traj_table, distance_column="distance", value_column=None, max_gap=None,
+                         batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Rasterize the line segments between the consecutive samples of each trajectory
+
+        :param traj_table: `cores.utils.TrajectoryTable` or `pandas.DataFrame` of the points
+        :param distance_column: column of the corridor distance, NaN breaks the line
+        :param value_column: column of the value to color the pixels (linearly interpolated along the segment)
+        :param max_gap: the samples more than ``max_gap`` seconds apart are not connected
+        :param batch_size: number of samples of each batch
+        :return: None
+        """
+        if not isinstance(traj_table, TrajectoryTable):
+            traj_table = TrajectoryTable(traj_table, index_columns=())
+        df = traj_table.df
+        for row_start in range(0, len(df), batch_size):
+            # one more row so that the segment across the batch boundary is drawn
+            row_end = min(row_start + batch_size + 1, len(df))
+            rows = slice(row_start, row_end)
+            timestamps = df[traj_table.time_column].values[rows].astype(float)
+            distances = df[distance_column].values[rows].astype(float)
+            values = None if value_column is None else df[value_column].values[rows].astype(float)
+            self._add_segments(timestamps, distances, values, traj_table.traj_codes[rows], max_gap,
+                               is_last_batch=row_end == len(df))
+            if row_end == len(df):
+                # the last sample is drawn by this batch
+                break
+
+    def add_signal(self, spat, stop_bar_distance, start_column="start_time", end_column="end_time",
+                   road_column="movement_index", bar_width=1):
+        """
+        Overlay the signal bars at the stop bars: green within the green intervals of the spat, red between
+        the first and the last interval otherwise
+
+        :param spat: `pandas.DataFrame` of the green intervals (spat.csv)
+        :param stop_bar_distance: dict {movement id: corridor distance of the stop bar}, the other movements of
+            the spat are skipped
+        :param start_column: column of the green start
+        :param end_column: column of the green end
+        :param road_column: column of the movement id
+        :param bar_width: height of the bar (pixel)
+        :return: None
+        """
+        spat = spat[spat[road_column].isin(list(stop_bar_distance.keys()))]
+        for road_id, road_spat in spat.groupby(road_column, sort=False):
+            _, row = self._to_pixel(np.zeros(1), np.array([stop_bar_distance[road_id]], dtype=float))
+            row = int(np.floor(row[0]))
+            rows = slice(max(row - bar_width // 2, 0), min(row - bar_width // 2 + bar_width, self.height))
+            if rows.start >= rows.stop:
+                continue
+            green_start, _ = self._to_pixel(road_spat[start_column].values.astype(float), np.zeros(len(road_spat)))
+            green_end, _ = self._to_pixel(road_spat[end_column].values.astype(float), np.zeros(len(road_spat)))
+            green_start = np.clip(np.floor(green_start).astype(np.int64), 0, self.width)
+            green_end = np.clip(np.ceil(green_end).astype(np.int64), 0, self.width)
+
+            # +1 at the green start and -1 at the green end, green where the cumulative sum is positive
+            change = np.zeros(self.width + 1, dtype=np.int64)
+            np.add.at(change, green_start, 1)
+            np.add.at(change, green_end, -1)
+            is_green = np.cumsum(change)[:-1] > 0
+            state = np.zeros(self.width, dtype=np.int8)
+            state[green_start.min():green_end.max()] = 2
+            state[is_green] = 1
+            self.signal[rows] = np.where(state > 0, state, self.signal[rows])
+
+    def get_density(self):
+        return self.counts
+
+    def get_mean_value(self):
+        """
+        Mean value of each pixel, NaN if empty
+
+        :return: `numpy.ndarray`
+        """
+        return np.divide(self.value_sums, self.counts, out=np.full(self.counts.shape, np.nan),
+                         where=self.counts > 0)
+
+    def to_rgba(self, mode="density", cmap=None, vmin=None, vmax=None, flip=False):
+        """
+        RGBA image, the first row is the max distance (the top of the diagram) unless flipped
+
+        :param mode: "density" (log scaled gray) or "value" (mean value with the color map)
+        :param cmap: matplotlib color map, default "gray_r" for density and "RdYlGn" for value
+        :param vmin: min of the color scale
+        :param vmax: max of the color scale
+        :param flip: True to put the min distance on the top (e.g., the southbound arterial)
+        :return: `numpy.ndarray` of float, shape (height, width, 4)
+        """
+        # matplotlib is only needed to render the image
+        import matplotlib
+
+        if mode == "density":
+            data = np.log1p(self.counts.astype(float))
+            data[self.counts == 0] = np.nan
+            cmap = "gray_r" if cmap is None else cmap
+        elif mode == "value":
+            data = self.get_mean_value()
+            cmap = "RdYlGn" if cmap is None else cmap
+        else:
+            raise ValueError(f"unknown mode {mode}")
+        has_data = np.any(np.isfinite(data))
+        if vmin is None:
+            vmin = np.nanmin(data) if has_data else 0.0
+        if vmax is None:
+            vmax = np.nanmax(data) if has_data else 1.0
+        scaled = (data - vmin) / (vmax - vmin) if vmax > vmin else np.zeros(data.shape)
+        rgba = matplotlib.colormaps[cmap](np.clip(np.nan_to_num(scaled), 0, 1))
+        rgba[np.isnan(data)] = (1.0, 1.0, 1.0, 1.0)
+        for state, color in SIGNAL_COLORS.items():
+            rgba[self.signal == state] = color
+        return rgba if flip else rgba[::-1]
+
+    def save(self, file_name, mode="density", cmap=None, vmin=None, vmax=None, flip=False):
+        """
+        Save the image as png (one pixel per cell), see :meth:`to_rgba`
+        """
+        import matplotlib.pyplot as plt
+
+        plt.imsave(file_name, self.to_rgba(mode, cmap, vmin, vmax, flip))
+
+    def _to_pixel(self, timestamps, distances):
+        return (timestamps - self.start_time) / self.time_resolution, \
+            (distances - self.min_distance) / self.distance_resolution
+
+    def _add_segments(self, timestamps, distances, values, traj_codes, max_gap, is_last_batch=True):
+        """
+        Vectorized DDA: each segment is split into ``max(|dx|, |dy|)`` unit steps (pixel), the steps of all the
+        segments are generated at once with the segment offsets. The start of each segment is drawn and the
+        end is drawn by the next segment, or as the last sample of the trajectory.
+        """
+        columns, rows = self._to_pixel(timestamps, distances)
+        valid = np.isfinite(columns) & np.isfinite(rows)
+        is_segment = (traj_codes[1:] == traj_codes[:-1]) & valid[1:] & valid[:-1]
+        if max_gap is not None:
+            is_segment &= np.diff(timestamps) <= max_gap
+        segment_index = np.flatnonzero(is_segment)
+        # the last sample of a line (no segment starting from it) is drawn as a point
+        is_end = valid.copy()
+        is_end[segment_index] = False
+        if not is_last_batch:
+            # the last row of the batch is drawn by the next batch
+            is_end[-1] = False
+        point_index = np.flatnonzero(is_end)
+
+        x_start, y_start = columns[segment_index], rows[segment_index]
+        x_delta, y_delta = columns[segment_index + 1] - x_start, rows[segment_index + 1] - y_start
+        step_nums = np.maximum(np.ceil(np.maximum(np.abs(x_delta), np.abs(y_delta))).astype(np.int64), 1)
+        step_offsets = np.cumsum(step_nums) - step_nums
+        # position of each step within its segment in [0, 1), float32 is enough for the pixel coordinates
+        ratio = np.arange(step_offsets[-1] + step_nums[-1] if len(step_nums) > 0 else 0, dtype=np.float32)
+        ratio -= np.repeat(step_offsets.astype(np.float32), step_nums)
+        ratio /= np.repeat(step_nums.astype(np.float32), step_nums)
+
+        pixel_x = np.repeat(x_delta.astype(np.float32), step_nums)
+        pixel_x *= ratio
+        pixel_x += np.repeat(x_start.astype(np.float32), step_nums)
+        pixel_y = np.repeat(y_delta.astype(np.float32), step_nums)
+        pixel_y *= ratio
+        pixel_y += np.repeat(y_start.astype(np.float32), step_nums)
+        pixel_x = np.concatenate([pixel_x, columns[point_index].astype(np.float32)])
+        pixel_y = np.concatenate([pixel_y, rows[point_index].astype(np.float32)])
+        pixel_values = None
+        if values is not None:
+            value_start = values[segment_index]
+            pixel_values = np.repeat(values[segment_index + 1] - value_start, step_nums) * ratio
+            pixel_values += np.repeat(value_start, step_nums)
+            pixel_values = np.concatenate([pixel_values, values[point_index]])
+        self._accumulate(np.floor(pixel_x).astype(np.int64), np.floor(pixel_y).astype(np.int64), pixel_values)
+
+    def _accumulate(self, columns, rows, values=None):
+        flat_index = rows * self.width + columns
+        if len(flat_index) > 0 and (columns.min() < 0 or columns.max() >= self.width or
+                                    rows.min() < 0 or rows.max() >= self.height):
+            inside = (columns >= 0) & (columns < self.width) & (rows >= 0) & (rows < self.height)
+            flat_index = flat_index[inside]
+            values = None if values is None else values[inside]
+        self.counts += np.bincount(flat_index, minlength=self.counts.size).reshape(self.counts.shape)
+        if values is not None:
+            finite = np.isfinite(values)
+            if not np.all(finite):
+                flat_index, values = flat_index[finite], values[finite]
+            self.value_sums += np.bincount(flat_index, weights=values,
+                                           minlength=self.counts.size).reshape(self.counts.shape)
+
+
+def render_time_space_diagram(traj_data, time_resolution=1.0, distance_resolution=1.0, distance_column="distance",
+                              value_column=None, max_gap=None, spat=None, stop_bar_distance=None):
+    """
+    Time-space diagram covering all the points of the trajectories
+
+    :param traj_data: `pandas.DataFrame` or `cores.utils.TrajectoryTable` with the corridor distance
+    :param time_resolution: see :class:`TimeSpaceRaster`
+    :param distance_resolution: see :class:`TimeSpaceRaster`
+    :param distance_column: see :meth:`TimeSpaceRaster.add_trajectories`
+    :param value_column: see :meth:`TimeSpaceRaster.add_trajectories`
+    :param max_gap: see :meth:`TimeSpaceRaster.add_trajectories`
+    :param spat: `pandas.DataFrame` of spat.csv to overlay, None for no signal
+    :param stop_bar_distance: dict {movement id: corridor distance of the stop bar}
+    :return: :class:`TimeSpaceRaster`
+    """
+    traj_table = traj_data if isinstance(traj_data, TrajectoryTable) else \
+        TrajectoryTable(traj_data, index_columns=())
+    df = traj_table.df
+    distances = df[distance_column].values.astype(float)
+    timestamps = df[traj_table.time_column].values.astype(float)
+    min_distance, max_distance = np.nanmin(distances), np.nanmax(distances)
+    if stop_bar_distance is not None and len(stop_bar_distance) > 0:
+        min_distance = min(min_distance, min(stop_bar_distance.values()))
+        max_distance = max(max_distance, max(stop_bar_distance.values()))
+    raster = TimeSpaceRaster(np.nanmin(timestamps), np.nanmax(timestamps) + time_resolution, min_distance,
+                             max_distance + distance_resolution, time_resolution, distance_resolution)
+    raster.add_trajectories(traj_table, distance_column, value_column, max_gap)
+    if spat is not None and stop_bar_distance is not None:
+        raster.add_signal(pd.DataFrame(spat), stop_bar_distance)
+    return raster
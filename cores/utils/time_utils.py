@@ -35,6 +35,10 @@ TodInterval
 
 Utility functions
 """
+import datetime
+import functools
+import math
+
 import numpy as np
 import pandas as pd
 
@@ -42,31 +46,38 @@ DATE_FORMAT = "%Y-%m-%d"
 DATE_TIME_FORMAT = "%H:%M"
 DEFAULT_TIMEZONE = "UTC"
 
+# range and probing step of the UTC offset table, the transitions of the timezone rules are months apart
+OFFSET_TABLE_START_YEAR = 1900
+OFFSET_TABLE_END_YEAR = 2100
+_OFFSET_PROBE_SECONDS = 6 * 3600
+
 
 def df_add_date_time_and_tod(df, attr="timestamp", timezone_name=DEFAULT_TIMEZONE, tod_column_name="tod",
                              date_column_name="date", date_time_column_name="date_time", date_format=DATE_FORMAT,
-                             date_time_format=DATE_TIME_FORMAT):
+                             date_time_format=DATE_TIME_FORMAT, as_category=True):
     """
-    Add date and tod to DataFrame
+    Add date and tod to DataFrame, the timezone is converted only once and the strings are formatted
+    through a lookup table of the unique values.
     Note that if the user want the column of date to be np.datetime64, please run the following:
             df[date_column_name] = pd.to_datetime(df[attr], unit='s', utc=True)
             df[date_column_name] = df['attr'].dt.tz_convert(tz=tod_column_name)
+
+    :param as_category: True to save the date and date_time as categorical columns
     """
     if not (attr in ['timestamp']):
         raise NotImplementedError
-    df = df_add_date(df, attr=attr, date_column_name=date_column_name,
-                     date_format=date_format, timezone_name=timezone_name)
-    df = df_add_tod(df, attr=attr, tod_column_name=tod_column_name, timezone_name=timezone_name)
-    df = df_add_date_time(df, attr=attr, date_time_column_name=date_time_column_name,
-                          date_time_format=date_time_format, timezone_name=timezone_name)
+    local_seconds, valid = _get_local_seconds(df[attr], timezone_name)
+    df[date_column_name] = _format_local_seconds(local_seconds, valid, date_format, as_category)
+    df[tod_column_name] = _local_seconds_to_tod(local_seconds, valid)
+    df[date_time_column_name] = _format_local_seconds(local_seconds, valid, date_time_format, as_category)
     return df
 
 
 def df_add_date(df, attr="timestamp", date_column_name="date", date_format=DATE_FORMAT, timezone_name=DEFAULT_TIMEZONE):
     if not (attr in ['timestamp']):
         raise NotImplementedError
-    df[date_column_name] = pd.to_datetime(df[attr], unit='s', utc=True).dt.tz_convert(tz=timezone_name)
-    df[date_column_name] = df[date_column_name].dt.strftime(date_format)
+    local_seconds, valid = _get_local_seconds(df[attr], timezone_name)
+    df[date_column_name] = _format_local_seconds(local_seconds, valid, date_format, as_category=False)
     return df
 
 
@@ -74,13 +85,12 @@ def df_add_tod(df, attr="timestamp", tod_column_name="tod", timezone_name=DEFAUL
     if attr not in ["date_time", "timestamp", "seconds_in_day"]:
         raise NotImplementedError
     if attr == "timestamp":
-        df[tod_column_name] = pd.to_datetime(df[attr], unit='s', utc=True).dt.tz_convert(tz=timezone_name)
-        df[tod_column_name] = df[tod_column_name].dt.hour + df[tod_column_name].dt.minute / 60.0 + df[
-            tod_column_name].dt.second / 3600
+        local_seconds, valid = _get_local_seconds(df[attr], timezone_name)
+        df[tod_column_name] = _local_seconds_to_tod(local_seconds, valid)
     elif attr == "date_time":
-        df[tod_column_name] = df.apply(lambda row: date_time_to_tod(row[attr]), axis=1)
+        df[tod_column_name] = date_time_to_tod_array(df[attr])
     else:
-        df[tod_column_name] = df.apply(lambda row: seconds_in_day_to_tod(row[attr]), axis=1)
+        df[tod_column_name] = df[attr].values / 3600.0
     return df
 
 
@@ -89,15 +99,14 @@ def df_add_date_time(df, attr="timestamp", timezone_name=DEFAULT_TIMEZONE, date_
     if attr not in ["timestamp", "tod", "seconds_in_day"]:
         raise NotImplementedError
     if attr == "timestamp":
-        df[date_time_column_name] = pd.to_datetime(df[attr], unit='s', utc=True).dt.tz_convert(tz=timezone_name)
-        df[date_time_column_name] = df[date_time_column_name].dt.strftime(date_time_format)
+        local_seconds, valid = _get_local_seconds(df[attr], timezone_name)
+        df[date_time_column_name] = _format_local_seconds(local_seconds, valid, date_time_format, as_category=False)
     elif attr == "tod":
-        df[date_time_column_name] = df.apply(lambda row: tod_to_date_time(row[attr],
-                                                                          date_time_format=date_time_format), axis=1)
+        seconds_in_day, valid = _tod_to_whole_seconds(df[attr].values)
+        df[date_time_column_name] = _format_seconds_in_day(seconds_in_day, valid, date_time_format)
     else:
-        df[date_time_column_name] = df.apply(lambda row:
-                                             seconds_in_day_to_date_time(row[attr], date_time_format=date_time_format),
-                                             axis=1)
+        seconds_in_day, valid = _seconds_in_day_to_whole_seconds(df[attr].values)
+        df[date_time_column_name] = _format_seconds_in_day(seconds_in_day, valid, date_time_format)
     return df
 
 
@@ -106,29 +115,328 @@ def df_add_seconds_in_day(df, attr="timestamp", timezone_name=DEFAULT_TIMEZONE,
     if attr not in ["timestamp", "date_time", "tod"]:
         raise NotImplementedError
     if attr == "timestamp":
-        df[seconds_in_day_column_name] = df.apply(
-            lambda row: get_seconds_in_day_from_timestamp(row[attr], timezone_name=timezone_name), axis=1)
+        # same as get_seconds_in_day_from_timestamp, which goes through the "%H:%M" string (seconds dropped)
+        local_seconds, valid = _get_local_seconds(df[attr], timezone_name)
+        seconds_in_day = local_seconds % 86400
+        tod = seconds_in_day // 3600 + (seconds_in_day % 3600 // 60) / 60.0
+        df[seconds_in_day_column_name] = np.where(valid, (tod - 0.0) * 3600, np.nan)
     elif attr == "date_time":
-        df[seconds_in_day_column_name] = df.apply(lambda row: date_time_to_seconds_in_day(row[attr]), axis=1)
+        tod = date_time_to_tod_array(df[attr])
+        in_range = (tod <= 23.999) & (tod >= 0)
+        if not np.all(in_range):
+            print(f"{int(np.sum(~in_range))} date_time not in [00:00, 23:59]")
+        df[seconds_in_day_column_name] = np.where(in_range, (tod - 0.0) * 3600, np.nan)
     else:
-        df[seconds_in_day_column_name] = df.apply(lambda row: tod_to_seconds_in_day(row[attr]), axis=1)
+        df[seconds_in_day_column_name] = df[attr].values * 3600.0
     return df
 
 
+def date_time_to_tod_array(date_times):
+    """
+    Vectorized :func:`date_time_to_tod`, each unique string is only parsed once
+
+    :param date_times: array-like of "hh:mm" or "hh:mm:ss", the missing values give NaN
+    :return: `numpy.ndarray` of float
+    """
+    codes, uniques = pd.factorize(pd.Series(np.asarray(date_times, dtype=object)))
+    split_info = pd.Series(np.asarray(uniques, dtype=object)).str.split(":", expand=True)
+    hour = split_info[0].astype(int).values
+    minute = split_info[1].astype(int).values
+    unique_tod = hour + minute / 60.0
+    if split_info.shape[1] > 2:
+        second = split_info[2]
+        has_second = second.notna().values
+        unique_tod = np.where(has_second, unique_tod + second.fillna(0).astype(int).values / 3600.0, unique_tod)
+    return np.where(codes >= 0, unique_tod[codes], np.nan)
+
+
+def _tod_to_whole_seconds(tod):
+    """
+    Same rounding as :func:`tod_to_date_time`: minute rounded, second truncated. A minute rounded to 60 is
+    carried to the next hour (:func:`tod_to_date_time` raises in this case)
+
+    :param tod: `numpy.ndarray` of float
+    :return: seconds in day (int64), valid flag
+    """
+    tod = np.asarray(tod, dtype=float)
+    valid = (tod <= 23.999) & (tod >= 0)
+    if not np.all(valid):
+        print(f"{int(np.sum(~valid))} tod not in [0, 23.999]")
+    tod = np.where(valid, tod, 0)
+    hour = np.trunc(tod)
+    minute = np.round(60 * (tod - hour))
+    second = np.trunc(3600 * (tod - hour - minute / 60))
+    negative = second < 0
+    minute = np.where(negative, minute - 1, minute)
+    second = np.where(negative, np.trunc(3600 * (tod - hour - minute / 60)), second)
+    return (hour * 3600 + minute * 60 + second).astype(np.int64), valid
+
+
+def _seconds_in_day_to_whole_seconds(seconds_in_day):
+    """
+    Same truncation as :func:`seconds_in_day_to_date_time`
+
+    :param seconds_in_day: `numpy.ndarray` of float
+    :return: seconds in day (int64), valid flag
+    """
+    seconds_in_day = np.asarray(seconds_in_day, dtype=float)
+    valid = (seconds_in_day >= 0) & (seconds_in_day < 86400)
+    seconds_in_day = np.where(valid, seconds_in_day, 0)
+    hour = np.trunc(seconds_in_day / 3600.0)
+    minute = np.trunc((seconds_in_day - hour * 3600) / 60)
+    second = np.trunc(seconds_in_day - hour * 3600 - minute * 60)
+    return (hour * 3600 + minute * 60 + second).astype(np.int64), valid
+
+
+def _format_seconds_in_day(seconds_in_day, valid, fmt):
+    """
+    Format the seconds in day as the time of "1970-01-01", None if not valid
+
+    :return: `numpy.ndarray` of object
+    """
+    output = _format_local_seconds(seconds_in_day, valid, fmt, as_category=False)
+    output[~valid] = None
+    return output
+
+
+def _get_local_seconds(timestamps, timezone_name=DEFAULT_TIMEZONE):
+    """
+    Convert the unix timestamps to the (floored) local seconds since 1970-01-01 00:00 wall time
+
+    :param timestamps: `pandas.Series` of unix timestamp (seconds)
+    :param timezone_name: str
+    :return: `numpy.ndarray` of int64, `numpy.ndarray` of bool (False for the missing timestamps)
+    """
+    timestamps = np.asarray(timestamps, dtype=float)
+    valid = np.isfinite(timestamps)
+    utc_seconds = np.floor(np.where(valid, timestamps, 0)).astype(np.int64)
+    return utc_seconds + get_utc_offset(utc_seconds, timezone_name), valid
+
+
+def _local_seconds_to_tod(local_seconds, valid):
+    """
+    Same as ``dt.hour + dt.minute / 60.0 + dt.second / 3600``
+
+    :return: `numpy.ndarray` of float
+    """
+    seconds_in_day = local_seconds % 86400
+    tod = seconds_in_day // 3600 + (seconds_in_day % 3600 // 60) / 60.0 + (seconds_in_day % 60) / 3600
+    return np.where(valid, tod, np.nan)
+
+
+_DATE_DIRECTIVES = set("aAbBcCdDeFgGhjmuUVwWxyY")
+
+
+def _format_local_seconds(local_seconds, valid, fmt, as_category=True):
+    """
+    Format the local seconds with ``strftime`` through a lookup table, each unique value is only formatted once
+
+    :param local_seconds: `numpy.ndarray` of int64, see :func:`_get_local_seconds`
+    :param valid: `numpy.ndarray` of bool
+    :param fmt: strftime format
+    :param as_category: True to return `pandas.Categorical`, otherwise object array
+    :return: `pandas.Categorical` or `numpy.ndarray`
+    """
+    directives = set(fmt[idx + 1] for idx in range(len(fmt) - 1) if fmt[idx] == "%")
+    if directives & set("sSTXcr"):
+        unit = 1
+    elif directives & set("MR"):
+        unit = 60
+    elif directives & set("HIpk"):
+        unit = 3600
+    else:
+        unit = 86400
+    if directives & set("fzZ"):
+        # sub-second or timezone directives cannot be derived from the local seconds
+        raise NotImplementedError(f"format {fmt} not supported")
+
+    keys = local_seconds // unit * unit
+    if not (directives & _DATE_DIRECTIVES):
+        keys = keys % 86400
+    codes, unique_keys = pd.factorize(keys)
+    formatted = pd.to_datetime(unique_keys, unit='s').strftime(fmt)
+    # different keys might give the same string, e.g., "%Y" of two days
+    string_codes, categories = pd.factorize(np.asarray(formatted, dtype=object))
+    codes = np.where(valid, string_codes[codes], -1)
+    output = pd.Categorical.from_codes(codes, categories=categories)
+    if as_category:
+        return output
+    return np.asarray(output, dtype=object)
+
+
+@functools.lru_cache(maxsize=None)
+def get_utc_offset_table(timezone_name=DEFAULT_TIMEZONE):
+    """
+    UTC offset table of the timezone between ``OFFSET_TABLE_START_YEAR`` and ``OFFSET_TABLE_END_YEAR``. The offset
+    is probed with pandas on a coarse grid and each change is located to the second by bisection. The table is
+    built once per timezone, the local time math afterwards is a ``searchsorted`` and integer arithmetic.
+
+    :param timezone_name: str
+    :return: transition timestamps (int64, the first one is the minimum int64, sorted),
+             UTC offset (seconds, int64) starting from each transition; both read-only
+    """
+    start = (pd.Timestamp(f"{OFFSET_TABLE_START_YEAR}-01-01").value // 10 ** 9)
+    end = (pd.Timestamp(f"{OFFSET_TABLE_END_YEAR}-12-31").value // 10 ** 9)
+    grid = np.arange(start, end + _OFFSET_PROBE_SECONDS, _OFFSET_PROBE_SECONDS, dtype=np.int64)
+    grid_offsets = _probe_utc_offset(grid, timezone_name)
+
+    changes = np.flatnonzero(np.diff(grid_offsets))
+    low, high = grid[changes], grid[changes + 1]
+    high_offsets = grid_offsets[changes + 1]
+    while np.any(high - low > 1):
+        middle = (low + high) // 2
+        changed = _probe_utc_offset(middle, timezone_name) == high_offsets
+        high = np.where(changed, middle, high)
+        low = np.where(changed, low, middle)
+
+    transitions = np.concatenate([[np.iinfo(np.int64).min], high]).astype(np.int64)
+    offsets = np.concatenate([grid_offsets[:1], high_offsets]).astype(np.int64)
+    transitions.setflags(write=False)
+    offsets.setflags(write=False)
+    return transitions, offsets
+
+
+def _probe_utc_offset(timestamps, timezone_name):
+    """
+    UTC offset (seconds) of the int64 timestamps with pandas, only used to build the offset table
+    """
+    utc_dt = pd.to_datetime(timestamps, unit='s', utc=True)
+    local_dt = utc_dt.tz_convert(timezone_name).tz_localize(None)
+    return local_dt.values.astype("datetime64[s]").astype(np.int64) - timestamps
+
+
+def get_utc_offset(timestamp, timezone_name=DEFAULT_TIMEZONE):
+    """
+    UTC offset (seconds) of the timezone at the given unix timestamp
+
+    :param timestamp: unix timestamp or array of unix timestamp (int64 or float)
+    :param timezone_name: str
+    :return: int or `numpy.ndarray` of int64
+    """
+    transitions, offsets = get_utc_offset_table(timezone_name)
+    output = offsets[np.searchsorted(transitions, timestamp, side="right") - 1]
+    return output.item() if np.ndim(timestamp) == 0 else output
+
+
+def get_local_seconds(timestamp, timezone_name=DEFAULT_TIMEZONE):
+    """
+    Local wall time of the unix timestamp, counted in seconds since 1970-01-01 00:00 (fraction kept)
+
+    :param timestamp: unix timestamp or array of unix timestamp
+    :param timezone_name: str
+    :return: same type as the input
+    """
+    return timestamp + get_utc_offset(timestamp, timezone_name)
+
+
+def local_seconds_to_timestamp(local_seconds, timezone_name=DEFAULT_TIMEZONE):
+    """
+    Inverse of :func:`get_local_seconds`. Same as the ``fold=0`` rule of python datetime: the ambiguous local
+    time takes its first occurrence, the nonexistent local time is shifted with the offset before the transition.
+
+    :param local_seconds: local seconds or array of local seconds
+    :param timezone_name: str
+    :return: same type as the input
+    """
+    transitions, offsets = get_utc_offset_table(timezone_name)
+    next_transitions = np.append(transitions[1:], np.iinfo(np.int64).max)
+    local = np.asarray(local_seconds)
+    # the offset is less than a day, the local time is within one transition of its timestamp
+    base_idx = np.searchsorted(transitions, local, side="right") - 1
+
+    candidates = []
+    for shift in (-1, 0, 1):
+        table_idx = np.clip(base_idx + shift, 0, len(offsets) - 1)
+        candidates.append((local - offsets[table_idx], table_idx))
+    output = candidates[0][0]
+    for candidate, table_idx in candidates:
+        output = np.where(candidate >= next_transitions[table_idx], candidate, output)
+    for candidate, table_idx in candidates[::-1]:
+        in_range = (candidate >= transitions[table_idx]) & (candidate < next_transitions[table_idx])
+        output = np.where(in_range, candidate, output)
+    return output.item() if np.ndim(local_seconds) == 0 else output
+
+
+def get_local_date(timestamp, timezone_name=DEFAULT_TIMEZONE, date_format=DATE_FORMAT):
+    """
+    Local date of the unix timestamp
+
+    :param timestamp: unix timestamp or array of unix timestamp
+    :param timezone_name: str
+    :param date_format: strftime format
+    :return: str or `numpy.ndarray` of object (None for the missing timestamps)
+    """
+    local_seconds, valid = _get_local_seconds(np.atleast_1d(timestamp), timezone_name)
+    output = _format_local_seconds(local_seconds, valid, date_format, as_category=False)
+    return output[0] if np.ndim(timestamp) == 0 else output
+
+
+def get_local_tod(timestamp, timezone_name=DEFAULT_TIMEZONE):
+    """
+    Local tod of the unix timestamp (seconds floored), same as :func:`df_add_tod`
+
+    :param timestamp: unix timestamp or array of unix timestamp
+    :param timezone_name: str
+    :return: float or `numpy.ndarray` of float
+    """
+    local_seconds, valid = _get_local_seconds(np.atleast_1d(timestamp), timezone_name)
+    output = _local_seconds_to_tod(local_seconds, valid)
+    return output.item() if np.ndim(timestamp) == 0 else output
+
+
+def floor_local_timestamp(timestamp, floor_minute, timezone_name=DEFAULT_TIMEZONE):
+    """
+    Floor the unix timestamp to the start of its local ``floor_minute`` bin, the bins are aligned
+    to the local midnight
+
+    :param timestamp: unix timestamp or array of unix timestamp
+    :param floor_minute: bin size (minute)
+    :param timezone_name: str
+    :return: same type as the input
+    """
+    output = timestamp - np.mod(get_local_seconds(timestamp, timezone_name), floor_minute * 60)
+    return output.item() if isinstance(output, np.generic) else output
+
+
+def _get_local_minute(timestamp, timezone_name):
+    """
+    Same as ``pd.Timestamp(timestamp, unit="s", tz=timezone_name).minute``, float array if not scalar
+    """
+    minute = np.floor(get_local_seconds(timestamp, timezone_name)) // 60 % 60
+    return int(minute) if np.ndim(minute) == 0 else minute
+
+
+def _local_seconds_to_datetime(local_seconds):
+    """
+    Naive `datetime.datetime` of the local seconds, for the scalar formatting
+    """
+    whole_seconds = math.floor(local_seconds)
+    microseconds = int((local_seconds - whole_seconds) * 10 ** 6)
+    return datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=whole_seconds, microseconds=microseconds)
+
+
 def timestamp_to_date_time_and_tod(timestamp, date_format=DATE_FORMAT, date_time_format=DATE_TIME_FORMAT,
                                    minute_interval=None, timezone_name=DEFAULT_TIMEZONE):
-    ts = pd.Timestamp(timestamp, tz=timezone_name, unit='s')
-    date = ts.strftime(date_format)
-    if minute_interval is None:
-        date_time = ts.strftime(date_time_format)
-        tod = date_time_to_tod(date_time)
-    else:
-        new_minute = int(ts.minute / minute_interval) * minute_interval
-        timestamp = timestamp - 60 * (ts.minute - new_minute)
-        ts = pd.Timestamp(timestamp, tz=timezone_name, unit='s')
-        date_time = ts.strftime(date_time_format)
-        tod = date_time_to_tod(date_time)
-    return date, date_time, tod
+    """
+    Date, date time and tod of the unix timestamp, the timestamp can also be an array
+    (the output is then three arrays)
+
+    :param minute_interval: floor the date time to the minute interval
+    """
+    if minute_interval is not None:
+        minute = _get_local_minute(timestamp, timezone_name)
+        timestamp = timestamp - 60 * (minute - minute // minute_interval * minute_interval)
+
+    if np.ndim(timestamp) == 0:
+        local_dt = _local_seconds_to_datetime(get_local_seconds(timestamp, timezone_name))
+        date = local_dt.strftime(date_format)
+        date_time = local_dt.strftime(date_time_format)
+        return date, date_time, date_time_to_tod(date_time)
+
+    local_seconds, valid = _get_local_seconds(timestamp, timezone_name)
+    date = _format_local_seconds(local_seconds, valid, date_format, as_category=False)
+    date_time = _format_local_seconds(local_seconds, valid, date_time_format, as_category=False)
+    return date, date_time, date_time_to_tod_array(date_time)
 
 
 def tod_to_date_time(tod, date_time_format=DATE_TIME_FORMAT):
@@ -193,36 +501,55 @@ def seconds_in_day_to_date_time(seconds_in_day, date_time_format=DATE_TIME_FORMA
 
 def get_timestamp_from_date_tod(date, tod, timezone_name=DEFAULT_TIMEZONE):
     """
-    get the timestamp given date and tod
+    get the timestamp given date and tod, the tod is rounded to the minute as :func:`tod_to_date_time`.
+    The date and tod can also be arrays, the output is then a float array (``NaN`` for the invalid tod).
+    See :func:`local_seconds_to_timestamp` for the ambiguous and nonexistent local time.
 
-    :param date:
+    :param date: "yyyy-mm-dd"
     :param tod:
     :param timezone_name:
     :return:
     """
-    if tod > 23.999 or tod < 0:
-        print(f"tod {tod} not in [0, 23.999]")
-        return None
-    date_time = tod_to_date_time(tod)
-    ts = pd.Timestamp(f"{date} {date_time}", tz=timezone_name)
-    timestamp = ts.value // 10 ** 9
-    return timestamp
+    if np.ndim(date) == 0 and np.ndim(tod) == 0:
+        if tod > 23.999 or tod < 0:
+            print(f"tod {tod} not in [0, 23.999]")
+            return None
+        seconds_in_day, _ = _tod_to_whole_seconds(np.array([tod]))
+        days = _date_to_days([date])
+        return int(local_seconds_to_timestamp(days[0] * 86400 + seconds_in_day[0] // 60 * 60, timezone_name))
+
+    tod = np.asarray(tod, dtype=float)
+    seconds_in_day, valid = _tod_to_whole_seconds(tod)
+    days = _date_to_days(np.broadcast_to(np.asarray(date, dtype=object), tod.shape).ravel()).reshape(tod.shape)
+    local_seconds = days * 86400 + seconds_in_day // 60 * 60
+    return np.where(valid, local_seconds_to_timestamp(local_seconds, timezone_name), np.nan)
+
+
+def _date_to_days(dates):
+    """
+    Days since 1970-01-01 of the date strings, each unique date is only parsed once
+
+    :param dates: array-like of date
+    :return: `numpy.ndarray` of int64
+    """
+    codes, uniques = pd.factorize(np.asarray(dates, dtype=object))
+    unique_days = pd.to_datetime(uniques).values.astype("datetime64[D]").astype(np.int64)
+    return unique_days[codes]
 
 
 def get_floor_timestamp(timestamp, floor_minute: int = None,
                         timezone_name=DEFAULT_TIMEZONE):
     """
-    get the floor timestamp given certain timestamp
+    get the floor timestamp given certain timestamp, only the local minute is floored (the seconds are kept).
+    See :func:`floor_local_timestamp` for the start of the local bin.
 
-    :param timestamp:
+    :param timestamp: unix timestamp or array of unix timestamp
     :param floor_minute:
     :param timezone_name:
     :return:
     """
-    ts = pd.Timestamp(timestamp, unit="s", tz=timezone_name)
-    new_minute = int(ts.minute / floor_minute) * floor_minute
-    timestamp = timestamp - (ts.minute - new_minute) * 60
-    return timestamp
+    minute = _get_local_minute(timestamp, timezone_name)
+    return timestamp - (minute - minute // floor_minute * floor_minute) * 60
 
 
 def pandas_timestamp_to_string(ts, fmt=f"{DATE_FORMAT} {DATE_TIME_FORMAT}"):
@@ -307,28 +634,22 @@ def get_date_time_list(resolution=20):
 
 def get_data_list_given_time_list(agg_df, channel_name, date_time_list, fillnan=0):
     """
+    Data of the channel at each date time, see :class:`cores.utils.TimeBins` to aggregate the raw records
+    of many channels and entities directly
 
-    :param agg_df: aggregated df, with column ['date_time', channel_name]
+    :param agg_df: aggregated df, with column ['start_time', channel_name]
     :param channel_name:
     :param date_time_list: ['00:00', '00:20', ...]
     :param fillnan:
     :return:
     """
     selected_time_list = date_time_list[:-1]
-
-    channel_data_dict = {}
-    time_list = agg_df['start_time'].tolist()
-    channel_data_list = agg_df[channel_name].tolist()
-    for (date_time, trajs_num) in zip(time_list, channel_data_list):
-        channel_data_dict[date_time] = trajs_num
-
-    new_channel_data_list = []
-    for date_time in selected_time_list:
-        if date_time in channel_data_dict.keys():
-            new_channel_data_list.append(channel_data_dict[date_time])
-        else:
-            new_channel_data_list.append(fillnan)
-    return new_channel_data_list
+    # the last record wins for the duplicated start time, same as filling a dict
+    channel_data = pd.Series(agg_df[channel_name].values, index=agg_df['start_time'].values)
+    channel_data = channel_data[~channel_data.index.duplicated(keep="last")]
+    locations = channel_data.index.get_indexer(selected_time_list)
+    channel_values = np.asarray(channel_data.values, dtype=object)
+    return [channel_values[loc] if loc >= 0 else fillnan for loc in locations]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,620 @@
+"""
+Traffic images (time-space matrices) of the roads with Edie's generalized definitions
+
+The consecutive points of a trajectory on the same road form a segment. The time spent and the distance traveled
+of all the segments are accumulated into ``(date, road, time bin, distance bin)`` arrays with one ``np.add.at``, so
+the images of every link (or movement) and every date are built in one pass over the sorted point table. In each
+cell of area ``|A| = time interval * cell length``:
+
+    - density = total time spent / |A|
+    - flow = total distance traveled / |A|
+    - speed = total distance traveled / total time spent
+
+The images are saved in a binary folder (:class:`TrafficImageFile`): one memory-mapped ``(cell, time bin)`` array
+per channel and a small json index of the row range of each road, so a corridor or road query only reads its rows.
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from .time_bins import TimeBins
+from .time_utils import DEFAULT_TIMEZONE, get_local_date
+from .trajectory_table import TrajectoryTable
+
+TRAFFIC_IMAGE_CHANNELS = ("flow", "density", "speed")
+TRAFFIC_IMAGE_INDEX_FILE = "index.json"
+
+
+class _TrafficImageQuery(object):
+    """
+    Queries shared by :class:`TrafficImage` and :class:`TrafficImageFile`, the subclass reads the
+    ``(time bin, cell)`` values of one road and one channel ("flow", "density" or "speed")
+    """
+    road_index = None
+    road_lengths = None
+    time_bins = None
+    distance_interval = None
+
+    def get_density_matrix(self, road_id, remove_incomplete_cell=False):
+        """
+        ``(time bin, cell)`` density (veh/km) of the road, the cells are from upstream to downstream
+
+        :param road_id: road id
+        :param remove_incomplete_cell: True to drop the last cell if it is shorter than the interval
+        :return: `numpy.ndarray`
+        """
+        return self._get_road_matrix("density", road_id, remove_incomplete_cell)
+
+    def get_flow_matrix(self, road_id, remove_incomplete_cell=False):
+        return self._get_road_matrix("flow", road_id, remove_incomplete_cell)
+
+    def get_speed_matrix(self, road_id, remove_incomplete_cell=False):
+        return self._get_road_matrix("speed", road_id, remove_incomplete_cell)
+
+    def get_path_density(self, road_id_list, remove_incomplete_cell=False):
+        """
+        ``(time bin, cell)`` density of the roads of a path, the cells of the roads are concatenated
+        from upstream to downstream
+
+        :param road_id_list: list of road ids
+        :param remove_incomplete_cell: True to drop the last cell of each road if it is shorter than the interval
+        :return: `numpy.ndarray`
+        """
+        return self._get_path_matrix("density", road_id_list, remove_incomplete_cell)
+
+    def get_path_flow(self, road_id_list, remove_incomplete_cell=False):
+        return self._get_path_matrix("flow", road_id_list, remove_incomplete_cell)
+
+    def get_path_speed(self, road_id_list, remove_incomplete_cell=False):
+        return self._get_path_matrix("speed", road_id_list, remove_incomplete_cell)
+
+    def get_density_vector(self, road_id, date_time, remove_incomplete_cell=False):
+        """
+        Density of the cells of the road in the time bin of ``date_time`` ("hh:mm")
+        """
+        return self._get_road_matrix("density", road_id, remove_incomplete_cell, self._get_time_loc(date_time))
+
+    def get_flow_vector(self, road_id, date_time, remove_incomplete_cell=False):
+        return self._get_road_matrix("flow", road_id, remove_incomplete_cell, self._get_time_loc(date_time))
+
+    def get_speed_vector(self, road_id, date_time, remove_incomplete_cell=False):
+        return self._get_road_matrix("speed", road_id, remove_incomplete_cell, self._get_time_loc(date_time))
+
+    def get_cell_nums(self):
+        """
+        Number of the cells of each road (the last cell can be incomplete)
+
+        :return: `numpy.ndarray` of int64
+        """
+        return np.ceil(np.round(self.road_lengths / self.distance_interval, 9)).astype(np.int64)
+
+    def _get_road_channel(self, channel, road_loc, time_loc):
+        raise NotImplementedError
+
+    def _get_road_matrix(self, channel, road_id, remove_incomplete_cell, time_loc=slice(None)):
+        road_loc = self.road_index.get_loc(road_id)
+        values = self._get_road_channel(channel, road_loc, time_loc)
+        if remove_incomplete_cell and self.road_lengths[road_loc] < self.get_cell_nums()[road_loc] * \
+                self.distance_interval - 1e-9:
+            values = values[..., :-1]
+        return values
+
+    def _get_path_matrix(self, channel, road_id_list, remove_incomplete_cell):
+        return np.concatenate([self._get_road_matrix(channel, road_id, remove_incomplete_cell)
+                               for road_id in road_id_list], axis=1)
+
+    def _get_time_loc(self, date_time):
+        time_loc = self.time_bins.get_bin_index_from_date_time([date_time])[0]
+        if time_loc < 0:
+            raise KeyError(f"{date_time} is out of the time bins")
+        return time_loc
+
+
+class TrafficImage(_TrafficImageQuery):
+    """
+    Traffic images of many roads, the images are averaged over the dates
+
+    **Main Attributes**
+        - ``.road_index``: `pandas.Index` of the road (link or movement) ids
+        - ``.road_lengths``: `numpy.ndarray`, length of each road (m)
+        - ``.time_bins``: `cores.utils.TimeBins`
+        - ``.distance_interval``: length of the cells (m), the distance bin 0 is at the upstream end
+        - ``.cell_lengths``: ``(road, distance bin)`` length of each cell, 0 beyond the road end
+        - ``.time_spent``: ``(road, time bin, distance bin)`` total time spent (second)
+        - ``.distance_traveled``: ``(road, time bin, distance bin)`` total distance traveled (m)
+        - ``.date_list``: dates of the data
+    """
+
+    def __init__(self, road_index, road_lengths, time_bins, distance_interval, time_spent=None,
+                 distance_traveled=None, date_list=None):
+        """
+
+        :param road_index: array-like of the road ids
+        :param road_lengths: array-like of the road lengths (m)
+        :param time_bins: `cores.utils.TimeBins`
+        :param distance_interval: length of the cells (m)
+        :param time_spent: ``(road, time bin, distance bin)`` array, default zeros
+        :param distance_traveled: ``(road, time bin, distance bin)`` array, default zeros
+        :param date_list: list of dates "yyyy-mm-dd"
+        """
+        self.road_index = pd.Index(road_index)
+        self.road_lengths = np.asarray(road_lengths, dtype=float)
+        self.time_bins = time_bins
+        self.distance_interval = distance_interval
+        self.date_list = [] if date_list is None else list(date_list)
+
+        distance_bin_num = max(int(np.max(self.get_cell_nums())), 1) if len(self.road_lengths) > 0 else 1
+        cell_starts = np.arange(distance_bin_num) * distance_interval
+        self.cell_lengths = np.clip(self.road_lengths[:, None] - cell_starts[None, :], 0, distance_interval)
+        shape = (len(self.road_index), time_bins.bin_num, distance_bin_num)
+        self.time_spent = np.zeros(shape) if time_spent is None else time_spent
+        self.distance_traveled = np.zeros(shape) if distance_traveled is None else distance_traveled
+
+    @property
+    def shape(self):
+        return self.time_spent.shape
+
+    @property
+    def day_num(self):
+        return max(len(self.date_list), 1)
+
+    @property
+    def density(self):
+        """
+        ``(road, time bin, distance bin)`` density (veh/km), NaN beyond the road end
+        """
+        return _get_channel("density", self.time_spent, self.distance_traveled, self._get_area())
+
+    @property
+    def flow(self):
+        """
+        ``(road, time bin, distance bin)`` flow (veh/h), NaN beyond the road end
+        """
+        return _get_channel("flow", self.time_spent, self.distance_traveled, self._get_area())
+
+    @property
+    def speed(self):
+        """
+        ``(road, time bin, distance bin)`` space mean speed (m/s), NaN if no vehicle
+        """
+        return _get_channel("speed", self.time_spent, self.distance_traveled, self._get_area())
+
+    def extend(self, other, weight=1.0):
+        """
+        Add the images of another date (same roads and bins)
+
+        :param other: :class:`TrafficImage`
+        :param weight: weight of the other images
+        :return: None
+        """
+        if not self.road_index.equals(other.road_index) or self.shape != other.shape:
+            raise ValueError("the traffic images have different roads or bins")
+        self.time_spent = self.time_spent + weight * other.time_spent
+        self.distance_traveled = self.distance_traveled + weight * other.distance_traveled
+        self.date_list = self.date_list + [val for val in other.date_list if val not in self.date_list]
+
+    def get_channel(self, channel):
+        """
+        ``(cell, time bin)`` array of the channel, the cells of each road are a row range (no padding beyond the
+        road end), same layout as :meth:`TrafficImageFile.get_channel`
+
+        :param channel: "flow", "density" or "speed"
+        :return: `numpy.ndarray`
+        """
+        is_cell = np.arange(self.shape[2])[None, :] < self.get_cell_nums()[:, None]
+        values = _get_channel(channel, self.time_spent, self.distance_traveled, self._get_area())
+        # (road, time, distance) -> (road, distance, time), then the cells of the roads are stacked
+        return values.transpose(0, 2, 1)[is_cell]
+
+    def save(self, folder, dtype=np.float32):
+        """
+        Save the images as a :class:`TrafficImageFile`: one ``(cell, time bin)`` array per channel
+
+        :param folder: output folder
+        :param dtype: dtype of the channels
+        :return: None
+        """
+        os.makedirs(folder, exist_ok=True)
+        for channel in TRAFFIC_IMAGE_CHANNELS:
+            np.save(os.path.join(folder, f"{channel}.npy"), np.ascontiguousarray(self.get_channel(channel),
+                                                                                 dtype=dtype))
+        _write_index(folder, self, self.date_list)
+
+    def to_json(self, file_name):
+        output = {"road_index": [str(val) for val in self.road_index], "road_lengths": self.road_lengths.tolist(),
+                  "resolution": self.time_bins.resolution, "start_tod": self.time_bins.start_tod,
+                  "end_tod": self.time_bins.end_tod, "distance_interval": self.distance_interval,
+                  "date_list": self.date_list, "time_spent": self.time_spent.tolist(),
+                  "distance_traveled": self.distance_traveled.tolist()}
+        with open(file_name, "w") as temp_file:
+            json.dump(output, temp_file)
+
+    def _get_area(self):
+        return self.cell_lengths[:, None, :] * self.time_bins.bin_seconds * self.day_num
+
+    def _get_road_channel(self, channel, road_loc, time_loc):
+        cell_num = self.get_cell_nums()[road_loc]
+        area = self.cell_lengths[road_loc, :cell_num] * self.time_bins.bin_seconds * self.day_num
+        return _get_channel(channel, self.time_spent[road_loc, time_loc, :cell_num],
+                            self.distance_traveled[road_loc, time_loc, :cell_num], area)
+
+
+class TrafficImageFile(_TrafficImageQuery):
+    """
+    Traffic images saved by :meth:`TrafficImage.save`, the channels are memory-mapped and a query only reads
+    the rows of its roads (and the column of its time bin)
+
+    ::
+
+        folder/
+            index.json      road ids, lengths and row offsets, time bins, dates
+            flow.npy        (cell, time bin) flow (veh/h)
+            density.npy     (cell, time bin) density (veh/km)
+            speed.npy       (cell, time bin) space mean speed (m/s)
+
+    **Main Attributes**
+        - ``.road_index``: `pandas.Index` of the road ids (str)
+        - ``.road_offsets``: first row of each road in the channels, and the number of rows at the end
+        - ``.time_bins``: `cores.utils.TimeBins`
+        - ``.date_list``: dates of the data
+    """
+
+    def __init__(self, folder):
+        """
+
+        :param folder: folder of :meth:`TrafficImage.save`
+        """
+        self.folder = folder
+        with open(os.path.join(folder, TRAFFIC_IMAGE_INDEX_FILE), "r") as temp_file:
+            index = json.load(temp_file)
+        self.road_index = pd.Index(index["road_index"])
+        self.road_lengths = np.array(index["road_lengths"], dtype=float)
+        self.road_offsets = np.array(index["road_offsets"], dtype=np.int64)
+        self.time_bins = TimeBins(index["resolution"], index["start_tod"], index["end_tod"])
+        self.distance_interval = index["distance_interval"]
+        self.date_list = index["date_list"]
+        self.channels = index["channels"]
+        self._arrays = {}
+
+    def get_channel(self, channel):
+        """
+        Memory-mapped ``(cell, time bin)`` array of the channel
+
+        :param channel: "flow", "density" or "speed"
+        :return: `numpy.memmap`
+        """
+        if channel not in self.channels:
+            raise KeyError(f"unknown channel {channel}")
+        if channel not in self._arrays:
+            self._arrays[channel] = np.load(os.path.join(self.folder, f"{channel}.npy"), mmap_mode="r")
+        return self._arrays[channel]
+
+    def to_traffic_image(self):
+        """
+        Load the whole file as a :class:`TrafficImage`, the totals are recovered from the flow and density
+
+        :return: :class:`TrafficImage`
+        """
+        image = TrafficImage(self.road_index, self.road_lengths, self.time_bins, self.distance_interval,
+                             date_list=self.date_list)
+        is_cell = np.arange(image.shape[2])[None, :] < self.get_cell_nums()[:, None]
+        area = image._get_area().transpose(0, 2, 1)[is_cell]
+        time_spent = np.nan_to_num(np.asarray(self.get_channel("density"), dtype=float)) * area / 1000
+        distance_traveled = np.nan_to_num(np.asarray(self.get_channel("flow"), dtype=float)) * area / 3600
+        for values, output in [(time_spent, image.time_spent), (distance_traveled, image.distance_traveled)]:
+            output_view = output.transpose(0, 2, 1)
+            output_view[is_cell] = values
+        return image
+
+    def _get_road_channel(self, channel, road_loc, time_loc):
+        rows = slice(self.road_offsets[road_loc], self.road_offsets[road_loc + 1])
+        return np.asarray(self.get_channel(channel)[rows, time_loc], dtype=float).T
+
+
+class TrafficImageAggregator(_TrafficImageQuery):
+    """
+    Streaming multi-day statistics of the traffic images
+
+    The daily images are folded one at a time into the running weighted mean, the sum of the squared deviations
+    (Welford) and the count of each cell of each channel, so the memory does not grow with the days. With
+    ``decay < 1`` the previous days are down-weighted by ``decay`` at each new day (exponentially weighted
+    rolling baseline). A day can be removed by folding its image again with the opposite weight. The missing
+    cells (e.g., the speed without vehicle) are skipped. The mean images can be queried like a
+    :class:`TrafficImage` and saved as a :class:`TrafficImageFile`.
+
+    **Main Attributes**
+        - ``.decay``: weight of the previous days at each new day
+        - ``.date_list``: dates currently in the statistics
+        - ``.mean``, ``.m2``, ``.weight``, ``.count``: dict {channel: ``(cell, time bin)`` array}
+    """
+
+    def __init__(self, decay=1.0, channels=TRAFFIC_IMAGE_CHANNELS):
+        """
+
+        :param decay: weight of the previous days at each new day, 1.0 for the equal weights
+        :param channels: channels to aggregate
+        """
+        if not 0 < decay <= 1:
+            raise ValueError("the decay should be in (0, 1]")
+        self.decay = decay
+        self.channels = list(channels)
+        self.date_list = []
+        self.mean, self.m2, self.weight, self.count = {}, {}, {}, {}
+        self.road_offsets = None
+        self._step = 0
+        self._date_steps = {}
+
+    @property
+    def day_num(self):
+        return len(self.date_list)
+
+    def add(self, image, date=None):
+        """
+        Fold a daily image into the statistics
+
+        :param image: :class:`TrafficImage` or :class:`TrafficImageFile` (or its folder)
+        :param date: key of the day, default the dates of the image
+        :return: None
+        """
+        image = read_traffic_image(image) if isinstance(image, str) else image
+        date = self._get_date_key(image, date)
+        if date in self._date_steps:
+            raise ValueError(f"{date} is already aggregated")
+        if self.road_offsets is None:
+            self._init_from_image(image)
+        elif not self.road_index.equals(image.road_index) or \
+                self.time_bins.date_time_list != image.time_bins.date_time_list:
+            raise ValueError("the traffic image has different roads or bins")
+
+        self._step += 1
+        for channel in self.channels:
+            if self.decay < 1:
+                self.weight[channel] *= self.decay
+                self.m2[channel] *= self.decay
+            self._update(channel, np.asarray(image.get_channel(channel), dtype=float), 1.0)
+        self._date_steps[date] = self._step
+        self.date_list.append(date)
+
+    def remove(self, image, date=None):
+        """
+        Remove the contribution of a day added before, the same image should be given
+
+        :param image: :class:`TrafficImage` or :class:`TrafficImageFile` (or its folder)
+        :param date: key of the day, default the dates of the image
+        :return: None
+        """
+        image = read_traffic_image(image) if isinstance(image, str) else image
+        date = self._get_date_key(image, date)
+        if date not in self._date_steps:
+            raise KeyError(f"{date} is not aggregated")
+        # current weight of the day after the decays of the following days
+        day_weight = self.decay ** (self._step - self._date_steps.pop(date))
+        for channel in self.channels:
+            self._update(channel, np.asarray(image.get_channel(channel), dtype=float), -day_weight)
+        self.date_list.remove(date)
+
+    def get_channel(self, channel):
+        """
+        ``(cell, time bin)`` mean of the channel, NaN if no data
+
+        :return: `numpy.ndarray`
+        """
+        return np.where(self.count[channel] > 0, self.mean[channel], np.nan)
+
+    def get_variance(self, channel, ddof=0):
+        """
+        ``(cell, time bin)`` weighted variance of the channel over the days, NaN if not enough data
+
+        :param channel: "flow", "density" or "speed"
+        :param ddof: subtracted from the total weight (1 for the sample variance of the equal weights)
+        :return: `numpy.ndarray`
+        """
+        denominator = self.weight[channel] - ddof
+        return np.divide(self.m2[channel], denominator, out=np.full(denominator.shape, np.nan),
+                         where=(self.count[channel] > ddof) & (denominator > 0))
+
+    def get_std(self, channel, ddof=0):
+        return np.sqrt(self.get_variance(channel, ddof))
+
+    def save(self, folder, dtype=np.float32):
+        """
+        Save the mean images as a :class:`TrafficImageFile`, with the running statistics so that the
+        aggregation can be resumed by :meth:`load`
+
+        :param folder: output folder
+        :param dtype: dtype of the mean channels
+        :return: None
+        """
+        os.makedirs(folder, exist_ok=True)
+        for channel in self.channels:
+            np.save(os.path.join(folder, f"{channel}.npy"), self.get_channel(channel).astype(dtype))
+            for name, values in [("mean", self.mean), ("m2", self.m2), ("weight", self.weight),
+                                 ("count", self.count)]:
+                np.save(os.path.join(folder, f"{channel}_{name}.npy"), values[channel])
+        _write_index(folder, self, self.date_list, channels=self.channels,
+                     aggregator={"decay": self.decay, "step": self._step, "date_steps": self._date_steps})
+
+    @classmethod
+    def load(cls, folder):
+        """
+        Resume the aggregation saved by :meth:`save`
+
+        :param folder: str
+        :return: :class:`TrafficImageAggregator`
+        """
+        image_file = TrafficImageFile(folder)
+        with open(os.path.join(folder, TRAFFIC_IMAGE_INDEX_FILE), "r") as temp_file:
+            state = json.load(temp_file)["aggregator"]
+        aggregator = cls(state["decay"], image_file.channels)
+        aggregator._init_from_image(image_file)
+        for channel in aggregator.channels:
+            for name, values in [("mean", aggregator.mean), ("m2", aggregator.m2), ("weight", aggregator.weight),
+                                 ("count", aggregator.count)]:
+                values[channel] = np.load(os.path.join(folder, f"{channel}_{name}.npy"))
+        aggregator._step = state["step"]
+        aggregator._date_steps = state["date_steps"]
+        aggregator.date_list = image_file.date_list
+        return aggregator
+
+    def _init_from_image(self, image):
+        self.road_index = image.road_index
+        self.road_lengths = image.road_lengths
+        self.time_bins = image.time_bins
+        self.distance_interval = image.distance_interval
+        cell_nums = self.get_cell_nums()
+        self.road_offsets = np.append(0, np.cumsum(cell_nums))
+        shape = (int(self.road_offsets[-1]), self.time_bins.bin_num)
+        for channel in self.channels:
+            self.mean[channel] = np.zeros(shape)
+            self.m2[channel] = np.zeros(shape)
+            self.weight[channel] = np.zeros(shape)
+            self.count[channel] = np.zeros(shape, dtype=np.int64)
+
+    def _update(self, channel, values, weight):
+        """
+        Weighted Welford update, a negative weight removes the values
+        """
+        valid = np.isfinite(values)
+        values = np.where(valid, values, 0.0)
+        weights = np.where(valid, weight, 0.0)
+        mean, m2 = self.mean[channel], self.m2[channel]
+        total_weight = self.weight[channel] + weights
+        delta = values - mean
+        new_mean = mean + np.divide(weights * delta, total_weight, out=np.zeros(mean.shape),
+                                    where=total_weight > 0)
+        m2 += weights * delta * (values - new_mean)
+        self.count[channel] += np.where(valid, int(np.sign(weight)), 0)
+
+        # the cells without any day are reset to avoid the rounding residuals
+        is_empty = self.count[channel] <= 0
+        new_mean[is_empty] = 0
+        m2[is_empty | (m2 < 0)] = 0
+        total_weight[is_empty] = 0
+        self.mean[channel] = new_mean
+        self.weight[channel] = total_weight
+
+    def _get_road_channel(self, channel, road_loc, time_loc):
+        rows = slice(self.road_offsets[road_loc], self.road_offsets[road_loc + 1])
+        return np.where(self.count[channel][rows, time_loc] > 0, self.mean[channel][rows, time_loc], np.nan).T
+
+    @staticmethod
+    def _get_date_key(image, date):
+        return date if date is not None else "/".join(image.date_list)
+
+
+def read_traffic_image(folder):
+    """
+    Open the traffic images saved by :meth:`TrafficImage.save`
+
+    :param folder: str
+    :return: :class:`TrafficImageFile`
+    """
+    return TrafficImageFile(folder)
+
+
+def _write_index(folder, image, date_list, channels=TRAFFIC_IMAGE_CHANNELS, **kwargs):
+    cell_nums = image.get_cell_nums()
+    index = {"road_index": [str(val) for val in image.road_index], "road_lengths": image.road_lengths.tolist(),
+             "road_offsets": np.append(0, np.cumsum(cell_nums)).tolist(),
+             "resolution": image.time_bins.resolution, "start_tod": image.time_bins.start_tod,
+             "end_tod": image.time_bins.end_tod, "date_time_list": image.time_bins.date_time_list,
+             "distance_interval": image.distance_interval, "date_list": list(date_list),
+             "channels": list(channels)}
+    index.update(kwargs)
+    with open(os.path.join(folder, TRAFFIC_IMAGE_INDEX_FILE), "w") as temp_file:
+        json.dump(index, temp_file, indent=2)
+
+
+def _get_channel(channel, time_spent, distance_traveled, area):
+    if channel == "density":
+        return np.divide(time_spent, area, out=np.full(time_spent.shape, np.nan), where=area > 0) * 1000
+    if channel == "flow":
+        return np.divide(distance_traveled, area, out=np.full(time_spent.shape, np.nan), where=area > 0) * 3600
+    if channel == "speed":
+        return np.divide(distance_traveled, time_spent, out=np.full(time_spent.shape, np.nan),
+                         where=time_spent > 0)
+    raise KeyError(f"unknown channel {channel}")
+
+
+def build_traffic_images(points_df, road_lengths, time_bins, distance_interval, road_column="link_id",
+                         timezone_name=DEFAULT_TIMEZONE, distance_column="distance", max_gap=None):
+    """
+    Traffic images of all the roads and all the dates in one pass, see :func:`iter_traffic_images` to hold only
+    one date in memory
+
+    :return: dict {date: :class:`TrafficImage`}
+    """
+    return dict(iter_traffic_images(points_df, road_lengths, time_bins, distance_interval, road_column,
+                                    timezone_name, distance_column, max_gap))
+
+
+def iter_traffic_images(points_df, road_lengths, time_bins, distance_interval, road_column="link_id",
+                        timezone_name=DEFAULT_TIMEZONE, distance_column="distance", max_gap=None):
+    """
+    Traffic images of all the roads, one date at a time
+
+    The points of a trajectory are sorted by time, two consecutive points on the same road (and date) are a
+    segment, its time spent and distance traveled are added to the cell of its midpoint. The segments of all the
+    dates are found in one pass, then the cells of each date are summed by ``np.bincount`` when its image is
+    yielded, so the peak memory is one image whatever the number of dates.
+
+    :param points_df: `pandas.DataFrame` or `cores.utils.TrajectoryTable` of the matched points with columns
+        traj_id, timestamp, the road column and the distance (signed distance to the stop bar, negative upstream)
+    :param road_lengths: dict {road id: length (m)}, the points of the other roads are skipped
+    :param time_bins: `cores.utils.TimeBins`
+    :param distance_interval: length of the cells (m)
+    :param road_column: "link_id" or "movement_id"
+    :param timezone_name: timezone of the date and time bins
+    :param distance_column: column of the signed distance to the stop bar
+    :param max_gap: the points more than ``max_gap`` seconds apart are not connected
+    :return: generator of (date, :class:`TrafficImage`) in date order
+    """
+    traj_table = points_df if isinstance(points_df, TrajectoryTable) else \
+        TrajectoryTable(points_df, index_columns=())
+    df = traj_table.df
+    road_index = pd.Index(list(road_lengths.keys()))
+    lengths = np.array([road_lengths[road_id] for road_id in road_index], dtype=float)
+    empty_image = TrafficImage(road_index, lengths, time_bins, distance_interval)
+
+    timestamps = df[traj_table.time_column].values.astype(float)
+    road_codes = road_index.get_indexer(df[road_column].values)
+    positions = df[distance_column].values.astype(float) + lengths[road_codes]
+
+    # segments between the consecutive points of the same trajectory on the same road
+    is_segment = (traj_table.traj_codes[1:] == traj_table.traj_codes[:-1]) & \
+        (road_codes[1:] == road_codes[:-1]) & (road_codes[:-1] >= 0)
+    time_spent = np.diff(timestamps)
+    is_segment &= time_spent > 0
+    if max_gap is not None:
+        is_segment &= time_spent <= max_gap
+    segment_index = np.flatnonzero(is_segment)
+    time_spent = time_spent[segment_index]
+    distance_traveled = np.maximum(positions[segment_index + 1] - positions[segment_index], 0)
+    mid_times = (timestamps[segment_index] + timestamps[segment_index + 1]) * 0.5
+    mid_positions = (positions[segment_index] + positions[segment_index + 1]) * 0.5
+    segment_roads = road_codes[segment_index]
+
+    time_index = time_bins.get_bin_index_from_timestamp(mid_times, timezone_name)
+    distance_index = np.floor(mid_positions / distance_interval).astype(np.int64)
+    valid = (time_index >= 0) & (mid_positions >= 0) & (mid_positions <= lengths[segment_roads]) & \
+        np.isfinite(distance_traveled)
+    distance_index = np.minimum(distance_index, empty_image.shape[2] - 1)
+    date_codes, date_list = pd.factorize(get_local_date(mid_times[valid], timezone_name), sort=True)
+
+    cell_index = np.ravel_multi_index((segment_roads[valid], time_index[valid], distance_index[valid]),
+                                      empty_image.shape)
+    time_spent = time_spent[valid]
+    distance_traveled = distance_traveled[valid]
+    order = np.argsort(date_codes, kind="stable")
+    bounds = np.searchsorted(date_codes[order], np.arange(len(date_list) + 1))
+    cell_num = int(np.prod(empty_image.shape))
+    for idx, date in enumerate(date_list):
+        rows = order[bounds[idx]:bounds[idx + 1]]
+        total_time_spent = np.bincount(cell_index[rows], weights=time_spent[rows], minlength=cell_num)
+        total_distance_traveled = np.bincount(cell_index[rows], weights=distance_traveled[rows], minlength=cell_num)
+        yield date, TrafficImage(road_index, lengths, time_bins, distance_interval,
+                                 total_time_spent.reshape(empty_image.shape),
+                                 total_distance_traveled.reshape(empty_image.shape), [date])
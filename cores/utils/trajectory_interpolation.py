@@ -0,0 +1,124 @@
+"""
+Batch linear interpolation of the trajectories
+
+All the trajectories of a :class:`cores.utils.TrajectoryTable` are resampled together: the resample grid of each
+trajectory is described by its start time and point number (offsets), and the grid points of a batch of
+trajectories are located among the original points with one ``searchsorted`` on the time shifted by trajectory.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from .trajectory_table import TrajectoryTable
+
+INTERPOLATED_COLUMN = "interpolated"
+DEFAULT_BATCH_SIZE = 1000000
+
+
+def interpolate_trajectories(traj_table, numeric_columns, resolution=0.2, only_new=False, attribute_columns=None,
+                             align_to_clock=False, output_file=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Linear interpolation of all the trajectories
+
+    :param traj_table: `cores.utils.TrajectoryTable` or `pandas.DataFrame` of the points
+    :param numeric_columns: columns to interpolate, e.g., ["distance", "speed", "longitude", "latitude"]
+    :param resolution: time step of the resample grid (second)
+    :param only_new: True to only output the new points, otherwise the original points are also kept
+    :param attribute_columns: columns copied from the previous original point, e.g., ["movement_id"]
+    :param align_to_clock: True to align the grid to the multiples of the resolution, otherwise the grid starts
+        from the first point of each trajectory
+    :param output_file: csv file, the batches are appended to the file instead of being returned
+    :param batch_size: number of original points of each batch
+    :return: `pandas.DataFrame` with the column "interpolated" (1 for the new points), None if ``output_file``
+    """
+    batch_iter = iter_interpolate_trajectories(traj_table, numeric_columns, resolution, only_new,
+                                               attribute_columns, align_to_clock, batch_size)
+    if output_file is None:
+        df_list = list(batch_iter)
+        return pd.concat(df_list, ignore_index=True) if len(df_list) > 0 else None
+
+    if os.path.exists(output_file):
+        os.remove(output_file)
+    for df in batch_iter:
+        df.to_csv(output_file, mode="a", index=False, header=not os.path.exists(output_file))
+    return None
+
+
+def iter_interpolate_trajectories(traj_table, numeric_columns, resolution=0.2, only_new=False,
+                                  attribute_columns=None, align_to_clock=False, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Generator of :func:`interpolate_trajectories`, one `pandas.DataFrame` per batch of trajectories
+    """
+    if not isinstance(traj_table, TrajectoryTable):
+        traj_table = TrajectoryTable(traj_table, index_columns=())
+    attribute_columns = [] if attribute_columns is None else list(attribute_columns)
+    offsets = traj_table.traj_offsets
+    traj_start = 0
+    while traj_start < len(offsets) - 1:
+        traj_end = max(traj_start + 1, int(np.searchsorted(offsets, offsets[traj_start] + batch_size,
+                                                             side="right")) - 1)
+        traj_end = min(traj_end, len(offsets) - 1)
+        yield _interpolate_batch(traj_table, traj_start, traj_end, numeric_columns, resolution, only_new,
+                                 attribute_columns, align_to_clock)
+        traj_start = traj_end
+
+
+def _interpolate_batch(traj_table, traj_start, traj_end, numeric_columns, resolution, only_new,
+                       attribute_columns, align_to_clock):
+    """
+    Interpolate the trajectories ``[traj_start, traj_end)`` of the table
+    """
+    row_start, row_end = traj_table.traj_offsets[traj_start], traj_table.traj_offsets[traj_end]
+    batch_df = traj_table.df.iloc[row_start:row_end]
+    timestamps = batch_df[traj_table.time_column].values.astype(float)
+    point_offsets = traj_table.traj_offsets[traj_start:traj_end + 1] - row_start
+    point_nums = np.diff(point_offsets)
+    traj_codes = np.repeat(np.arange(traj_end - traj_start), point_nums)
+
+    # resample grid of each trajectory: start time and number of points
+    first_times, last_times = timestamps[point_offsets[:-1]], timestamps[point_offsets[1:] - 1]
+    grid_starts = np.ceil(np.round(first_times / resolution, 6)) * resolution if align_to_clock else first_times
+    grid_nums = np.maximum(np.floor(np.round((last_times - grid_starts) / resolution, 6)).astype(np.int64) + 1, 0)
+    grid_offsets = np.append(0, np.cumsum(grid_nums))
+    grid_codes = np.repeat(np.arange(len(grid_nums)), grid_nums)
+    grid_times = grid_starts[grid_codes] + (np.arange(grid_offsets[-1]) - grid_offsets[grid_codes]) * resolution
+
+    # shift the time of each trajectory so that the whole batch is sorted
+    shift = np.arange(len(first_times)) * (np.max(last_times - first_times) + 1.0) - first_times
+    shifted_times = timestamps + shift[traj_codes]
+    shifted_grid = grid_times + shift[grid_codes]
+    left = np.searchsorted(shifted_times, shifted_grid, side="right") - 1
+    left = np.clip(left, point_offsets[grid_codes], np.maximum(point_offsets[grid_codes + 1] - 2,
+                                                                  point_offsets[grid_codes]))
+    right = np.minimum(left + 1, point_offsets[grid_codes + 1] - 1)
+    time_gap = timestamps[right] - timestamps[left]
+    weights = np.divide(grid_times - timestamps[left], time_gap, out=np.zeros(len(grid_times)), where=time_gap > 0)
+    weights = np.clip(weights, 0, 1)
+
+    # the grid points at the time of an original point are not new
+    is_new = ~(np.isclose(grid_times, timestamps[left], rtol=0, atol=1e-6) |
+               np.isclose(grid_times, timestamps[right], rtol=0, atol=1e-6))
+    new_index = np.flatnonzero(is_new)
+    left, right, weights = left[new_index], right[new_index], weights[new_index]
+
+    new_data = {traj_table.traj_column: batch_df[traj_table.traj_column].values[left],
+                traj_table.time_column: grid_times[new_index]}
+    for column in numeric_columns:
+        values = batch_df[column].values.astype(float)
+        new_data[column] = values[left] + weights * (values[right] - values[left])
+    for column in attribute_columns:
+        new_data[column] = batch_df[column].values[left]
+    new_df = pd.DataFrame(new_data)
+    new_df[INTERPOLATED_COLUMN] = 1
+    if only_new:
+        return new_df
+
+    original_df = batch_df[[traj_table.traj_column, traj_table.time_column] + list(numeric_columns) +
+                           attribute_columns].reset_index(drop=True)
+    original_df[INTERPOLATED_COLUMN] = 0
+    # the new point goes after the original points before it
+    sort_key = np.concatenate([np.arange(len(original_df)) * 2.0, left * 2.0 + 1 + weights * 0.5])
+    output_df = pd.concat([original_df, new_df], ignore_index=True)
+    return output_df.iloc[np.argsort(sort_key, kind="stable")].reset_index(drop=True)
@@ -0,0 +1,150 @@
+"""
+Trajectory table sorted by trajectory and time
+
+The points are sorted once by ``(traj_id, timestamp)`` and the start offset of each trajectory is kept, so that a
+trajectory is a slice of the table (no copy, no scan). The secondary indexes (e.g., ``movement_id``,
+``junction_id``) keep the row positions of each key in the same order, so that a group and the trajectories in
+the group are found without scanning the table.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class TrajectoryTable(object):
+    """
+    Points of many trajectories, contiguous by trajectory
+
+    **Main Attributes**
+        - ``.df``: `pandas.DataFrame` sorted by ``(traj_column, time_column)`` with a range index
+        - ``.traj_index``: `pandas.Index` of the trajectory ids (sorted)
+        - ``.traj_offsets``: start row of each trajectory in ``.df``, and the number of rows at the end
+        - ``.traj_codes``: trajectory index of each row
+    """
+
+    def __init__(self, df, traj_column="traj_id", time_column="timestamp",
+                 index_columns=("movement_id", "junction_id")):
+        """
+
+        :param df: `pandas.DataFrame` of the points
+        :param traj_column: trajectory id column
+        :param time_column: time column
+        :param index_columns: columns of the secondary indexes built at once (the missing ones are skipped),
+            the other columns are indexed when first used
+        """
+        self.traj_column = traj_column
+        self.time_column = time_column
+        self.df = df.sort_values(by=[traj_column, time_column], kind="stable", ignore_index=True)
+
+        self.traj_codes, traj_uniques = pd.factorize(self.df[traj_column])
+        self.traj_index = pd.Index(traj_uniques)
+        self.traj_offsets = np.append(np.flatnonzero(np.diff(self.traj_codes, prepend=-1)), len(self.df))
+
+        self._secondary_indexes = {}
+        for column in index_columns:
+            if column in self.df.columns:
+                self._build_secondary_index(column)
+
+    def __len__(self):
+        return len(self.df)
+
+    @property
+    def traj_ids(self):
+        return self.traj_index
+
+    def get_trajectory(self, traj_id):
+        """
+        Points of the trajectory, a slice of ``.df``
+
+        :param traj_id: trajectory id
+        :return: `pandas.DataFrame`
+        """
+        traj_loc = self.traj_index.get_loc(traj_id)
+        return self.df.iloc[self.traj_offsets[traj_loc]:self.traj_offsets[traj_loc + 1]]
+
+    def get_trajectory_values(self, traj_id, column):
+        """
+        Values of one column of the trajectory, a view of the column array
+
+        :return: `numpy.ndarray`
+        """
+        traj_loc = self.traj_index.get_loc(traj_id)
+        return self.df[column].values[self.traj_offsets[traj_loc]:self.traj_offsets[traj_loc + 1]]
+
+    def get_keys(self, column):
+        """
+        Keys of the secondary index
+
+        :param column: column name
+        :return: `pandas.Index`
+        """
+        return self._get_secondary_index(column)[0]
+
+    def get_group_positions(self, column, key):
+        """
+        Rows of the key in ``.df``, ordered by trajectory and time
+
+        :return: `numpy.ndarray` of int64 (a view of the index), empty if the key does not exist
+        """
+        keys, positions, offsets = self._get_secondary_index(column)
+        key_loc = keys.get_indexer([key])[0]
+        if key_loc < 0:
+            return positions[:0]
+        return positions[offsets[key_loc]:offsets[key_loc + 1]]
+
+    def get_group(self, column, key):
+        """
+        Points of the key (e.g., all the points of a movement), ordered by trajectory and time
+
+        :return: `pandas.DataFrame`
+        """
+        return self.df.iloc[self.get_group_positions(column, key)]
+
+    def get_group_traj_ids(self, column, key):
+        """
+        Trajectories that have points of the key
+
+        :return: `pandas.Index`
+        """
+        traj_codes = self.traj_codes[self.get_group_positions(column, key)]
+        return self.traj_index[np.unique(traj_codes)]
+
+    def iter_trajectories(self, column=None, key=None):
+        """
+        Iterate the trajectories, or the part of each trajectory in a group if the column and key are given.
+        The contiguous parts are slices of ``.df``.
+
+        :return: generator of (traj_id, `pandas.DataFrame`)
+        """
+        if column is None:
+            for traj_loc, traj_id in enumerate(self.traj_index):
+                yield traj_id, self.df.iloc[self.traj_offsets[traj_loc]:self.traj_offsets[traj_loc + 1]]
+            return
+
+        positions = self.get_group_positions(column, key)
+        traj_codes = self.traj_codes[positions]
+        starts = np.flatnonzero(np.diff(traj_codes, prepend=-1))
+        ends = np.append(starts[1:], len(positions))
+        for start, end in zip(starts, ends):
+            first_row, last_row = positions[start], positions[end - 1]
+            if last_row - first_row == end - start - 1:
+                rows = slice(first_row, last_row + 1)
+            else:
+                rows = positions[start:end]
+            yield self.traj_index[traj_codes[start]], self.df.iloc[rows]
+
+    def _get_secondary_index(self, column):
+        if column not in self._secondary_indexes:
+            self._build_secondary_index(column)
+        return self._secondary_indexes[column]
+
+    def _build_secondary_index(self, column):
+        """
+        Row positions grouped by the key, the stable sort keeps the trajectory and time order in each group
+        """
+        codes, uniques = pd.factorize(self.df[column])
+        positions = np.argsort(codes, kind="stable")
+        sorted_codes = codes[positions]
+        offsets = np.searchsorted(sorted_codes, np.arange(len(uniques) + 1))
+        # the missing values have the code -1 and are placed before the first group
+        self._secondary_indexes[column] = (pd.Index(uniques), positions, offsets)
@@ -1,9 +1,13 @@
 from utils.ngsim_adapter import NgsimTrajectoryAdapter
+from utils.trajectory_cache import TrajectoryCache
 from mtldp.processes import Region, build_region_network, \
     split_points_df_into_region, region_map_match, region_trajectory_calculation
 
 
 file_location = 'E:/Data/Peachtree-Street-Atlanta-GA/NGSIM_Peachtree_Vehicle_Trajectories.csv'
+# the raw points (10 Hz) are decimated to one point per vehicle per second during ingest
+decimate_interval = 1.0
+cache_folder = f'E:/Data/Peachtree-Street-Atlanta-GA/ngsim_cache_{decimate_interval}s'
 
 # step 0: construct the region configuration.json file
 config_region = Region('peachtree/configuration.json')
@@ -12,8 +16,11 @@ config_region = Region('peachtree/configuration.json')
 network = build_region_network(config_region, save_to_local=True)
 exit()
 
-# step 2: read the raw data
-points_df = NgsimTrajectoryAdapter().load([file_location])[::10]
+# step 2: read the raw data (the raw csv is only parsed and decimated once into the columnar cache)
+trajectory_cache = TrajectoryCache(cache_folder)
+if not trajectory_cache.exists():
+    trajectory_cache.write(NgsimTrajectoryAdapter(decimate_interval=decimate_interval).iter_load([file_location]))
+points_df = trajectory_cache.load()
 
 # step 3: split trajectory data into region and date
 split_points_df_into_region(points_df, config_region, append=False)
@@ -1,7 +1,7 @@
 import pandas as pd
-import mtldp.mtltrajs as mtltrajs
 import mtldp.mtlmap as mtlmap
-from tqdm import tqdm
+
+import cores.utils as mtlutils
 
 network = mtlmap.build_network_from_xml(region_name='peachtree',
                                         file_name='peachtree/peachtree_filtered.osm',
@@ -15,27 +15,16 @@ corridor = mtlmap.Arterial(network, 'peachtree',
                            ref_node='69421277')
 
 points_df = pd.read_csv('peachtree/matched_trajs.csv')
-points_table = mtltrajs.OverallPoints()
-points_table.load_data(points_df)
-trajs_dict = points_table.get_trajs_dict(groupby='traj_id',
-                                         traj_attributes=['link_id', 'movement_id', 'junction_id'])
+traj_table = mtlutils.TrajectoryTable(points_df)
 
 # todo: call function get the traffic matrices, in application
 # todo: interpolation: for every 1 second (only keep new points)
 numeric_column = ["distance", "speed", "longitude", "latitude"]
-for trip_id, traj in tqdm(trajs_dict.dict.items()):
-    # if traj.traj_id == "1000-1163668":
-    #     a = points_table.df.loc[points_table.df["traj_id"] == "1000-1163668"]
-    #     print()
-    new_traj = mtltrajs.interpolation(traj, numeric_column, resolution=0.2, degree=1, inplace=False)
-    new_traj.df = new_traj.df.loc[new_traj.df["interpolated"] == 1]
-    new_traj.df = new_traj.df.drop(columns="interpolated")
-    trajs_dict.dict[trip_id] = new_traj
+# all the trips are interpolated together, set output_file to stream the batches to the csv
+interpolated_points_df = mtlutils.interpolate_trajectories(traj_table, numeric_column, resolution=0.2,
+                                                           only_new=True,
+                                                           attribute_columns=['link_id', 'movement_id',
+                                                                              'junction_id'])
+interpolated_points_df = interpolated_points_df.drop(columns="interpolated")
 
-# interpolated_points_df = trajs_dict.get_points_df(attributes="all")
-#
 # interpolated_points_df.to_csv("peachtree/interpolated_trajs.csv", index=False)
-
-# print()
-
-# points_df = trajs_dict.get_points_df(attributes='all')
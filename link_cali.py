@@ -1,17 +1,208 @@
-import pandas
+import numpy as np
 import pandas as pd
 
+from cores.utils import TimeBins, build_traffic_images
+
+# default (triangular) fundamental diagram of a lane for the lanesets without enough data
+DEFAULT_SAT_FLOW = 1800         # veh/h/lane
+DEFAULT_SHOCKWAVE = 5           # m/s
+# the "jam_density" column of links.csv keeps its original unit, the jam spacing (m/veh) read by the ctm, the
+# fitted jam density (veh/m/lane) is converted when it is written
+DEFAULT_JAM_SPACING = 7         # m/veh
+
+
+def link_calibration(filepath, traj_file=None, time_interval=30, distance_interval=20, output_file=None):
+    """
+    Fundamental diagram of each laneset, estimated from the matched trajectories of its link (see
+    :func:`fit_fundamental_diagrams`) if ``traj_file`` is given. The lanesets without enough data keep the speed
+    limit and the default parameters, the sat flow is per lane times the lane number of the laneset. The
+    "jam_density" column is the jam spacing (m/veh), same unit as the original links.csv.
+
+    :param filepath: csv of the static lanesets
+    :param traj_file: csv of the matched trajectories (link_id, traj_id, timestamp and distance)
+    :param time_interval: time interval of the Edie cells (second)
+    :param distance_interval: length of the Edie cells (m)
+    :param output_file: csv, default "calibration/links.csv"
+    :return: `pandas.DataFrame` of the calibrated lanesets
+    """
+    traj_data = None if traj_file is None else pd.read_csv(traj_file)
+    laneset = calibrate_lanesets(pd.read_csv(filepath), traj_data, time_interval, distance_interval)
+    laneset.to_csv('calibration/links.csv' if output_file is None else output_file, index=None)
+    return laneset
+
+
+def calibrate_lanesets(laneset_raw, traj_data=None, time_interval=30, distance_interval=20):
+    """
+    In-memory :func:`link_calibration`
+
+    :param laneset_raw: `pandas.DataFrame` of the static lanesets
+    :param traj_data: `pandas.DataFrame` of the matched trajectories, None to keep the default parameters
+    :param time_interval: time interval of the Edie cells (second)
+    :param distance_interval: length of the Edie cells (m)
+    :return: `pandas.DataFrame` of the calibrated lanesets
+    """
+    laneset_raw = laneset_raw.copy()
+    laneset_raw['sat_flow'] = laneset_raw['lane_number'] * DEFAULT_SAT_FLOW
+    laneset_raw['jam_density'] = DEFAULT_JAM_SPACING
+    laneset_raw['shockwave'] = DEFAULT_SHOCKWAVE
+
+    if traj_data is not None:
+        link_info = get_link_info(laneset_raw)
+        cells = get_fd_cells(traj_data, link_info, time_interval, distance_interval)
+        link_fd = fit_fundamental_diagrams(cells).reindex(laneset_raw['belonged_link'].astype(str).values)
+        calibrated = link_fd['calibrated'].fillna(False).astype(bool).values
+        fitted = link_fd['fitted'].fillna(False).astype(bool).values
+        laneset_raw['speed_limit'] = np.where(calibrated, link_fd['free_v'].values, laneset_raw['speed_limit'])
+        laneset_raw['sat_flow'] = np.where(fitted, link_fd['sat_flow'].values * laneset_raw['lane_number'],
+                                           laneset_raw['sat_flow'])
+        jam_spacing = np.divide(1, link_fd['jam_density'].values, out=np.full(len(laneset_raw), np.nan),
+                                where=fitted)
+        laneset_raw['jam_density'] = np.where(fitted, jam_spacing, DEFAULT_JAM_SPACING)
+        laneset_raw['shockwave'] = np.where(fitted, link_fd['shockwave'].values, DEFAULT_SHOCKWAVE)
 
-def link_calibration(filepath):
-    laneset_raw = pd.read_csv(filepath)
-    laneset_raw['sat_flow'] = laneset_raw['lane_number'] * 1800
-    laneset_raw['jam_density'] = 7
-    laneset_raw['shockwave'] = 5
     laneset = laneset_raw[
         ['laneset_id', 'length', 'speed_limit', 'lane_number', 'shockwave', 'jam_density', 'sat_flow']]
     laneset = laneset.rename(columns={'laneset_id': 'link_id', 'length': 'link_length', 'speed_limit': 'free_v'})
-    laneset.to_csv('calibration/links.csv', index=None)
+    return laneset
+
+
+def get_link_info(laneset_info):
+    """
+    Length and average lane number of each link from its lanesets, the parallel lanesets of a segment (e.g.,
+    the turning bays) are counted once in the length and summed in the lane number
+
+    :param laneset_info: `pandas.DataFrame` of the static lanesets
+    :return: `pandas.DataFrame` indexed by the link id (str) with columns "length" and "lane_number"
+    """
+    lanesets = laneset_info.astype({'belonged_link': str, 'belonged_segment': str})
+    segments = lanesets.groupby(['belonged_link', 'belonged_segment'], sort=False).agg(
+        length=('length', 'max'), lane_number=('lane_number', 'sum')).reset_index()
+    segments['lane_length'] = segments['length'] * segments['lane_number']
+    link_info = segments.groupby('belonged_link', sort=False)[['length', 'lane_length']].sum()
+    link_info['lane_number'] = link_info['lane_length'] / link_info['length']
+    return link_info[['length', 'lane_number']]
+
+
+def get_fd_cells(traj_data, link_info, time_interval=30, distance_interval=20, road_column='link_id'):
+    """
+    Edie cells of all the links and dates in one pass (:func:`cores.utils.build_traffic_images`), the
+    density and flow are per lane
+
+    :param traj_data: `pandas.DataFrame` of the matched trajectories
+    :param link_info: `pandas.DataFrame` of :func:`get_link_info`
+    :param time_interval: time interval of the cells (second)
+    :param distance_interval: length of the cells (m)
+    :param road_column: column of the link id
+    :return: `pandas.DataFrame` of the non-empty complete cells with columns road_id, "density" (veh/km/lane),
+        "flow" (veh/h/lane) and "speed" (m/s)
+    """
+    traj_data = traj_data.astype({road_column: str})
+    road_lengths = link_info['length'].to_dict()
+    time_bins = TimeBins(time_interval / 60)
+    cell_list = []
+    for traffic_image in build_traffic_images(traj_data, road_lengths, time_bins, distance_interval,
+                                              road_column=road_column).values():
+        cell_nums = traffic_image.get_cell_nums()
+        road_codes = np.repeat(np.arange(len(cell_nums)), cell_nums)
+        is_cell = np.arange(traffic_image.shape[2])[None, :] < cell_nums[:, None]
+        complete = traffic_image.cell_lengths[is_cell] >= distance_interval - 1e-9
+        lane_numbers = link_info['lane_number'].reindex(traffic_image.road_index).values[road_codes]
+        density = traffic_image.get_channel('density') / lane_numbers[:, None]
+        flow = traffic_image.get_channel('flow') / lane_numbers[:, None]
+        keep = complete[:, None] & (density > 0)
+        cell_list.append(pd.DataFrame({'road_id': traffic_image.road_index.values[
+                                           np.broadcast_to(road_codes[:, None], keep.shape)[keep]],
+                                       'density': density[keep], 'flow': flow[keep],
+                                       'speed': traffic_image.get_channel('speed')[keep]}))
+    if len(cell_list) == 0:
+        return pd.DataFrame(columns=['road_id', 'density', 'flow', 'speed'])
+    return pd.concat(cell_list, ignore_index=True)
+
+
+def fit_fundamental_diagrams(cells, free_flow_quantile=0.85, capacity_quantile=0.95, congested_quantile=0.9,
+                             min_cells=20, iterations=50):
+    """
+    Triangular fundamental diagram of all the roads at once
+
+        - free-flow speed: ``free_flow_quantile`` of the speed of the cells below the median density
+        - saturation flow: ``capacity_quantile`` of the flow
+        - congested branch: linear quantile regression (``congested_quantile``, upper envelope) of the flow on
+          the density of the cells above the critical density, solved for all the roads together by iteratively
+          reweighted least squares. The backward wave speed is the negative slope and the jam density is where
+          the line meets zero flow.
+
+    The saturation flow is only observed if the road is congested, so the congested branch, the saturation flow
+    and the jam density are only "fitted" for the roads with at least ``min_cells`` congested cells and a
+    negative slope, NaN otherwise.
+
+    :param cells: `pandas.DataFrame` of :func:`get_fd_cells`
+    :param free_flow_quantile: float
+    :param capacity_quantile: float
+    :param congested_quantile: float
+    :param min_cells: min number of the cells of a road (and of its congested cells for the regression)
+    :param iterations: iterations of the quantile regression
+    :return: `pandas.DataFrame` indexed by the road id with columns "free_v" (m/s), "sat_flow" (veh/h/lane),
+        "critical_density", "jam_density" (veh/m/lane), "shockwave" (m/s), "cell_num", "congested_num",
+        "calibrated" (the free-flow speed, False if the road has fewer than ``min_cells`` cells) and "fitted"
+        (the congested branch)
+    """
+    road_codes, road_index = pd.factorize(cells['road_id'])
+    road_num = len(road_index)
+    density = cells['density'].values.astype(float)
+    flow = cells['flow'].values.astype(float)
+    speed = cells['speed'].values.astype(float)
+    groups = pd.Series(density).groupby(road_codes)
+
+    is_free = density <= groups.transform('median').values
+    free_v = pd.Series(speed[is_free]).groupby(road_codes[is_free]).quantile(free_flow_quantile)
+    free_v = free_v.reindex(np.arange(road_num)).values
+    sat_flow = pd.Series(flow).groupby(road_codes).quantile(capacity_quantile).reindex(np.arange(road_num)).values
+    critical_density = sat_flow / (free_v * 3.6)
+
+    is_congested = density > critical_density[road_codes]
+    congested_codes = road_codes[is_congested]
+    intercept, slope = _batch_quantile_regression(density[is_congested], flow[is_congested], congested_codes,
+                                                  road_num, congested_quantile, iterations)
+    congested_num = np.bincount(congested_codes, minlength=road_num)
+    fitted = (congested_num >= min_cells) & (slope < 0) & (intercept > 0)
+
+    shockwave = np.where(fitted, -slope / 3.6, np.nan)
+    # jam density where the fitted line meets zero flow
+    jam_density = np.divide(intercept, -slope * 1000, out=np.full(road_num, np.nan), where=fitted)
+    sat_flow = np.where(fitted, sat_flow, np.nan)
+    cell_num = np.bincount(road_codes, minlength=road_num)
+    return pd.DataFrame({'free_v': free_v, 'sat_flow': sat_flow, 'critical_density': critical_density / 1000,
+                         'jam_density': jam_density, 'shockwave': shockwave, 'cell_num': cell_num,
+                         'congested_num': congested_num,
+                         'calibrated': (cell_num >= min_cells) & np.isfinite(free_v) & (free_v > 0),
+                         'fitted': fitted & (cell_num >= min_cells)},
+                        index=pd.Index(road_index, name='road_id'))
+
+
+def _batch_quantile_regression(x, y, codes, group_num, quantile, iterations):
+    """
+    Linear quantile regression ``y = intercept + slope * x`` of each group, iteratively reweighted least squares
+    with the weighted sums of all the groups computed by ``np.bincount``
+
+    :return: intercept `numpy.ndarray`, slope `numpy.ndarray` (NaN if the group has fewer than two points)
+    """
+    weights = np.ones(len(x))
+    intercept, slope = np.full(group_num, np.nan), np.full(group_num, np.nan)
+    for _ in range(iterations):
+        sums = [np.bincount(codes, weights=weights * val, minlength=group_num)
+                for val in (np.ones(len(x)), x, x * x, y, x * y)]
+        weight_sum, x_sum, xx_sum, y_sum, xy_sum = sums
+        determinant = weight_sum * xx_sum - x_sum * x_sum
+        valid = determinant > 1e-9 * np.maximum(weight_sum * xx_sum, 1e-12)
+        slope = np.divide(weight_sum * xy_sum - x_sum * y_sum, determinant, out=np.full(group_num, np.nan),
+                          where=valid)
+        intercept = np.divide(y_sum - slope * x_sum, weight_sum, out=np.full(group_num, np.nan), where=valid)
+        residuals = y - intercept[codes] - slope[codes] * x
+        # check loss weights, the points above the line weigh quantile / |r|
+        weights = np.where(residuals > 0, quantile, 1 - quantile) / np.maximum(np.abs(residuals), 1e-6)
+        weights = np.nan_to_num(weights)
+    return intercept, slope
 
 
 if __name__ == "__main__":
-    link_calibration('D:/osm-map-parser/output/peachtree/lanesets.csv')
\ No newline at end of file
+    link_calibration('D:/osm-map-parser/output/peachtree/lanesets.csv', 'peachtree/matched_trajs.csv')
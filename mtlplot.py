@@ -1,8 +1,8 @@
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import mtldp.mtlmap as mtlmap
-import mtldp.mtltrajs as mtltrajs
-import mtldp.mobility_utils as mtlmobility
+import cores.mtlmap as mtlmap
+
+import cores.utils as mtlutils
 
 
 network = mtlmap.build_network_from_xml(region_name='peachtree',
@@ -17,26 +17,19 @@ corridor = mtlmap.Arterial(network, 'peachtree',
                            ref_node='69421277')
 
 points_df = pd.read_csv('peachtree/matched_trajs.csv')
-points_table = mtltrajs.OverallPoints()
-
-points_table.load_data(points_df)
-trajs_dict = points_table.get_trajs_dict(groupby='traj_id',
-                                         traj_attributes=['link_id', 'movement_id', 'junction_id'])
-movement_trajs_dict = trajs_dict.groupby('movement_id')
-
-# todo: load spat data
+spat = pd.read_csv('calibration/spat.csv')
 
 for oneway in corridor.oneways.values():
-    fig, ax = plt.subplots()
     flip_figure = False
     if oneway.direction in ['S', 's', 'W', 'w']:
         flip_figure = True
     print(oneway.direction)
-    # todo: add plots here
-    # ax.plot(x_list, y_list, color='g')
-    mtlmobility.plot_path_ts(ax, oneway, movement_trajs_dict, flip=flip_figure)
-    distance_dict = oneway.distance_by_node
-    print(distance_dict)
-    plt.savefig(f"output/{oneway.direction}.png", dpi=300)
-    # plt.show()
-    plt.close()
+    oneway_points = points_df[points_df['movement_id'].isin(list(oneway.distance_by_movement.keys()))].copy()
+    oneway_points['distance'] = oneway.get_corridor_distance(oneway_points['movement_id'].values,
+                                                             oneway_points['distance'].values)
+    oneway_points = oneway_points[np.isfinite(oneway_points['distance'].values)]
+    # the trajectories are rasterized (one pixel per second and meter) with the signal bars at the stop bars
+    raster = mtlutils.render_time_space_diagram(oneway_points, time_resolution=1.0, distance_resolution=1.0,
+                                                value_column='speed', max_gap=10, spat=spat,
+                                                stop_bar_distance=oneway.distance_by_movement)
+    raster.save(f"output/{oneway.direction}.png", mode='value', flip=flip_figure)
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 
 
@@ -10,20 +11,20 @@ def connection_calibration(stat_connections, cali_data):
     """
     turning_ratio = pd.read_csv(cali_data)
     connections = pd.read_csv(stat_connections)
-    net_turning = pd.merge(connections, turning_ratio, on='movement_id', how='left')
-    movement_list = net_turning['movement_id'].values
-    upstream_list = net_turning['upstream_laneset'].values
+    laneset_connection = get_laneset_connection(connections, turning_ratio)
+    laneset_connection.to_csv('calibration/laneset_connection.csv', index=None)
 
-    connector_downstream = []
-    for movement in movement_list:
-        if movement in upstream_list:
-            connector_downstream.append(movement)
 
-    for downstream in connector_downstream:
-        data_sum = net_turning[net_turning['upstream_laneset'] == downstream].sum()
-        volume_sum = data_sum['volume']
-        idx = net_turning[net_turning['movement_id'] == downstream].index
-        net_turning.loc[idx, 'volume'] = volume_sum
+def get_laneset_connection(connections, turning_ratio):
+    """
+    Laneset connections with the diverge proportion from the movement volume
+
+    :param connections: `pandas.DataFrame` of the static connections
+    :param turning_ratio: `pandas.DataFrame` with columns ["movement_id", "volume"]
+    :return: `pandas.DataFrame` of the laneset connections
+    """
+    net_turning = pd.merge(connections, turning_ratio, on='movement_id', how='left')
+    net_turning['volume'] = propagate_connector_volume(net_turning)
 
     net_turning.dropna(subset=['volume'], inplace=True)
 
@@ -42,10 +43,44 @@ def connection_calibration(stat_connections, cali_data):
     laneset_connection['priority'] = 0
 
     # corrections
-    idx = laneset_connection[laneset_connection['diverge_prop'] == 1].index
-    laneset_connection.loc[idx, 'connection_type'] = 'ordinary'
+    laneset_connection['connection_type'] = laneset_connection['connection_type'].where(
+        laneset_connection['diverge_prop'] != 1, 'ordinary')
     laneset_connection['connection_id'] = laneset_connection['upstream_link']
-    laneset_connection.to_csv('calibration/laneset_connection.csv', index=None)
+    return laneset_connection
+
+
+def propagate_connector_volume(net_turning):
+    """
+    Volume of the connectors inside the links
+
+    A connector is a row whose "movement_id" is a laneset id (its downstream laneset), its volume is the total
+    volume leaving that laneset. The lanesets are resolved from downstream to upstream in topological order: at
+    each step, all the connectors whose downstream laneset has no unresolved outgoing row are resolved together
+    with one bincount, so a chain of any length takes one step per connector level. The connectors on a cycle
+    (if any) take the sum of the resolved volumes.
+
+    :param net_turning: `pandas.DataFrame` of the connections with columns "upstream_laneset", "movement_id"
+        and "volume" (NaN if unknown)
+    :return: `numpy.ndarray` of the volume of each row
+    """
+    laneset_index = pd.Index(pd.unique(net_turning['upstream_laneset']))
+    source_codes = laneset_index.get_indexer(net_turning['upstream_laneset'])
+    target_codes = laneset_index.get_indexer(net_turning['movement_id'])
+    laneset_num = len(laneset_index)
+
+    volume = net_turning['volume'].values.astype(float)
+    pending = target_codes >= 0
+    volume[pending] = np.nan
+    while np.any(pending):
+        pending_out = np.bincount(source_codes[pending], minlength=laneset_num)
+        ready = pending & (pending_out[target_codes] == 0)
+        if not np.any(ready):
+            # cycle, the remaining connectors take the resolved volumes
+            ready = pending
+        out_volume = np.bincount(source_codes, weights=np.nan_to_num(volume), minlength=laneset_num)
+        volume[ready] = out_volume[target_codes[ready]]
+        pending &= ~ready
+    return volume
 
 
 def demand_calibration(stat_lanesets, demand_data):
@@ -55,15 +90,29 @@ def demand_calibration(stat_lanesets, demand_data):
     :param demand_data:
     :return: pandas.DataFrame contains downstream laneset_id
     """
-    upstream_node_list = []
     laneset_info = pd.read_csv(stat_lanesets)
+    demand = pd.read_csv(demand_data)
+    laneset_demand = get_laneset_demand(laneset_info, demand)
+    laneset_demand.to_csv("calibration/laneset_demand.csv", index=None)
+
+
+def get_laneset_demand(laneset_info, demand):
+    """
+    Demand of the source lanesets
+
+    :param laneset_info: `pandas.DataFrame` of the static lanesets
+    :param demand: `pandas.DataFrame` with columns ["downstream", "vph"]
+    :return: `pandas.DataFrame` of the laneset demand
+    """
+    upstream_node_list = []
+    laneset_info = laneset_info.copy()
     link_list = laneset_info["belonged_link"].values
     for link in link_list:
         od_node = link.split('_')
         upstream_node_list.append(od_node[0])
     laneset_info["upstream"] = upstream_node_list
     laneset_info = laneset_info.rename(columns={"upstream": "downstream"})
-    demand = pd.read_csv(demand_data)
+    demand = demand.copy()
     demand["downstream"] = demand["downstream"].astype(str)
     laneset_demand_raw = pd.merge(demand, laneset_info, on="downstream")
     dup_laneset = laneset_demand_raw.duplicated('downstream', keep=False)
@@ -72,7 +121,7 @@ def demand_calibration(stat_lanesets, demand_data):
     laneset_demand = laneset_demand_raw[['laneset_id', 'vph']]
     laneset_demand = laneset_demand.reset_index()
     laneset_demand.rename(columns={'index': 'demand_id', 'laneset_id': 'downstream'})
-    laneset_demand.to_csv("calibration/laneset_demand.csv", index=None)
+    return laneset_demand
 
 
 if __name__ == "__main__":
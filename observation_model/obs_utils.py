@@ -2,6 +2,9 @@ import numpy as np
 import pandas as pd
 from ctm_network_adapter.ctm_adapter import CTMAdapter
 
+# upper bound of the jam density (veh/m/lane), i.e., 2 m jam spacing
+MAX_JAM_DENSITY = 0.5
+
 
 def get_free_flow_event(free_flow_points, ctm_net):
     """
@@ -61,6 +64,20 @@ def get_free_flow_event(free_flow_points, ctm_net):
 #
 
 
+def get_jam_density(ctm_link):
+    """
+    Jam density of a ctm link (veh/m/lane). The "jam_density" column of links.csv is the jam spacing (m/veh,
+    e.g., 7), the values above ``MAX_JAM_DENSITY`` are taken as the jam spacing and converted.
+
+    :param ctm_link:
+    :return: float
+    """
+    jam_density = ctm_link.fd_parameter.jam_density
+    if not jam_density > 0:
+        raise ValueError(f"jam density {jam_density} of link {ctm_link.link_id} is not positive")
+    return 1 / jam_density if jam_density > MAX_JAM_DENSITY else jam_density
+
+
 def get_stop_event(stop_points, ctm_net, upstream_cut_dis=50):
     """
     :param stop_points:
@@ -79,10 +96,10 @@ def get_stop_event(stop_points, ctm_net, upstream_cut_dis=50):
         ctm_link = ctm_net.links[ctm_link_id]
         stop_location = lane_dis + ctm_link.link_length
 
-        fd_parameters = ctm_link.fd_parameter
+        jam_density = get_jam_density(ctm_link)
         lane_number = ctm_link.lane_number
-        half_jam_headway = 1 / fd_parameters.jam_density / 2
-        single_lane_jam_veh = fd_parameters.jam_density * ctm_link.cell_length
+        half_jam_headway = 1 / jam_density / 2
+        single_lane_jam_veh = jam_density * ctm_link.cell_length
 
         start_dis = stop_location - half_jam_headway
         end_dis = stop_location + half_jam_headway
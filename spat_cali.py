@@ -1,24 +1,28 @@
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
+from cores.utils import TrajectoryTable
+
+SPAT_COLUMNS = ["junction_id", "movement_index", "signal_state", "start_time", "end_time"]
+
 
 def spat_cali(file_path):
     traj_data = pd.read_csv(file_path)
     junctions = traj_data["junction_id"].unique()
+    traj_table = TrajectoryTable(traj_data)
     for junction in junctions:
-        junction_data = traj_data[traj_data["junction_id"] == junction]
+        junction_data = traj_table.get_group("junction_id", junction)
 
         movements = junction_data["movement_id"].unique()
         if junction == junctions[2]:
             for movement in movements:
-                movement_data = junction_data[junction_data["movement_id"] == movement]
-                trajs = movement_data["traj_id"].unique()
+                trajs = traj_table.get_group_traj_ids("movement_id", movement)
                 if len(trajs) < 50:
                     continue
-                for traj in trajs:
-                    traj_data = movement_data[movement_data["traj_id"] == traj]
-                    time = traj_data["timestamp"].values
-                    distance = traj_data["distance"].values
+                for _, movement_traj in traj_table.iter_trajectories("movement_id", movement):
+                    time = movement_traj["timestamp"].values
+                    distance = movement_traj["distance"].values
                     plt.plot(time, distance, color='gray')
                 print(movement)
                 print(junction)
@@ -28,15 +32,255 @@ def spat_cali(file_path):
             continue
 
 
+def get_stop_bar_events(traj_table, stop_speed=1.0, stop_distance=60.0):
+    """
+    Stop and discharge events of all the trajectories near the stop bar, computed on the whole table at once
+
+    The distance is the signed distance to the stop bar (negative before the stop bar). A point is stopped if its
+    speed is not larger than ``stop_speed`` within ``stop_distance`` before the stop bar. The speed column is
+    used if it exists, otherwise the speed is the distance difference over the time difference.
+
+    :param traj_table: `cores.utils.TrajectoryTable` or `pandas.DataFrame` of the matched trajectories
+    :param stop_speed: speed threshold of the stopped points (m/s)
+    :param stop_distance: distance before the stop bar of the stopped points (m)
+    :return: `pandas.DataFrame` with one row per (traj_id, movement_id) and columns junction_id,
+        "crossing_time" (time of crossing the stop bar, NaN if not observed), "stop_start" and "stop_end"
+        (first and last stopped time, the stop end is the discharge, NaN if not stopped)
+    """
+    if not isinstance(traj_table, TrajectoryTable):
+        traj_table = TrajectoryTable(traj_table, index_columns=())
+    df = traj_table.df.dropna(subset=["movement_id"])
+    timestamps = df[traj_table.time_column].values.astype(float)
+    distance = df["distance"].values.astype(float)
+    traj_codes = traj_table.traj_codes[df.index.values]
+    movement_codes, movement_uniques = pd.factorize(df["movement_id"])
+
+    # the rows are sorted by trajectory and time, a group is a contiguous run of the same movement
+    group_start = np.ones(len(df), dtype=bool)
+    group_start[1:] = (traj_codes[1:] != traj_codes[:-1]) | (movement_codes[1:] != movement_codes[:-1])
+    group_codes = np.cumsum(group_start) - 1
+    first_rows = np.flatnonzero(group_start)
+    same_group = ~group_start[1:]
+
+    # crossing time, linear interpolation between the last point before and the first point after the stop bar
+    crossing = np.flatnonzero(same_group & (distance[:-1] < 0) & (distance[1:] >= 0))
+    crossing_ratio = -distance[crossing] / (distance[crossing + 1] - distance[crossing])
+    crossing_time = np.full(len(first_rows), np.inf)
+    # the first crossing of the group is kept
+    np.minimum.at(crossing_time, group_codes[crossing],
+                  timestamps[crossing] + crossing_ratio * (timestamps[crossing + 1] - timestamps[crossing]))
+    crossing_time[np.isinf(crossing_time)] = np.nan
+
+    if "speed" in df.columns:
+        speed = np.abs(df["speed"].values.astype(float))
+    else:
+        time_diff = np.diff(timestamps)
+        forward_speed = np.divide(np.abs(np.diff(distance)), time_diff, out=np.full(len(time_diff), np.inf),
+                                  where=time_diff > 0)
+        forward_speed[~same_group] = np.inf
+        # forward difference, the last point of each group uses the backward difference
+        speed = np.append(forward_speed, np.inf)
+        group_last = np.append(~same_group, True)
+        speed[group_last] = np.append(np.inf, forward_speed)[group_last]
+    stopped = np.flatnonzero((speed <= stop_speed) & (distance < 0) & (distance >= -stop_distance))
+    stop_start = np.full(len(first_rows), np.inf)
+    stop_end = np.full(len(first_rows), -np.inf)
+    np.minimum.at(stop_start, group_codes[stopped], timestamps[stopped])
+    np.maximum.at(stop_end, group_codes[stopped], timestamps[stopped])
+    stop_start[np.isinf(stop_start)] = np.nan
+    stop_end[np.isinf(stop_end)] = np.nan
+
+    return pd.DataFrame({"traj_id": traj_table.traj_index.values[traj_codes[first_rows]],
+                         "movement_id": movement_uniques[movement_codes[first_rows]],
+                         "junction_id": df["junction_id"].values[first_rows],
+                         "crossing_time": crossing_time, "stop_start": stop_start, "stop_end": stop_end})
+
+
+def get_cycle_scores(crossing_times, cycle_lengths, bin_seconds=1.0, noise_ratio=0.1):
+    """
+    Score of each candidate cycle length: the crossing times are folded by the cycle length, the score is the
+    longest (circular) run of phase bins without crossings over the cycle length, i.e., the fraction of the cycle
+    seen as red by the movement. A wrong candidate spreads the crossings over the phase and has no long run. All
+    the candidates are folded at once.
+
+    :param crossing_times: `numpy.ndarray` of the stop bar crossing times of a movement
+    :param cycle_lengths: `numpy.ndarray` of the candidate cycle lengths (second)
+    :param bin_seconds: width of the phase bins (second)
+    :param noise_ratio: a phase bin with no more than ``noise_ratio`` times the average crossings per bin
+        (the crossings over the bin number) is seen as empty (e.g., red light running)
+    :return: `numpy.ndarray` of the scores in [0, 1], NaN if no bin is occupied
+    """
+    bin_nums = np.ceil(cycle_lengths / bin_seconds).astype(np.int64)
+    width = int(bin_nums.max())
+    phase_bins = np.minimum((np.mod(crossing_times[None, :], cycle_lengths[:, None]) / bin_seconds).astype(np.int64),
+                            bin_nums[:, None] - 1)
+    flat_index = (np.arange(len(cycle_lengths))[:, None] * width + phase_bins).ravel()
+    counts = np.bincount(flat_index, minlength=len(cycle_lengths) * width).reshape(len(cycle_lengths), width)
+    occupied = counts > noise_ratio * len(crossing_times) / bin_nums[:, None]
+    has_occupied = np.any(occupied, axis=1)
+
+    # the bins are repeated once so that the run across the end of the cycle is found
+    positions = np.arange(2 * width)
+    bin_index = np.mod(positions[None, :], bin_nums[:, None])
+    is_valid = positions[None, :] < 2 * bin_nums[:, None]
+    occupied = np.take_along_axis(occupied, bin_index, axis=1) | ~is_valid
+    last_occupied = np.maximum.accumulate(np.where(occupied, positions[None, :], -1), axis=1)
+    longest_run = np.minimum(np.max(np.where(is_valid, positions[None, :] - last_occupied, 0), axis=1), bin_nums)
+    return np.where(has_occupied, longest_run / bin_nums, np.nan)
+
+
+def estimate_cycle_length(crossing_list, cycle_range=(40, 180), cycle_step=0.5, bin_seconds=1.0, noise_ratio=0.1,
+                          tolerance=0.9):
+    """
+    Common cycle length of the movements of a junction, the scores of the movements are summed weighted by their
+    crossing numbers, the candidates with no occupied bin for any movement are dropped. The red fraction of the
+    multiples of the cycle length is not larger, the shortest candidate within ``tolerance`` of the best score is
+    taken.
+
+    :param crossing_list: list of `numpy.ndarray`, the crossing times of each movement
+    :param cycle_range: (min, max) of the candidate cycle lengths (second)
+    :param cycle_step: step of the candidate cycle lengths (second)
+    :param bin_seconds: see :func:`get_cycle_scores`
+    :param noise_ratio: see :func:`get_cycle_scores`
+    :param tolerance: ratio to the best score
+    :return: cycle length (second), None if there is no crossing or no valid candidate
+    """
+    cycle_lengths = np.arange(cycle_range[0], cycle_range[1] + cycle_step * 0.5, cycle_step)
+    scores = np.zeros(len(cycle_lengths))
+    for crossing_times in crossing_list:
+        if len(crossing_times) > 0:
+            scores += len(crossing_times) * get_cycle_scores(crossing_times, cycle_lengths, bin_seconds,
+                                                             noise_ratio)
+    scores = np.where(np.isnan(scores), -np.inf, scores)
+    if np.max(scores) <= 0:
+        return None
+    return float(cycle_lengths[np.flatnonzero(scores >= tolerance * np.max(scores))[0]])
+
+
+def estimate_movement_timing(crossing_times, discharge_times, cycle_length, noise_ratio=0.1, bin_seconds=1.0):
+    """
+    Green start (offset) and green duration of a movement given the cycle length
+
+    The red is the largest gap between the folded crossing times (the sparse phase bins are dropped as noise).
+    The stopped vehicles start to discharge at the start of the green, so the green start is moved earlier to
+    the low percentile of the discharge phases within the red if they are earlier than the first crossing.
+
+    :param crossing_times: `numpy.ndarray` of the stop bar crossing times
+    :param discharge_times: `numpy.ndarray` of the stop end times of the stopped vehicles
+    :param cycle_length: cycle length (second)
+    :param noise_ratio: see :func:`get_cycle_scores`
+    :param bin_seconds: see :func:`get_cycle_scores`
+    :return: offset (green start modulo the cycle length, referenced to timestamp 0), green duration (second)
+    """
+    phases = np.mod(crossing_times, cycle_length)
+    bin_num = int(np.ceil(cycle_length / bin_seconds))
+    phase_bins = np.minimum((phases / bin_seconds).astype(np.int64), bin_num - 1)
+    counts = np.bincount(phase_bins, minlength=bin_num)
+    phases = np.sort(phases[counts[phase_bins] > noise_ratio * len(crossing_times) / bin_num])
+    if len(phases) == 0:
+        phases = np.sort(np.mod(crossing_times, cycle_length))
+
+    gaps = np.diff(np.append(phases, phases[0] + cycle_length))
+    gap_index = int(np.argmax(gaps))
+    red_start, red_duration = phases[gap_index], gaps[gap_index]
+
+    discharge = np.mod(discharge_times - red_start, cycle_length)
+    discharge = discharge[discharge < red_duration]
+    if len(discharge) > 0:
+        red_duration = min(red_duration, float(np.percentile(discharge, 10)))
+    return float(np.mod(red_start + red_duration, cycle_length)), float(cycle_length - red_duration)
+
+
+def infer_spat(traj_data, stop_speed=1.0, stop_distance=60.0, cycle_range=(40, 180), cycle_step=0.5,
+               min_crossings=20, noise_ratio=0.1):
+    """
+    Fixed-time SPaT of each movement inferred from the matched trajectories
+
+    The stop and discharge events of all the trajectories are detected at once (:func:`get_stop_bar_events`),
+    the cycle length is estimated per junction from the crossings of all its movements, then the offset and the
+    green duration are estimated per movement. The green intervals are repeated over the time span of the
+    crossings of each movement.
+
+    :param traj_data: `pandas.DataFrame` or `cores.utils.TrajectoryTable` of the matched trajectories with
+        columns traj_id, timestamp, movement_id, junction_id and distance (and optionally speed)
+    :param stop_speed: see :func:`get_stop_bar_events`
+    :param stop_distance: see :func:`get_stop_bar_events`
+    :param cycle_range: see :func:`estimate_cycle_length`
+    :param cycle_step: see :func:`estimate_cycle_length`
+    :param min_crossings: the movements with fewer crossings are skipped
+    :param noise_ratio: see :func:`get_cycle_scores`
+    :return: spat `pandas.DataFrame` (same columns as spat.csv), timing plan `pandas.DataFrame` with columns
+        junction_id, movement_index, cycle_length, offset, green_duration, crossing_num and stop_num
+    """
+    events = get_stop_bar_events(traj_data, stop_speed, stop_distance)
+    events = events.dropna(subset=["crossing_time"])
+    spat_list, plan_list = [], []
+    for junction_id, junction_events in events.groupby("junction_id", sort=False):
+        movement_events = [(movement_id, movement_df) for movement_id, movement_df
+                           in junction_events.groupby("movement_id", sort=False)
+                           if len(movement_df) >= min_crossings]
+        cycle_length = estimate_cycle_length([movement_df["crossing_time"].values
+                                              for _, movement_df in movement_events],
+                                             cycle_range, cycle_step, noise_ratio=noise_ratio)
+        if cycle_length is None:
+            continue
+        for movement_id, movement_df in movement_events:
+            crossing_times = movement_df["crossing_time"].values
+            discharge_times = movement_df["stop_end"].dropna().values
+            offset, green_duration = estimate_movement_timing(crossing_times, discharge_times, cycle_length,
+                                                              noise_ratio)
+            plan_list.append({"junction_id": junction_id, "movement_index": movement_id,
+                              "cycle_length": cycle_length, "offset": offset, "green_duration": green_duration,
+                              "crossing_num": len(crossing_times), "stop_num": len(discharge_times)})
+
+            first_cycle = np.floor((crossing_times.min() - offset) / cycle_length)
+            last_cycle = np.floor((crossing_times.max() - offset) / cycle_length)
+            green_start = offset + np.arange(first_cycle, last_cycle + 1) * cycle_length
+            spat_list.append(pd.DataFrame({"junction_id": junction_id, "movement_index": movement_id,
+                                           "signal_state": "g",
+                                           "start_time": np.round(green_start).astype(np.int64),
+                                           "end_time": np.round(green_start + green_duration).astype(np.int64)}))
+
+    spat = pd.concat(spat_list, ignore_index=True) if len(spat_list) > 0 else pd.DataFrame(columns=SPAT_COLUMNS)
+    return spat, pd.DataFrame(plan_list)
+
+
+def spat_calibration(file_path, spat_file="calibration/spat.csv", connection_file=None):
+    """
+    Write the inferred spat.csv, and laneset_spat.csv if the connection file is given
+
+    :param file_path: csv of the matched trajectories
+    :param spat_file: output spat csv
+    :param connection_file: csv of the static connections
+    :return: timing plan `pandas.DataFrame`, see :func:`infer_spat`
+    """
+    spat, plan = infer_spat(pd.read_csv(file_path))
+    spat.to_csv(spat_file, index=None)
+    if connection_file is not None:
+        net_spat_cali(spat_file, connection_file)
+    return plan
+
+
 def net_spat_cali(spat_file, connection_file):
-    spat_raw = pd.read_csv(spat_file)
-    connection = pd.read_csv(connection_file)
+    laneset_spat = get_laneset_spat(pd.read_csv(spat_file), pd.read_csv(connection_file))
+    laneset_spat.to_csv('calibration/laneset_spat.csv', index=None)
+
+
+def get_laneset_spat(spat_raw, connection):
+    """
+    SPaT of the upstream lanesets of each movement
+
+    :param spat_raw: `pandas.DataFrame` of the spat (see :func:`infer_spat`)
+    :param connection: `pandas.DataFrame` of the static connections
+    :return: `pandas.DataFrame` with columns spat_id, upstream_laneset, start_time and end_time
+    """
     spat = spat_raw.rename(columns={'movement_index': 'movement_id'})
     laneset_spat = pd.merge(spat, connection, on='movement_id', how='left')
     laneset_spat = laneset_spat[['upstream_laneset', 'start_time', 'end_time']]
-    laneset_spat.to_csv('calibration/laneset_spat.csv')
+    return laneset_spat.rename_axis('spat_id').reset_index()
 
 
 if __name__ == "__main__":
     # spat_cali('peachtree/matched_trajs.csv')
+    # spat_calibration('peachtree/matched_trajs.csv')
     net_spat_cali('calibration/spat.csv', 'D:/osm-map-parser/output/peachtree/connections.csv')
@@ -1,23 +1,15 @@
 import pandas as pd
 
+from turning_ratio import get_movement_volume
+
 traj_data = pd.read_csv('peachtree/matched_trajs.csv')
 junctions = traj_data["junction_id"].unique()
-flag = 0
-turning = []
-for junction in junctions:
-    time = []
-    distance = []
-    junction_data = traj_data[traj_data["junction_id"] == junction]
-
-    movements = junction_data["movement_id"].unique()
-    for movement in movements:
-        movement_data = junction_data[junction_data["movement_id"] == movement]
-        trajs = movement_data["traj_id"].unique()
-        links = movement.split('_')
-        turning.append([movement, len(trajs), int(links[0]), links[1]])
+volume = get_movement_volume(traj_data)
+links = volume["movement_id"].str.split('_', expand=True)
+turning = [volume["movement_id"].values, volume["volume"].values, links[0].astype(int).values, links[1].values]
 
-raw_turning = pd.DataFrame(turning, columns=['movement_id', 'volume', 'upstream', 'junction'])
-volume_sum = raw_turning.groupby('upstream').sum().reset_index()
+raw_turning = pd.DataFrame(dict(zip(['movement_id', 'volume', 'upstream', 'junction'], turning)))
+volume_sum = raw_turning.groupby('upstream')[['volume']].sum().reset_index()
 volume_sum = volume_sum.rename(columns={'volume': 'volume_sum'})
 turning = pd.merge(raw_turning, volume_sum, on='upstream')
 turning["turning_ratio"] = turning["volume"] / turning["volume_sum"]
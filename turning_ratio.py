@@ -1,40 +1,218 @@
+import os
+
+import numpy as np
 import pandas as pd
 
+from cores.utils import TimeBins
+from cores.utils.time_utils import DEFAULT_TIMEZONE, get_local_seconds
+from net_cali import get_laneset_connection, get_laneset_demand
 
-def demand_and_turning_calibration(file):
-    traj_data = pd.read_csv(file)
-    junctions = traj_data["junction_id"].unique()
-    flag = 0
-    turning = []
-    for junction in junctions:
-        time = []
-        distance = []
-        junction_data = traj_data[traj_data["junction_id"] == junction]
-
-        movements = junction_data["movement_id"].unique()
-        for movement in movements:
-            movement_data = junction_data[junction_data["movement_id"] == movement]
-            trajs = movement_data["traj_id"].unique()
-            links = movement.split('_')
-            turning.append([movement, len(trajs), int(links[0]), links[1], links[2]])
-
-    raw_turning = pd.DataFrame(turning, columns=['movement_id', 'volume', 'upstream', 'junction', 'downstream'])
-    volume_sum = raw_turning.groupby(['junction', 'upstream']).sum().reset_index()
-
-    volume_sum = volume_sum.rename(columns={'volume': 'volume_sum'})
-    turning = pd.merge(raw_turning, volume_sum, on=['upstream','junction'])
+
+def get_movement_volume(traj_data, day_column=None):
+    """
+    Number of trajectories of each movement in one groupby pass
+
+    :param traj_data: `pandas.DataFrame` of the matched trajectories
+    :param day_column: column of the day for the multi-day data, the same traj_id on different days
+        are counted as different trajectories
+    :return: `pandas.DataFrame` with columns ["junction_id", "movement_id", "volume"], ordered by the first
+             appearance of the junction and then of the movement
+    """
+    traj_key = traj_data["traj_id"] if day_column is None else \
+        traj_data[day_column].astype(str) + "/" + traj_data["traj_id"].astype(str)
+    volume = traj_key.groupby([traj_data["junction_id"], traj_data["movement_id"]], sort=False).nunique()
+    volume = volume.rename("volume").reset_index()
+    junction_order = pd.Index(traj_data["junction_id"].unique()).get_indexer(volume["junction_id"])
+    return volume.iloc[np.argsort(junction_order, kind="stable")].reset_index(drop=True)
+
+
+def get_turning_and_demand(traj_data, period_hours=0.25, day_column=None):
+    """
+    Turning ratio of each movement and the demand of the source links
+
+    :param traj_data: `pandas.DataFrame` of the matched trajectories
+    :param period_hours: duration of the data of each day (hour), the volume is divided by it to get vph
+    :param day_column: column of the day for the multi-day data, the demand is averaged over the days
+    :return: turning `pandas.DataFrame`, demand `pandas.DataFrame`
+    """
+    volume = get_movement_volume(traj_data, day_column)
+    links = volume["movement_id"].str.split("_", expand=True)
+    raw_turning = pd.DataFrame({"movement_id": volume["movement_id"].values, "volume": volume["volume"].values,
+                                "upstream": links[0].astype(int).values, "junction": links[1].values,
+                                "downstream": links[2].values})
+    turning = raw_turning.copy()
+    turning["volume_sum"] = raw_turning.groupby(["junction", "upstream"])["volume"].transform("sum")
     turning["turning_ratio"] = turning["volume"] / turning["volume_sum"]
-    turning.to_csv("./output/turning.csv", index=None)
 
-    turning_idx = turning.set_index("upstream")
-    demand = turning_idx.drop(labels=junctions).reset_index()
-    demand['volume_sum'] = demand['volume_sum'] * 4
-    demand = demand[['upstream', 'volume_sum']]
-    demand.drop_duplicates(inplace=True)
-    demand = demand.rename(columns={'volume_sum': 'vph'})
-    demand = demand.rename(columns={'upstream': 'downstream'})
-    demand.to_csv('./output/demand.csv', index=None)
+    # the links from the boundary (not from any junction) are the sources
+    day_num = 1 if day_column is None else traj_data[day_column].nunique()
+    junctions = traj_data["junction_id"].unique()
+    demand = turning.loc[~turning["upstream"].isin(junctions), ["upstream", "volume_sum"]].drop_duplicates()
+    demand["volume_sum"] = demand["volume_sum"] / (period_hours * day_num)
+    demand = demand.rename(columns={"upstream": "downstream", "volume_sum": "vph"}).reset_index(drop=True)
+    return turning, demand
+
+
+class TurningProfileAggregator(object):
+    """
+    Streaming per-(movement, time bin) volume of the matched trajectories
+
+    Each trajectory is counted once per movement, in the time bin of its first point on the movement. The counts
+    are kept in a ``(movement, bin)`` array, so the demand and turning ratio time series can be emitted at any time
+    without reading the previous chunks again. The chunks of a trajectory should arrive in time order, only the
+    last movement of each open trajectory is kept to continue it in the next chunk, the trajectories of the days
+    before the previous day of the latest data are closed.
+
+    **Main Attributes**
+        - ``.time_bins``: `cores.utils.TimeBins`
+        - ``.movement_index``: `pandas.Index` of the movement ids
+        - ``.counts``: `numpy.ndarray` of int64, ``(movement, bin)`` trajectory counts (summed over the days)
+        - ``.day_num``: number of local days in the data
+    """
+
+    def __init__(self, time_bins=None, timezone_name=DEFAULT_TIMEZONE):
+        """
+
+        :param time_bins: `cores.utils.TimeBins`, default 15-minute bins
+        :param timezone_name: timezone of the timestamp
+        """
+        self.time_bins = TimeBins(15) if time_bins is None else time_bins
+        self.timezone_name = timezone_name
+        self.movement_index = pd.Index([], dtype=object)
+        self.counts = np.zeros((0, self.time_bins.bin_num), dtype=np.int64)
+        self.junctions = set()
+        self._days = set()
+        self._last_movements = pd.DataFrame({"day": pd.Series([], dtype=float),
+                                             "movement_id": pd.Series([], dtype=object)})
+
+    @property
+    def day_num(self):
+        return max(len(self._days), 1)
 
+    def update(self, traj_data):
+        """
+        Add a chunk of the matched trajectories
+
+        :param traj_data: `pandas.DataFrame` with columns traj_id, movement_id, junction_id and timestamp
+        :return: None
+        """
+        traj_data = traj_data.dropna(subset=["movement_id", "junction_id"])
+        if len(traj_data) == 0:
+            return
+        timestamps = traj_data["timestamp"].values.astype(float)
+        local_days = np.floor(get_local_seconds(timestamps, self.timezone_name) / 86400)
+        self._days.update(np.unique(local_days).tolist())
+        self.junctions.update(traj_data["junction_id"].unique().tolist())
+
+        # first point of each (day, trajectory, movement) in the chunk
+        traj_codes = pd.factorize(traj_data["traj_id"])[0]
+        movement_codes, movement_uniques = pd.factorize(traj_data["movement_id"])
+        order = np.lexsort((timestamps, movement_codes, traj_codes, local_days))
+        group_key = np.stack([local_days[order], traj_codes[order], movement_codes[order]])
+        first_rows = order[np.flatnonzero(np.any(np.diff(group_key, axis=1, prepend=-1) != 0, axis=0))]
+
+        # the trajectories continuing their last movement of the previous chunks are already counted
+        traj_ids = traj_data["traj_id"].values
+        previous = self._last_movements.reindex(traj_ids[first_rows])
+        is_new = ~((previous["day"].values == local_days[first_rows]) &
+                   (previous["movement_id"].values == movement_uniques[movement_codes[first_rows]]))
+        self._update_last_movements(traj_ids, traj_codes, movement_uniques[movement_codes], local_days, timestamps)
+        first_rows = first_rows[is_new]
+
+        bin_index = self.time_bins.get_bin_index_from_timestamp(timestamps[first_rows], self.timezone_name)
+        new_movements = pd.Index(movement_uniques).difference(self.movement_index)
+        if len(new_movements) > 0:
+            self.movement_index = self.movement_index.append(new_movements)
+            self.counts = np.vstack([self.counts, np.zeros((len(new_movements), self.time_bins.bin_num),
+                                                           dtype=np.int64)])
+        movement_loc = self.movement_index.get_indexer(movement_uniques)[movement_codes[first_rows]]
+        valid = bin_index >= 0
+        np.add.at(self.counts, (movement_loc[valid], bin_index[valid]), 1)
+
+    def _update_last_movements(self, traj_ids, traj_codes, movement_ids, local_days, timestamps):
+        order = np.lexsort((timestamps, traj_codes))
+        last_rows = order[np.append(np.diff(traj_codes[order]) != 0, True)]
+        last_movements = pd.DataFrame({"day": local_days[last_rows], "movement_id": movement_ids[last_rows]},
+                                      index=traj_ids[last_rows])
+        last_movements = pd.concat([self._last_movements[~self._last_movements.index.isin(last_movements.index)],
+                                    last_movements])
+        self._last_movements = last_movements[last_movements["day"].values >= max(self._days) - 1]
+
+    def get_turning_profile(self):
+        """
+        Turning ratio of each movement in each time bin, same columns as turning.csv with "start_time"
+
+        :return: `pandas.DataFrame`
+        """
+        links = self.movement_index.to_series().str.split("_", expand=True)
+        upstream = links[0].astype(int).values
+        junction = links[1].values
+        group_codes = pd.factorize(pd.MultiIndex.from_arrays([junction, upstream]))[0]
+        volume_sum = np.zeros((group_codes.max() + 1 if len(group_codes) > 0 else 0, self.time_bins.bin_num),
+                              dtype=np.int64)
+        np.add.at(volume_sum, group_codes, self.counts)
+        volume_sum = volume_sum[group_codes]
+
+        bin_num = self.time_bins.bin_num
+        turning = pd.DataFrame({"movement_id": np.repeat(self.movement_index.values, bin_num),
+                                "start_time": np.tile(self.time_bins.date_time_list, len(self.movement_index)),
+                                "volume": self.counts.ravel(),
+                                "upstream": np.repeat(upstream, bin_num),
+                                "junction": np.repeat(junction, bin_num),
+                                "downstream": np.repeat(links[2].values, bin_num),
+                                "volume_sum": volume_sum.ravel()})
+        turning["turning_ratio"] = np.divide(turning["volume"].values, turning["volume_sum"].values,
+                                             out=np.full(len(turning), np.nan), where=turning["volume_sum"].values > 0)
+        return turning
+
+    def get_demand_profile(self):
+        """
+        Hourly demand of the source links (not from any junction) in each time bin, same columns as demand.csv
+        with "start_time", averaged over the days
+
+        :return: `pandas.DataFrame`
+        """
+        turning = self.get_turning_profile()
+        # compared as numbers, the junction ids are read as float if the column has NaN
+        junctions = pd.to_numeric(pd.Series(list(self.junctions), dtype=object), errors="coerce").dropna().values
+        demand = turning.loc[~turning["upstream"].isin(junctions), ["upstream", "junction", "start_time", "volume_sum"]]
+        # one row per source link and time bin
+        demand = demand.drop_duplicates(subset=["upstream", "junction", "start_time"]).drop(columns="junction")
+        demand["volume_sum"] = demand["volume_sum"] * 60.0 / (self.time_bins.resolution * self.day_num)
+        return demand.rename(columns={"upstream": "downstream", "volume_sum": "vph"}).reset_index(drop=True)
+
+    def write_ctm_inputs(self, stat_lanesets, stat_connections, output_folder="calibration"):
+        """
+        Time-of-day laneset_demand.csv and laneset_connection.csv, the rows of each time bin are marked
+        by the "start_time" column
+
+        :param stat_lanesets: csv of the static lanesets
+        :param stat_connections: csv of the static connections
+        :param output_folder: str
+        :return: None
+        """
+        laneset_info = pd.read_csv(stat_lanesets)
+        connections = pd.read_csv(stat_connections)
+        turning = self.get_turning_profile()
+        demand = self.get_demand_profile()
+        demand_list, connection_list = [], []
+        for start_time in self.time_bins.date_time_list:
+            bin_demand = demand.loc[demand["start_time"] == start_time, ["downstream", "vph"]]
+            demand_list.append(get_laneset_demand(laneset_info, bin_demand).assign(start_time=start_time))
+            bin_turning = turning.loc[turning["start_time"] == start_time, ["movement_id", "volume"]]
+            connection_list.append(get_laneset_connection(connections, bin_turning).assign(start_time=start_time))
+        os.makedirs(output_folder, exist_ok=True)
+        pd.concat(demand_list, ignore_index=True).to_csv(os.path.join(output_folder, "laneset_demand.csv"),
+                                                         index=None)
+        pd.concat(connection_list, ignore_index=True).to_csv(os.path.join(output_folder, "laneset_connection.csv"),
+                                                             index=None)
+
+
+def demand_and_turning_calibration(file, period_hours=0.25, day_column=None):
+    traj_data = pd.read_csv(file)
+    turning, demand = get_turning_and_demand(traj_data, period_hours, day_column)
+    turning.to_csv("./output/turning.csv", index=None)
+    demand.to_csv('./output/demand.csv', index=None)
 
 
 if __name__ == "__main__":
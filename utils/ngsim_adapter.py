@@ -1,40 +1,241 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+
 import numpy as np
 import pandas as pd
 from pyproj import Transformer
 from mtldp.adapters.adapter_base import TrajectoryAdapterBase
 
+FEET2METER = 0.3048
+DEFAULT_CHUNKSIZE = 1000000
+MERGE_KEYS = ['veh_id', 'timestamp']
+
+# columns needed by the trajectory processing, None in `NgsimTrajectoryAdapter` to read all the columns
+NGSIM_COLUMNS = ['Vehicle_ID', 'Global_Time', 'Global_X', 'Global_Y', 'v_Vel']
+NGSIM_DTYPES = {'Vehicle_ID': np.int32, 'Frame_ID': np.int32, 'Total_Frames': np.int32, 'Global_Time': np.int64,
+                'Local_X': np.float32, 'Local_Y': np.float32, 'Global_X': np.float64, 'Global_Y': np.float64,
+                'v_Length': np.float32, 'v_Width': np.float32, 'v_Class': np.int8, 'v_Vel': np.float32,
+                'v_Acc': np.float32, 'Lane_ID': np.int16, 'Origin_Zone': np.int16, 'Destination_Zone': np.int16,
+                'Int_ID': np.int16, 'Section_ID': np.int16, 'Direction': np.int8, 'Movement': np.int8,
+                'Preceding': np.int32, 'Following': np.int32, 'Space_Headway': np.float32,
+                'Time_Headway': np.float32}
+
+
+class PointDecimator(object):
+    """
+    Keep one point per vehicle per time interval: the first point of each vehicle in each interval, the intervals
+    are aligned to the clock (``floor(timestamp / interval)``). The decimator is applied to the chunks one by one
+    and remembers the last interval of each vehicle, so that the interval of a vehicle split by the chunk
+    boundary is not kept twice.
+    """
+
+    def __init__(self, interval, id_column='veh_id', timestamp_column='timestamp'):
+        """
+
+        :param interval: time interval (second)
+        :param id_column: vehicle (trajectory) id column
+        :param timestamp_column: timestamp column
+        """
+        self.interval = interval
+        self.id_column = id_column
+        self.timestamp_column = timestamp_column
+        self._last_bins = {}
+
+    def __call__(self, df):
+        """
+
+        :param df: `pandas.DataFrame` sorted by vehicle and timestamp
+        :return: `pandas.DataFrame` of the kept points
+        """
+        if len(df) == 0:
+            return df
+        vehicles = df[self.id_column].values
+        # rounded so that the timestamp at the start of the interval is not floored to the previous one
+        bins = np.floor(np.round(df[self.timestamp_column].values / self.interval, 6)).astype(np.int64)
+        new_vehicle = np.ones(len(df), dtype=bool)
+        new_vehicle[1:] = vehicles[1:] != vehicles[:-1]
+        keep = new_vehicle.copy()
+        keep[1:] |= bins[1:] != bins[:-1]
+
+        # the first interval of each vehicle might have been kept in the previous chunk
+        first_rows = np.flatnonzero(new_vehicle)
+        last_bins = np.array([self._last_bins.get(val, np.iinfo(np.int64).min) for val in vehicles[first_rows]])
+        keep[first_rows] = last_bins != bins[first_rows]
+
+        last_rows = np.append(first_rows[1:], len(df)) - 1
+        self._last_bins.update(zip(vehicles[last_rows], bins[last_rows]))
+        return df[keep]
+
 
 class NgsimTrajectoryAdapter(TrajectoryAdapterBase):
-    def __init__(self):
-        self.dtype_dict = {'Vehicle_ID': str}
+    def __init__(self, usecols=NGSIM_COLUMNS, chunksize=DEFAULT_CHUNKSIZE, decimate_interval=None):
+        """
+
+        :param usecols: list of the raw columns to read, None for all the columns
+        :param chunksize: number of rows of each chunk in :meth:`iter_load`
+        :param decimate_interval: keep one point per vehicle per interval (second), see :class:`PointDecimator`,
+            None to keep all the points
+        """
+        self.usecols = usecols
+        self.chunksize = chunksize
+        self.decimate_interval = decimate_interval
+        self.dtype_dict = dict(NGSIM_DTYPES)
 
         self.attribute_map = {'Vehicle_ID': 'veh_id',
                               'v_Vel': 'speed'}
+        self._transformer = None
+
+    def __getstate__(self):
+        # the transformer is rebuilt in the worker process
+        state = self.__dict__.copy()
+        state['_transformer'] = None
+        return state
+
+    def load(self, file_list: list, processes=1):
+        """
+        Load all the files into one DataFrame sorted by vehicle and time, see :meth:`iter_load`
+        to process a large file with bounded memory
+
+        :param file_list: list of NGSIM csv files
+        :param processes: number of processes to parse the files, see :meth:`iter_load_parallel`
+        """
+        if processes is not None and processes <= 1:
+            df_combine = pd.concat(list(self.iter_load(file_list)), ignore_index=True)
+            return df_combine.sort_values(by=MERGE_KEYS, kind='stable', ignore_index=True)
+        return pd.concat(list(self.iter_load_parallel(file_list, processes)), ignore_index=True)
+
+    def iter_load_parallel(self, file_list: list, processes=None, merge_chunksize=None, temp_folder=None):
+        """
+        Parse the files concurrently in a process pool and yield the points of all the files merged by
+        ``(veh_id, timestamp)``. Each worker sorts one file and spills it to a temporary folder, the sorted files
+        are memory-mapped and merged block by block, so the peak memory is about one file per worker.
 
-    def load(self, file_list: list):
-        df_list = []
-        feet2meter = 0.3048
-        # 'epsg:2240' is for Georgia West State Plane in NAD83
-        trans = Transformer.from_crs('epsg:2240', 'epsg:4326')
+        :param file_list: list of NGSIM csv files
+        :param processes: size of the process pool, default the number of CPUs
+        :param merge_chunksize: rows read from each sorted file per merge step, default ``.chunksize``
+        :param temp_folder: parent folder of the temporary files, default the system temporary folder
+        :return: generator of `pandas.DataFrame`
+        """
+        merge_chunksize = self.chunksize if merge_chunksize is None else merge_chunksize
+        run_root = tempfile.mkdtemp(prefix='ngsim_', dir=temp_folder)
+        try:
+            tasks = [(self, file, os.path.join(run_root, f'run-{idx:05d}')) for idx, file in enumerate(file_list)]
+            processes = min(len(tasks), processes or os.cpu_count() or 1)
+            with multiprocessing.Pool(max(processes, 1)) as pool:
+                run_list = pool.map(_sort_file_to_run, tasks)
+            for df in _merge_sorted_runs([_open_run(*run) for run in run_list], merge_chunksize):
+                yield df
+        finally:
+            shutil.rmtree(run_root, ignore_errors=True)
+
+    def iter_load(self, file_list: list, chunksize=None):
+        """
+        Read the files chunk by chunk and yield the converted (and decimated) DataFrame of each chunk. Each chunk
+        is sorted by vehicle and time, the chunks follow the row order of the files.
+
+        :param file_list: list of NGSIM csv files
+        :param chunksize: number of rows of each chunk, default ``.chunksize``
+        :return: generator of `pandas.DataFrame`
+        """
+        chunksize = self.chunksize if chunksize is None else chunksize
         for file in file_list:
-            df = pd.read_csv(file, dtype=self.dtype_dict)
-            df = df.rename(columns=self.attribute_map)
-            df = df.sort_values(by=['veh_id', 'Global_Time'])
-            df = df.drop(columns=[])
-            df['timestamp'] = df['Global_Time'] * 0.001
-            global_x_list = df['Global_X']
-            global_y_list = df['Global_Y']
-
-            gps_x_list = []
-            gps_y_list = []
-            for (x, y) in zip(global_x_list, global_y_list):
-                gps_x, gps_y = trans.transform(x, y)
-                gps_x_list.append(gps_x)
-                gps_y_list.append(gps_y)
-            df['longitude'] = gps_y_list
-            df['latitude'] = gps_x_list
-            df['speed'] = df['speed'] * feet2meter
-            df_list.append(df)
-        df_combine = pd.concat(df_list, ignore_index=True)
-        df_combine['trip_id'] = df_combine['veh_id']
-        return df_combine
+            decimator = None if self.decimate_interval is None else PointDecimator(self.decimate_interval)
+            reader = pd.read_csv(file, usecols=self.usecols, dtype=self.dtype_dict, chunksize=chunksize)
+            for chunk in reader:
+                chunk = self.convert_chunk(chunk)
+                yield chunk if decimator is None else decimator(chunk)
+
+    def convert_chunk(self, df):
+        """
+        Rename the columns, add the timestamp and transform the coordinates of a raw chunk, the whole
+        chunk is transformed at once
+
+        :param df: `pandas.DataFrame` of the raw NGSIM columns
+        :return: `pandas.DataFrame`
+        """
+        df = df.rename(columns=self.attribute_map)
+        # the vehicle id is read as integer and each unique id is converted to string once
+        veh_codes, veh_uniques = pd.factorize(df['veh_id'])
+        df['veh_id'] = np.asarray(veh_uniques.astype(str), dtype=object)[veh_codes]
+        df = df.sort_values(by=['veh_id', 'Global_Time'], kind='stable', ignore_index=True)
+        df['timestamp'] = df['Global_Time'] * 0.001
+
+        # 'epsg:2240' is for Georgia West State Plane in NAD83, the output is (latitude, longitude)
+        latitude, longitude = self.transformer.transform(df['Global_X'].values, df['Global_Y'].values)
+        df['longitude'] = longitude
+        df['latitude'] = latitude
+        if 'speed' in df.columns:
+            df['speed'] = df['speed'] * np.float32(FEET2METER)
+        df['trip_id'] = df['veh_id']
+        return df
+
+    @property
+    def transformer(self):
+        if self._transformer is None:
+            self._transformer = Transformer.from_crs('epsg:2240', 'epsg:4326')
+        return self._transformer
+
+
+def _sort_file_to_run(task):
+    """
+    Worker of :meth:`NgsimTrajectoryAdapter.iter_load_parallel`: load one file, sort it by the merge keys and
+    save each column as ``.npy`` (fixed-width strings for the text columns)
+
+    :param task: (adapter, file, run folder)
+    :return: run folder, list of columns
+    """
+    adapter, file, run_folder = task
+    df = pd.concat(list(adapter.iter_load([file])), ignore_index=True)
+    df = df.sort_values(by=MERGE_KEYS, kind='stable', ignore_index=True)
+    os.makedirs(run_folder, exist_ok=True)
+    for column in df.columns:
+        values = df[column].to_numpy()
+        if not pd.api.types.is_numeric_dtype(df[column]):
+            values = np.asarray(values, dtype=str)
+        np.save(os.path.join(run_folder, f'{column}.npy'), values)
+    return run_folder, list(df.columns)
+
+
+def _open_run(run_folder, columns):
+    return {column: np.load(os.path.join(run_folder, f'{column}.npy'), mmap_mode='r') for column in columns}
+
+
+def _merge_sorted_runs(run_list, chunksize):
+    """
+    Block-wise k-way merge of the sorted runs: a block of ``chunksize`` rows is taken from each run, and only the
+    rows not after the smallest last key of the incomplete blocks are emitted, these rows cannot be preceded by
+    any row not read yet.
+
+    :param run_list: list of dict {column: array}, each sorted by ``MERGE_KEYS``
+    :param chunksize: int
+    :return: generator of `pandas.DataFrame`
+    """
+    id_column, time_column = MERGE_KEYS
+    lengths = [len(run[id_column]) for run in run_list]
+    positions = [0] * len(run_list)
+    while True:
+        active = [idx for idx in range(len(run_list)) if positions[idx] < lengths[idx]]
+        if len(active) == 0:
+            break
+        block_ends = {idx: min(positions[idx] + chunksize, lengths[idx]) for idx in active}
+        frontier_list = [(run_list[idx][id_column][block_ends[idx] - 1],
+                          run_list[idx][time_column][block_ends[idx] - 1])
+                         for idx in active if block_ends[idx] < lengths[idx]]
+        frontier = min(frontier_list) if len(frontier_list) > 0 else None
+
+        piece_list = []
+        for idx in active:
+            start, end = positions[idx], block_ends[idx]
+            if frontier is not None:
+                vehicles = run_list[idx][id_column][start:end]
+                timestamps = run_list[idx][time_column][start:end]
+                not_after = (vehicles < frontier[0]) | ((vehicles == frontier[0]) & (timestamps <= frontier[1]))
+                end = start + int(np.sum(not_after))
+            if end > start:
+                piece_list.append(pd.DataFrame({column: np.asarray(values[start:end])
+                                                for column, values in run_list[idx].items()}))
+            positions[idx] = end
+        df = pd.concat(piece_list, ignore_index=True)
+        yield df.sort_values(by=MERGE_KEYS, kind='stable', ignore_index=True)
@@ -0,0 +1,211 @@
+"""
+Columnar on-disk cache of the raw trajectory points
+
+The points are partitioned by the local date and time window of their timestamp::
+
+    cache_folder/
+        metadata.json
+        date=1970-01-14/window=0815/part-00000.parquet   (or part-00000/{column}.npy without pyarrow)
+
+``metadata.json`` keeps the row number and the min/max statistics of the numeric columns of each part, so that a
+load only opens the parts overlapping the requested time range and reads the requested columns. Without pyarrow
+each column is saved as a ``.npy`` file and memory-mapped when loading.
+"""
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from cores.utils.time_utils import DEFAULT_TIMEZONE, floor_local_timestamp, get_local_date, get_local_seconds
+
+try:
+    import pyarrow  # noqa: F401
+except ImportError:
+    pyarrow = None
+
+METADATA_FILE = "metadata.json"
+
+
+class TrajectoryCache(object):
+    """
+    Partitioned columnar cache
+
+    **Main Attributes**
+        - ``.cache_folder``: root folder of the cache
+        - ``.file_format``: "parquet" or "npy"
+        - ``.window_minute``: time window of the partitions (minute)
+        - ``.timezone_name``: timezone of the partition date and window
+        - ``.timestamp_column``: column of the unix timestamp
+        - ``.columns``: columns of the cached points
+        - ``.parts``: list of dict, the metadata of each part
+    """
+
+    def __init__(self, cache_folder, window_minute=60, timezone_name=DEFAULT_TIMEZONE, file_format=None):
+        """
+        Open the cache folder, the settings of an existing cache are loaded from its metadata
+
+        :param cache_folder: str
+        :param window_minute: time window of the partitions (minute)
+        :param timezone_name: timezone of the partition date and window
+        :param file_format: "parquet" or "npy", default "parquet" if pyarrow is installed
+        """
+        self.cache_folder = cache_folder
+        self.window_minute = window_minute
+        self.timezone_name = timezone_name
+        self.file_format = file_format if file_format is not None else ("npy" if pyarrow is None else "parquet")
+        self.timestamp_column = "timestamp"
+        self.columns = None
+        self.parts = []
+        if self.exists():
+            with open(os.path.join(cache_folder, METADATA_FILE), "r") as temp_file:
+                metadata = json.load(temp_file)
+            self.window_minute = metadata["window_minute"]
+            self.timezone_name = metadata["timezone_name"]
+            self.file_format = metadata["file_format"]
+            self.timestamp_column = metadata["timestamp_column"]
+            self.columns = metadata["columns"]
+            self.parts = metadata["parts"]
+        if self.file_format == "parquet" and pyarrow is None:
+            raise ImportError("pyarrow is required to read or write the parquet cache")
+
+    def exists(self):
+        return os.path.exists(os.path.join(self.cache_folder, METADATA_FILE))
+
+    def write(self, df_iter, timestamp_column="timestamp", overwrite=False):
+        """
+        Write the DataFrames (e.g., the chunks of :meth:`utils.ngsim_adapter.NgsimTrajectoryAdapter.iter_load`)
+        into the cache, each DataFrame is split into the partitions and appended as new parts
+
+        :param df_iter: iterable of `pandas.DataFrame` (or a single DataFrame)
+        :param timestamp_column: column of the unix timestamp
+        :param overwrite: True to remove the existing cache first
+        :return: None
+        """
+        if overwrite and os.path.exists(self.cache_folder):
+            shutil.rmtree(self.cache_folder)
+            self.parts, self.columns = [], None
+        elif len(self.parts) > 0 and timestamp_column != self.timestamp_column:
+            raise ValueError(f"the cache is partitioned by {self.timestamp_column}")
+        self.timestamp_column = timestamp_column
+        os.makedirs(self.cache_folder, exist_ok=True)
+        if isinstance(df_iter, pd.DataFrame):
+            df_iter = [df_iter]
+
+        for df in df_iter:
+            if self.columns is None:
+                self.columns = list(df.columns)
+            elif list(df.columns) != self.columns:
+                raise ValueError(f"columns {list(df.columns)} are different from the cache columns {self.columns}")
+            window_start = floor_local_timestamp(np.floor(df[timestamp_column].values), self.window_minute,
+                                                 self.timezone_name)
+            window_codes, window_uniques = pd.factorize(window_start)
+            partition_order = np.argsort(window_codes, kind="stable")
+            split_index = np.flatnonzero(np.diff(window_codes[partition_order])) + 1
+            unique_dates = get_local_date(window_uniques, self.timezone_name)
+            unique_minutes = np.mod(get_local_seconds(window_uniques, self.timezone_name), 86400) // 60
+
+            for rows in np.split(partition_order, split_index):
+                if len(rows) == 0:
+                    continue
+                code = window_codes[rows[0]]
+                window = f"{int(unique_minutes[code] // 60):02d}{int(unique_minutes[code] % 60):02d}"
+                self._write_part(df.iloc[rows], unique_dates[code], window)
+        self._save_metadata()
+
+    def load(self, columns=None, start_timestamp=None, end_timestamp=None, date_list=None):
+        """
+        Load the points within the time range, only the overlapping parts and the given columns are read
+
+        :param columns: list of columns, None for all the columns
+        :param start_timestamp: include the points with timestamp >= start_timestamp
+        :param end_timestamp: include the points with timestamp < end_timestamp
+        :param date_list: list of local dates "yyyy-mm-dd", None for all the dates
+        :return: `pandas.DataFrame`
+        """
+        if not self.exists():
+            raise FileNotFoundError(f"no trajectory cache in {self.cache_folder}")
+        columns = self.columns if columns is None else list(columns)
+        time_filter = start_timestamp is not None or end_timestamp is not None
+        read_columns = columns
+        if time_filter and self.timestamp_column not in columns:
+            read_columns = columns + [self.timestamp_column]
+
+        df_list = []
+        for part in self.select_parts(start_timestamp, end_timestamp, date_list):
+            df = self._read_part(part, read_columns)
+            if time_filter:
+                timestamp = df[self.timestamp_column].values
+                keep = np.ones(len(df), dtype=bool)
+                if start_timestamp is not None:
+                    keep &= timestamp >= start_timestamp
+                if end_timestamp is not None:
+                    keep &= timestamp < end_timestamp
+                if not np.all(keep):
+                    df = df[keep]
+            df_list.append(df[columns])
+        if len(df_list) == 0:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(df_list, ignore_index=True)
+
+    def select_parts(self, start_timestamp=None, end_timestamp=None, date_list=None):
+        """
+        Parts overlapping the time range according to the min/max statistics
+
+        :return: list of dict
+        """
+        selected_parts = []
+        for part in self.parts:
+            min_timestamp, max_timestamp = part["stats"][self.timestamp_column]
+            if start_timestamp is not None and max_timestamp < start_timestamp:
+                continue
+            if end_timestamp is not None and min_timestamp >= end_timestamp:
+                continue
+            if date_list is not None and part["date"] not in date_list:
+                continue
+            selected_parts.append(part)
+        return selected_parts
+
+    def get_dates(self):
+        return sorted(set(part["date"] for part in self.parts))
+
+    def _write_part(self, df, date, window):
+        part_name = f"part-{len(self.parts):05d}"
+        partition = f"date={date}/window={window}"
+        partition_folder = os.path.join(self.cache_folder, partition)
+        os.makedirs(partition_folder, exist_ok=True)
+        if self.file_format == "parquet":
+            file_name = os.path.join(partition, part_name + ".parquet")
+            df.to_parquet(os.path.join(self.cache_folder, file_name), index=False)
+        else:
+            file_name = os.path.join(partition, part_name)
+            os.makedirs(os.path.join(self.cache_folder, file_name), exist_ok=True)
+            for column in df.columns:
+                values = df[column].to_numpy()
+                if not (pd.api.types.is_numeric_dtype(df[column]) or pd.api.types.is_bool_dtype(df[column])):
+                    # fixed-width strings so that the column can be memory-mapped
+                    values = np.asarray(values, dtype=str)
+                np.save(os.path.join(self.cache_folder, file_name, column + ".npy"), values)
+
+        stats = {}
+        for column in df.columns:
+            if pd.api.types.is_numeric_dtype(df[column]) and not pd.api.types.is_bool_dtype(df[column]) \
+                    and len(df) > 0:
+                stats[column] = [float(np.nanmin(df[column].values)), float(np.nanmax(df[column].values))]
+        self.parts.append({"file": file_name.replace(os.sep, "/"), "date": date, "window": window,
+                           "row_num": len(df), "stats": stats})
+
+    def _read_part(self, part, columns):
+        file_name = os.path.join(self.cache_folder, part["file"])
+        if self.file_format == "parquet":
+            return pd.read_parquet(file_name, columns=columns)
+        return pd.DataFrame({column: np.load(os.path.join(file_name, column + ".npy"), mmap_mode="r")
+                             for column in columns})
+
+    def _save_metadata(self):
+        metadata = {"window_minute": self.window_minute, "timezone_name": self.timezone_name,
+                    "file_format": self.file_format, "timestamp_column": self.timestamp_column,
+                    "columns": self.columns, "parts": self.parts}
+        with open(os.path.join(self.cache_folder, METADATA_FILE), "w") as temp_file:
+            json.dump(metadata, temp_file, indent=2)